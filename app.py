@@ -1,86 +1,45 @@
+import time
+
+# Start of this script run, for the time-to-first-paint metric
+SCRIPT_STARTED = time.perf_counter()
+
 import streamlit as st
-import google.generativeai as genai
 from dotenv import load_dotenv
+import importlib
 import os
-from audio_recorder_streamlit import audio_recorder
-import speech_recognition as sr
-import io
-import tempfile
-import edge_tts
-import asyncio
-
-# Load environment variables
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+# Load environment variables (before the modules below read their settings)
 load_dotenv()
 
-# Configure Gemini API
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-# Language configurations
-LANGUAGES = {
-    "English": {
-        "code": "en",
-        "stt_code": "en-US",
-        "tts_voice": "en-US-JennyNeural",
-        "flag": "🇺🇸",
-        "ai_instruction": "Respond in English."
-    },
-    "Spanish": {
-        "code": "es",
-        "stt_code": "es-ES",
-        "tts_voice": "es-ES-ElviraNeural",
-        "flag": "🇪🇸",
-        "ai_instruction": "Responde en español. (Respond in Spanish.)"
-    },
-    "French": {
-        "code": "fr",
-        "stt_code": "fr-FR",
-        "tts_voice": "fr-FR-DeniseNeural",
-        "flag": "🇫🇷",
-        "ai_instruction": "Réponds en français. (Respond in French.)"
-    },
-    "Chinese (Mandarin)": {
-        "code": "zh",
-        "stt_code": "zh-CN",
-        "tts_voice": "zh-CN-XiaoxiaoNeural",
-        "flag": "🇨🇳",
-        "ai_instruction": "用中文回复。(Respond in Mandarin Chinese.)"
-    },
-    "Japanese": {
-        "code": "ja",
-        "stt_code": "ja-JP",
-        "tts_voice": "ja-JP-NanamiNeural",
-        "flag": "🇯🇵",
-        "ai_instruction": "日本語で返答してください。(Respond in Japanese.)"
-    }
-}
-
-# Personality prompts
-PERSONALITIES = {
-    "General Assistant": {
-        "name": "General Assistant",
-        "prompt": "You are a helpful and friendly AI assistant. Provide clear, accurate, and helpful responses to any questions or tasks.",
-        "icon": "🤖",
-        "description": "A versatile AI helper for all your questions"
-    },
-    "Study Buddy": {
-        "name": "Study Buddy",
-        "prompt": "You are a patient and encouraging study companion. Help users learn by explaining concepts clearly, providing examples, and asking questions to check understanding. Break down complex topics into digestible parts.",
-        "icon": "📚",
-        "description": "Your patient learning companion"
-    },
-    "Fitness Coach": {
-        "name": "Fitness Coach",
-        "prompt": "You are an enthusiastic and motivating fitness coach. Provide workout advice, nutrition tips, and encouragement. Focus on health, safety, and sustainable fitness habits. Always remind users to consult healthcare professionals for medical concerns.",
-        "icon": "💪",
-        "description": "Your motivating fitness partner"
-    },
-    "Gaming Helper": {
-        "name": "Gaming Helper",
-        "prompt": "You are an experienced gaming enthusiast. Help with game strategies, tips, walkthroughs, and recommendations. Be excited about gaming while providing practical advice.",
-        "icon": "🎮",
-        "description": "Your gaming strategy advisor"
-    }
-}
+# Provider SDKs (Gemini, speech recognition, Edge TTS, the recorder component)
+# are imported on first use rather than here, so the page paints first
+from audio_formats import encode_audio, get_output_format, join_encoded, mime_type, negotiate_format, submit_encode
+from audio_player import queued_player
+from audio_store import get_audio_store
+from chat_context import SUMMARY_INSTRUCTION, ConversationContext, history_tokens, summarize_turns
+from conversation_store import conversation_store_enabled, get_conversation_store
+from metrics import record, recent_spans, span
+from personas import LANGUAGES, PERSONALITIES, system_instruction
+from prefetch import get_prefetcher, prefetch_enabled
+from response_cache import get_response_cache, response_cache_enabled
+from scheduler import Overloaded, RateLimited, get_scheduler
+from tts import SpeechStream, cached_tts_audio
+from tts_cache import get_tts_cache
+from warmup import FIXED_PHRASES, fixed_phrase, last_report, load_phrases, run_warmup, warmup_enabled
+
+# Only the newest HISTORY_PAGE_SIZE messages are rendered on each rerun (older
+# ones load a page at a time on request) and only the newest EAGER_AUDIO_REPLIES
+# replies ship their audio with the page; older players load when asked for
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+EAGER_AUDIO_REPLIES = int(os.getenv("EAGER_AUDIO_REPLIES", "3"))
+
+# Stream Gemini replies token by token and speak finished sentences while the
+# model is still generating (set STREAM_RESPONSES=false to wait for the full reply)
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() not in ("0", "false", "no")
 
 # Page configuration
 st.set_page_config(
@@ -219,167 +178,279 @@ if "language" not in st.session_state:
 if "transcribed_text" not in st.session_state:
     st.session_state.transcribed_text = ""
 
-# TTS session state variables
+# TTS session state variables; the audio itself lives in the session audio store
 if "tts_audio" not in st.session_state:
-    st.session_state.tts_audio = {}  # Store generated audio by message index
+    st.session_state.tts_audio = {}  # Store audio handles by message index
 
 if "processing" not in st.session_state:
     st.session_state.processing = False
 
-if "last_audio_bytes" not in st.session_state:
-    st.session_state.last_audio_bytes = None
+# Digest of the last processed recording (the audio itself is not kept)
+if "last_audio_digest" not in st.session_state:
+    st.session_state.last_audio_digest = None
 
 if "last_transcription" not in st.session_state:
     st.session_state.last_transcription = None
 
-# Function to transcribe audio
-def transcribe_audio(audio_bytes, language_code="en-US"):
-    """Convert audio bytes to text using speech recognition"""
-    if audio_bytes is None:
-        return None
-
-    try:
-        # Initialize recognizer
-        recognizer = sr.Recognizer()
-
-        # The audio_recorder returns WAV format audio
-        # We need to use AudioFile to properly read it
-        audio_file = io.BytesIO(audio_bytes)
-
-        with sr.AudioFile(audio_file) as source:
-            # Read the audio data from the file
-            audio_data = recognizer.record(source)
-
-        # Recognize speech using Google Speech Recognition with specified language
-        text = recognizer.recognize_google(audio_data, language=language_code)
-        return text
-    except sr.UnknownValueError:
-        return None  # Return None so we can show a better message
-    except sr.RequestError as e:
-        return f"Speech service error: {e}"
-    except Exception as e:
-        return f"Error: {str(e)}"
-
-# Function to generate TTS audio using Edge TTS with gTTS fallback
-def generate_tts_audio(text, voice="en-US-JennyNeural"):
-    """Convert text to speech using Edge TTS (with gTTS fallback) and return audio bytes"""
-    if not text or len(text.strip()) == 0:
-        return None
-
-    # Limit text length to avoid issues
-    max_length = 1000
-    if len(text) > max_length:
-        text = text[:max_length] + "..."
-
-    # Try Edge TTS first
-    tmp_filename = None
-    try:
-        # Create a temporary file to save the audio
-        with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as tmp_file:
-            tmp_filename = tmp_file.name
-
-        # Define async function to generate TTS
-        async def generate_audio():
-            communicate = edge_tts.Communicate(text, voice)
-            await communicate.save(tmp_filename)
-
-        # Run in a completely new event loop in a separate thread
-        import threading
-        import time
-
-        error_container = []
-        success = [False]
-
-        def run_async():
-            try:
-                new_loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(new_loop)
-                try:
-                    new_loop.run_until_complete(generate_audio())
-                    success[0] = True
-                finally:
-                    new_loop.close()
-            except Exception as e:
-                error_container.append(e)
-
-        thread = threading.Thread(target=run_async)
-        thread.start()
-        thread.join(timeout=15)  # 15 second timeout
-
-        if thread.is_alive():
-            raise Exception("Edge TTS timeout")
-
-        if error_container:
-            raise error_container[0]
-
-        if not success[0]:
-            raise Exception("Edge TTS failed without error")
-
-        # Small delay to ensure file is fully written
-        time.sleep(0.2)
-
-        # Verify the file was created and has content
-        if not os.path.exists(tmp_filename):
-            raise Exception("Audio file was not created")
-
-        file_size = os.path.getsize(tmp_filename)
-        if file_size == 0:
-            raise Exception("Audio file is empty")
-
-        # Read the audio file
-        with open(tmp_filename, 'rb') as f:
-            audio_data = f.read()
-
-        if len(audio_data) == 0:
-            raise Exception("No audio data read from file")
-
-        return audio_data
+# Running summary of older turns plus the recent turns sent to Gemini
+if "context" not in st.session_state:
+    st.session_state.context = ConversationContext()
+
+# How many of the newest messages the history shows, and which older replies
+# have had their audio player opened
+if "history_limit" not in st.session_state:
+    st.session_state.history_limit = HISTORY_PAGE_SIZE
+
+if "audio_opened" not in st.session_state:
+    st.session_state.audio_opened = set()
+
+# Identifies this session's entries in the latency panel
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:12]
+
+# Conversations are saved to the conversation store and resumed from their URL
+# (?chat=<id>) after a refresh or restart. Only the newest page of messages is
+# loaded; history_offset is the number of older messages still in the store and
+# turns_before the completed turns among them. Message indices used as keys
+# (tts_audio, audio_opened) count from the start of the conversation.
+def start_conversation():
+    """Begin a new, empty conversation"""
+    st.session_state.conversation_id = uuid.uuid4().hex
+    st.session_state.history_offset = 0
+    st.session_state.turns_before = 0
+    st.session_state.saved_messages = 0
+    if conversation_store_enabled():
+        # Reply audio of saved conversations stays on disk for a resume
+        st.session_state.session_audio = get_audio_store().session(st.session_state.conversation_id,
+                                                                   persistent=True)
+        st.query_params["chat"] = st.session_state.conversation_id
+
+def load_messages(before):
+    """Read the page of stored messages preceding message number before
+    into the conversation; returns the index of the first message loaded"""
+    conversation_id = st.session_state.conversation_id
+    store = get_conversation_store()
+    offset, page = store.page(conversation_id, before=before, limit=HISTORY_PAGE_SIZE)
+    turns_before = store.completed_turns(conversation_id, offset)
+    audio = {offset + i: handle for i, (_, handle) in enumerate(page) if handle}
+    st.session_state.session_audio.restore(list(audio.values()))
+    st.session_state.messages[:0] = [message for message, _ in page]
+    st.session_state.tts_audio.update(audio)
+    # The summary covers fewer of the loaded turns now that older ones are loaded
+    st.session_state.context.summarized_turns += st.session_state.turns_before - turns_before
+    st.session_state.history_offset = offset
+    st.session_state.turns_before = turns_before
+    return offset
+
+def resume_conversation(conversation_id):
+    """Load the newest page of a stored conversation; returns False if there is none"""
+    conversation = get_conversation_store().load(conversation_id) if conversation_id else None
+    if (conversation is None or conversation["personality"] not in PERSONALITIES
+            or conversation["language"] not in LANGUAGES):
+        return False
+    st.session_state.personality = conversation["personality"]
+    st.session_state.language = conversation["language"]
+    st.session_state.conversation_id = conversation_id
+    st.session_state.session_audio = get_audio_store().session(conversation_id, persistent=True)
+    st.session_state.context = ConversationContext()
+    st.session_state.context.summary = conversation["summary"]
+    st.session_state.context.summarized_turns = conversation["summarized_turns"]
+    st.session_state.turns_before = 0
+    st.session_state.history_offset = conversation["messages"]
+    st.session_state.saved_messages = conversation["messages"]
+    offset = load_messages(None)
+    # Turns not yet folded into the summary are sent to Gemini verbatim, so load them too
+    while offset and st.session_state.context.summarized_turns < 0:
+        offset = load_messages(offset)
+    return True
+
+def persist_messages():
+    """Queue the messages not saved yet; they are written off the request path"""
+    if not conversation_store_enabled():
+        return
+    store = get_conversation_store()
+    offset = st.session_state.history_offset
+    for index in range(st.session_state.saved_messages, offset + len(st.session_state.messages)):
+        store.save_message(st.session_state.conversation_id, st.session_state.personality,
+                           st.session_state.language, index, st.session_state.messages[index - offset],
+                           st.session_state.tts_audio.get(index))
+    st.session_state.saved_messages = offset + len(st.session_state.messages)
+
+def reset_conversation(delete=False):
+    """Start a new conversation; the old one stays resumable unless deleted"""
+    if delete and conversation_store_enabled():
+        get_conversation_store().delete(st.session_state.conversation_id)
+    if delete or not conversation_store_enabled():
+        st.session_state.session_audio.clear()
+    st.session_state.messages = []
+    st.session_state.tts_audio = {}  # Clear TTS audio handles
+    st.session_state.context = ConversationContext()
+    st.session_state.history_limit = HISTORY_PAGE_SIZE
+    st.session_state.audio_opened = set()
+    start_conversation()
+
+# Reply audio is spilled to disk under a per-session quota and deleted when the
+# session ends (or, for saved conversations, when it has not been played for a while)
+if "session_audio" not in st.session_state and not conversation_store_enabled():
+    st.session_state.session_audio = get_audio_store().session(st.session_state.session_id)
+
+if "conversation_id" not in st.session_state:
+    if not (conversation_store_enabled() and resume_conversation(st.query_params.get("chat"))):
+        start_conversation()
+
+# Encoding of the audio sent to this browser (deployment default, Save-Data, Safari)
+if "audio_format" not in st.session_state:
+    st.session_state.audio_format = negotiate_format(st.context.headers)
+
+def span_tags():
+    """Return the latency span tags for the current session"""
+    return {
+        "session": st.session_state.session_id,
+        "personality": st.session_state.personality,
+        "language": st.session_state.language,
+        "voice": LANGUAGES[st.session_state.language]["tts_voice"],
+    }
 
-    except Exception as edge_error:
-        # Edge TTS failed, try gTTS as fallback
+# The Gemini client is imported and configured once per process, on first use
+@st.cache_resource
+def get_genai():
+    """Import and configure the Gemini client"""
+    with span("provider_init"):
+        import google.generativeai as genai
+
+        # Configure Gemini API
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    return genai
+
+# Import the provider SDKs on a background thread once the first page has been
+# sent, so the first prompt or recording does not pay for the imports either.
+# With WARMUP=true the thread then warms every model, voice and fixed phrase.
+def _preload_providers():
+    for module in ("google.generativeai", "stt", "edge_tts", "audio_recorder_streamlit"):
         try:
-            # Extract language code from voice (e.g., "en-US-JennyNeural" -> "en")
-            lang_code = voice.split('-')[0] if '-' in voice else 'en'
-
-            # Use gTTS as fallback
-            from gtts import gTTS
-            import time
-
-            # Add small delay to avoid rate limiting
-            time.sleep(0.5)
-
-            tts = gTTS(text=text, lang=lang_code, slow=False)
-
-            # Create new temp file for gTTS
-            if tmp_filename and os.path.exists(tmp_filename):
-                try:
-                    os.unlink(tmp_filename)
-                except:
-                    pass
-
-            with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as tmp_file:
-                tmp_filename = tmp_file.name
-
-            tts.save(tmp_filename)
-
-            # Read the audio file
-            with open(tmp_filename, 'rb') as f:
-                audio_data = f.read()
-
-            return audio_data
+            importlib.import_module(module)
+        except ImportError:
+            pass
+    if warmup_enabled():
+        language_codes = [config["code"] for config in LANGUAGES.values()]
+        run_warmup(
+            get_model,
+            [(personality, language) for personality in PERSONALITIES for language in LANGUAGES],
+            {config["code"]: config["tts_voice"] for config in LANGUAGES.values()},
+            load_phrases(language_codes),
+            output_format=get_output_format(),
+            ping=lambda: get_genai().get_model("models/gemini-2.5-flash"),
+        )
+
+@st.cache_resource
+def start_background_preload():
+    """Start the provider preloading thread once per process"""
+    thread = threading.Thread(target=_preload_providers, name="provider-preload", daemon=True)
+    thread.start()
+    return thread
+
+# Gemini models are created once per (personality, language) and shared by all sessions
+@st.cache_resource
+def get_model(personality, language):
+    """Return the Gemini model for a personality and language"""
+    genai = get_genai()
+    with span("model_create", personality=personality, language=language):
+        return genai.GenerativeModel(
+            'gemini-2.5-flash',
+            system_instruction=system_instruction(personality, language)
+        )
+
+@st.cache_resource
+def get_summary_model():
+    """Return the Gemini model used to fold old turns into the running summary"""
+    return get_genai().GenerativeModel(
+        'gemini-2.5-flash',
+        system_instruction=SUMMARY_INSTRUCTION
+    )
 
-        except Exception as gtts_error:
-            # Both TTS methods failed
-            return None
-    finally:
-        # Clean up temp file
-        if tmp_filename and os.path.exists(tmp_filename):
-            try:
-                import time
-                time.sleep(0.1)
-                os.unlink(tmp_filename)
-            except:
-                pass
+# Running summaries are updated on this pool, off the script thread, and
+# taken up at the start of the session's next turn
+@st.cache_resource
+def get_summary_pool():
+    """Return the process-wide pool that folds old turns into running summaries"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+
+def summarize_in_background(summary, turns):
+    """Fold turns into summary on the summary pool, in this session's Gemini lane; returns a Future"""
+    model = get_summary_model()
+    session = st.session_state.session_id
+
+    def summarize():
+        with get_scheduler().slot("gemini", session):
+            return summarize_turns(model, summary, turns)
+
+    return get_summary_pool().submit(summarize)
+
+def apply_summary():
+    """Take up a running summary finished since the last turn and save it"""
+    context = st.session_state.context
+    if context.apply_compaction() and conversation_store_enabled():
+        get_conversation_store().save_context(st.session_state.conversation_id, context.summary,
+                                              st.session_state.turns_before + context.summarized_turns)
+
+# Function to summarize per-turn latency for display
+def format_turn_metrics(metrics):
+    """Format time-to-first-token and time-to-first-audio as a caption"""
+    parts = []
+    if metrics.get("response_cache_hit"):
+        parts.append("cached reply")
+    if "time_to_first_token" in metrics:
+        parts.append(f"first token {metrics['time_to_first_token']:.2f}s")
+    if "time_to_first_audio" in metrics:
+        parts.append(f"first audio {metrics['time_to_first_audio']:.2f}s")
+    if metrics.get("tts_shed"):
+        parts.append("voice skipped, server busy")
+    return "⏱️ " + " · ".join(parts) if parts else ""
+
+# Function to speak a fixed reply; only pre-rendered audio is used, so error
+# paths never wait for synthesis
+def play_fixed_phrase(kind):
+    """Autoplay the cached audio of a fixed reply in the session's language"""
+    language = LANGUAGES[st.session_state.language]
+    audio_data = cached_tts_audio(fixed_phrase(kind, language["code"]), language["tts_voice"])
+    if audio_data:
+        audio_data, audio_format = encode_audio(audio_data, st.session_state.audio_format)
+        st.audio(audio_data, format=audio_format.mime, autoplay=True)
+
+# Function to voice, in the background and only with spare capacity, what this
+# user would hear first after switching to the language they are likely to pick next
+def schedule_voice_prefetch():
+    """Queue the fixed phrases and popular cached replies of the likely next languages"""
+    prefetcher = get_prefetcher()
+    for language in prefetcher.likely_languages(st.session_state.language, st.context.headers, LANGUAGES):
+        config = LANGUAGES[language]
+        texts = [fixed_phrase(kind, config["code"]) for kind in FIXED_PHRASES]
+        if response_cache_enabled():
+            texts += get_response_cache().top_responses(st.session_state.personality, language)
+        prefetcher.request(texts, config["tts_voice"], st.session_state.audio_format)
+
+# Function to read the text out of a (possibly streamed) Gemini response
+def response_text(response):
+    """Yield the text of each response chunk"""
+    for chunk in response:
+        try:
+            yield chunk.text
+        except ValueError:
+            continue  # Chunk without text parts (e.g. a safety stop)
+
+# Function to stream reply text while feeding finished sentences to TTS
+def stream_reply(text_chunks, speech, metrics, started, on_audio):
+    """Yield reply text as it arrives, submitting complete sentences for speech
+
+    on_audio(parts) is called after every piece of text with the audio chunks
+    that became ready, often none, so finished encodings can be shown too.
+    """
+    for text in text_chunks:
+        if "time_to_first_token" not in metrics:
+            metrics["time_to_first_token"] = time.perf_counter() - started
+        speech.feed(text)
+        on_audio(speech.poll())
+        yield text
 
 # Sidebar
 with st.sidebar:
@@ -398,8 +469,7 @@ with st.sidebar:
     # Update personality if changed
     if selected_personality != st.session_state.personality:
         st.session_state.personality = selected_personality
-        st.session_state.messages = []  # Clear chat history on personality change
-        st.session_state.tts_audio = {}  # Clear TTS audio cache
+        reset_conversation()  # Start a new conversation on personality change
         st.rerun()
 
     # Display current personality info
@@ -419,12 +489,15 @@ with st.sidebar:
         key="language_selector"
     )
 
-    # Update language if changed
+    # Update language if changed; the conversation and its audio are kept and
+    # only new replies use the new voice
     if selected_language != st.session_state.language:
+        if prefetch_enabled():
+            get_prefetcher().record_switch(st.session_state.language, selected_language)
         st.session_state.language = selected_language
-        st.session_state.messages = []  # Clear chat history on language change
-        st.session_state.tts_audio = {}  # Clear TTS audio cache
-        st.rerun()
+        if conversation_store_enabled():
+            get_conversation_store().save_settings(st.session_state.conversation_id,
+                                                   st.session_state.personality, selected_language)
 
     # Display current language info
     current_lang = LANGUAGES[st.session_state.language]
@@ -434,10 +507,48 @@ with st.sidebar:
 
     # Clear chat button
     if st.button("🗑️ Clear Chat History"):
-        st.session_state.messages = []
-        st.session_state.tts_audio = {}  # Clear TTS audio cache
+        reset_conversation(delete=True)
         st.rerun()
 
+    # Shared audio cache statistics
+    cache_stats = get_tts_cache().stats()
+    st.caption(
+        f"🔊 Audio cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+        f"{cache_stats['evictions']} evictions"
+    )
+    warmup_report = last_report()
+    if warmup_report:
+        st.caption(
+            f"🔥 Warm-up: {warmup_report['seconds']:.1f}s, {warmup_report['models']} models, "
+            f"{warmup_report['voices']} voices, {warmup_report['phrases']} phrases"
+        )
+    st.caption(f"💾 This chat's audio: {st.session_state.session_audio.size() / 1024:.0f} KB")
+
+    # Shared response cache statistics; only aggregates, since the cached
+    # prompts are other users' questions
+    if response_cache_enabled():
+        response_stats = get_response_cache().stats()
+        st.caption(f"💬 Response cache: {response_stats['hits']} hits, {response_stats['misses']} misses")
+
+    # Optional per-stage latency panel for this session
+    if st.toggle("📈 Show stage latencies", key="show_latency_panel"):
+        latest = recent_spans(session=st.session_state.session_id, limit=30)
+        if latest:
+            st.dataframe(
+                [
+                    {
+                        "stage": entry["stage"],
+                        "ms": round(entry["seconds"] * 1000),
+                        "outcome": entry["outcome"],
+                    }
+                    for entry in latest
+                ],
+                hide_index=True,
+                use_container_width=True,
+            )
+        else:
+            st.caption("No timings recorded yet.")
+
     st.markdown("---")
     st.markdown("### About")
     st.markdown("Powered by Google Gemini 2.5 Flash")
@@ -446,12 +557,15 @@ with st.sidebar:
 # Main chat interface
 st.title(f"{PERSONALITIES[st.session_state.personality]['icon']} {st.session_state.personality}")
 st.markdown("Ask me anything! I'm here to help.")
+record("first_paint", time.perf_counter() - SCRIPT_STARTED, session=st.session_state.session_id)
 
 # Voice input section
 st.markdown("### 🎤 Voice Input")
 col1, col2 = st.columns([1, 4])
 
 with col1:
+    from audio_recorder_streamlit import audio_recorder
+
     audio_bytes = audio_recorder(
         text="Click to record",
         recording_color="#ff1493",  # Deep pink when recording
@@ -462,12 +576,33 @@ with col1:
 
 with col2:
     # Only process if we have new audio (different from last processed)
-    if audio_bytes and audio_bytes != st.session_state.last_audio_bytes:
+    audio_id = None
+    if audio_bytes:
+        # Speech recognition is loaded on first use
+        from stt import audio_digest, transcribe_audio
+
+        audio_id = audio_digest(audio_bytes)
+    if audio_id and audio_id != st.session_state.last_audio_digest:
         with st.spinner("🎙️ Processing your voice input..."):
+            # Long recordings are transcribed in parallel segments; show each
+            # segment's text as soon as it is recognized
+            partial_box = st.empty()
+
+            def show_partial(texts, done, total):
+                partial = " ".join(text if text is not None else "…" for text in texts)
+                partial_box.info(f"📝 {done}/{total} segments: {partial}")
+
+            def show_stt_queue(position):
+                partial_box.info(f"⏳ Speech recognition is busy, you are #{position} in line...")
+
             # Get the current language's STT code
             stt_language = LANGUAGES[st.session_state.language]["stt_code"]
-            transcribed = transcribe_audio(audio_bytes, stt_language)
-            st.session_state.last_audio_bytes = audio_bytes
+            stt_stats = {}
+            transcribed = transcribe_audio(audio_bytes, stt_language, stats=stt_stats,
+                                           digest=audio_id, on_partial=show_partial,
+                                           tags=span_tags(), on_queue=show_stt_queue)
+            partial_box.empty()
+            st.session_state.last_audio_digest = audio_id
             # Store the transcribed text for later use
             if transcribed and not transcribed.startswith("Error:") and not transcribed.startswith("Speech service error:"):
                 st.session_state.last_transcription = transcribed
@@ -480,6 +615,9 @@ with col2:
             st.error(transcribed)
         else:
             st.success(f"**Transcribed:** {transcribed}")
+            if stt_stats.get("segments", 1) > 1:
+                st.caption(f"⏱️ {stt_stats['audio_seconds']:.0f}s of audio transcribed in "
+                           f"{stt_stats['segments']} parallel segments in {stt_stats['recognition_seconds']:.1f}s")
             st.info("💡 Click the button below to send, or copy the text to edit first!")
 
     # Show send button if we have a valid transcription
@@ -487,28 +625,59 @@ with col2:
         if st.button("📤 Send Voice Message", type="primary", use_container_width=True):
             st.session_state.voice_message = st.session_state.last_transcription
             st.session_state.last_transcription = None
-            st.session_state.last_audio_bytes = None  # Reset for next recording
             st.rerun()
 
-# Display chat history with TTS audio players
-for idx, message in enumerate(st.session_state.messages):
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-
-    # Show audio player for assistant messages OUTSIDE chat_message container
-    if message["role"] == "assistant":
-        # Generate TTS audio if not already cached
-        if idx not in st.session_state.tts_audio:
-            with st.spinner("🔊 Generating audio..."):
-                # Get the current language's TTS voice
-                tts_voice = LANGUAGES[st.session_state.language]["tts_voice"]
-                audio_data = generate_tts_audio(message["content"], tts_voice)
-                if audio_data:
-                    st.session_state.tts_audio[idx] = audio_data
-
-        # Display audio player if audio exists
-        if idx in st.session_state.tts_audio:
-            st.audio(st.session_state.tts_audio[idx], format="audio/mp3")
+# Display chat history with TTS audio players. The history is a fragment, so
+# paging and opening audio players rerun only this part of the page, and it
+# never synthesizes speech: replies are voiced when they are generated.
+def show_earlier_messages():
+    st.session_state.history_limit += HISTORY_PAGE_SIZE
+    # Read the next older page of a resumed conversation from the store
+    if st.session_state.history_offset and len(st.session_state.messages) < st.session_state.history_limit:
+        load_messages(st.session_state.history_offset)
+
+def open_audio(idx):
+    st.session_state.audio_opened.add(idx)
+
+@st.fragment
+def render_history():
+    with span("render_history", **span_tags()):
+        messages = st.session_state.messages
+        offset = st.session_state.history_offset
+        start = max(0, len(messages) - st.session_state.history_limit)
+        if start + offset:
+            st.button(f"⬆️ Show earlier messages ({start + offset} hidden)", key="show_earlier",
+                      on_click=show_earlier_messages)
+
+        assistant_indices = [offset + i for i, m in enumerate(messages) if m["role"] == "assistant"]
+        eager_audio = set(assistant_indices[-EAGER_AUDIO_REPLIES:]) if EAGER_AUDIO_REPLIES else set()
+
+        for idx in range(offset + start, offset + len(messages)):
+            message = messages[idx - offset]
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+
+            # Show audio player for assistant messages OUTSIDE chat_message container
+            if message["role"] == "assistant":
+                audio_handle = st.session_state.tts_audio.get(idx)
+                if audio_handle:
+                    if idx in eager_audio or idx in st.session_state.audio_opened:
+                        # The player reads the file itself; None once the quota evicted it
+                        audio_path = st.session_state.session_audio.path(audio_handle)
+                        if audio_path:
+                            st.audio(audio_path, format=mime_type(audio_path))
+                        else:
+                            st.caption("🔇 Audio no longer available")
+                    else:
+                        st.button("🔊 Load audio", key=f"load_audio_{idx}",
+                                  on_click=open_audio, args=(idx,))
+
+                # Show how long the reply took to start appearing and speaking
+                timing = format_turn_metrics(message.get("metrics", {}))
+                if timing:
+                    st.caption(timing)
+
+render_history()
 
 # Handle voice message if available
 if "voice_message" in st.session_state and st.session_state.voice_message:
@@ -524,6 +693,14 @@ else:
 if st.session_state.processing and not prompt:
     st.session_state.processing = False
 
+# Limit how many turns a session can start per minute
+if prompt and not st.session_state.processing:
+    try:
+        get_scheduler().check_rate(st.session_state.session_id)
+    except RateLimited as e:
+        st.warning(f"⏳ You're sending messages too quickly. Please wait {e.retry_after:.0f} seconds.")
+        prompt = None
+
 if prompt and not st.session_state.processing:
     # Set processing flag to prevent duplicate processing
     st.session_state.processing = True
@@ -539,49 +716,147 @@ if prompt and not st.session_state.processing:
     with st.chat_message("assistant"):
         with st.spinner("Thinking..."):
             try:
-                # Create model with personality-based system instruction + language instruction
-                personality_prompt = PERSONALITIES[st.session_state.personality]["prompt"]
-                language_instruction = LANGUAGES[st.session_state.language]["ai_instruction"]
-                combined_instruction = f"{personality_prompt}\n\nIMPORTANT: {language_instruction}"
-
-                model = genai.GenerativeModel(
-                    'gemini-2.5-flash',
-                    system_instruction=combined_instruction
-                )
+                turn_started = time.perf_counter()
+                turn_metrics = {}
 
-                # Generate response
-                response = model.generate_content(prompt)
-                assistant_response = response.text
+                model = get_model(st.session_state.personality, st.session_state.language)
 
-                # Display response
-                st.markdown(assistant_response)
+                # Start a chat carrying the running summary and the recent turns
+                # (everything except the prompt that was just appended)
+                apply_summary()
+                history = st.session_state.context.history(st.session_state.messages[:-1])
+                turn_metrics["context_tokens"] = history_tokens(history)
+                chat = model.start_chat(history=history)
+
+                # Speech for the reply is synthesized sentence by sentence while
+                # the text is still streaming in; one player above the reply
+                # speaks the chunks back to back as they arrive
+                tts_voice = LANGUAGES[st.session_state.language]["tts_voice"]
+                speech = SpeechStream(tts_voice, turn_metrics, started=turn_started, tags=span_tags())
+                audio_parts = []
+                encodings = []  # Future of each chunk's encoding for this browser
+                encoded_parts = []
+                player_slot = st.empty()
+                chunk_players = st.container()
+
+                def show_encoded(wait=False):
+                    # Chunks are encoded off this thread and queued in order once ready
+                    while len(encoded_parts) < len(encodings):
+                        encoding = encodings[len(encoded_parts)]
+                        if not (wait or encoding.done()):
+                            break
+                        chunk_audio, chunk_format = encoding.result()
+                        if not encoded_parts:
+                            with player_slot:
+                                queued_player()
+                        chunk_players.audio(chunk_audio, format=chunk_format.mime)
+                        encoded_parts.append((chunk_audio, chunk_format))
+
+                def on_audio(parts):
+                    for audio_part in parts:
+                        audio_parts.append(audio_part)
+                        encodings.append(submit_encode(audio_part, st.session_state.audio_format, span_tags()))
+                    show_encoded()
+
+                # Replies to a conversation's opening prompt can be shared across
+                # sessions; later turns depend on the history so always go to Gemini
+                use_response_cache = response_cache_enabled() and not history
+                cached_response = None
+                if use_response_cache:
+                    cached_response = get_response_cache().get(
+                        st.session_state.personality, st.session_state.language, prompt
+                    )
+
+                # Gemini calls share a process-wide limit; show the place in line
+                queue_box = st.empty()
+
+                def show_queue(position):
+                    queue_box.info(f"⏳ The assistant is busy, you are #{position} in line...")
+
+                gemini_slot = nullcontext() if cached_response else get_scheduler().slot(
+                    "gemini", st.session_state.session_id, on_wait=show_queue
+                )
+                with gemini_slot, span("llm_generate", **span_tags()) as stage:
+                    queue_box.empty()
+                    if cached_response:
+                        # Cached audio for the reply is reused by the speech stream, so
+                        # a cache hit skips synthesis as well as the Gemini call
+                        turn_metrics["response_cache_hit"] = True
+                        stage.outcome = "cache_hit"
+                        text_chunks = iter([cached_response])
+                    else:
+                        # Generate response, rendering tokens as they arrive
+                        response = chat.send_message(prompt, stream=STREAM_RESPONSES)
+                        text_chunks = response_text(response)
+
+                    assistant_response = st.write_stream(
+                        stream_reply(text_chunks, speech, turn_metrics, turn_started, on_audio)
+                    )
+                turn_metrics["llm_total"] = time.perf_counter() - turn_started
+
+                if use_response_cache and not cached_response:
+                    get_response_cache().put(
+                        st.session_state.personality, st.session_state.language,
+                        prompt, assistant_response
+                    )
 
                 # Add assistant response to chat history
                 st.session_state.messages.append({
                     "role": "assistant",
-                    "content": assistant_response
+                    "content": assistant_response,
+                    "metrics": turn_metrics
                 })
 
-                # Generate TTS audio for the new response
-                new_msg_idx = len(st.session_state.messages) - 1
+                # Finish synthesizing the sentences still in flight
+                new_msg_idx = st.session_state.history_offset + len(st.session_state.messages) - 1
+                speech.close()
                 with st.spinner("🔊 Generating audio..."):
-                    # Get the current language's TTS voice
-                    tts_voice = LANGUAGES[st.session_state.language]["tts_voice"]
-                    audio_data = generate_tts_audio(assistant_response, tts_voice)
-                    if audio_data:
-                        st.session_state.tts_audio[new_msg_idx] = audio_data
-
+                    for audio_part in speech:
+                        on_audio([audio_part])
+                    show_encoded(wait=True)
+
+                if encoded_parts:
+                    # The stored reply joins the chunk encodings where the format allows it
+                    reply_audio, reply_format = join_encoded(encoded_parts, audio_parts,
+                                                             st.session_state.audio_format, span_tags())
+                    audio_handle = st.session_state.session_audio.put(reply_audio, reply_format.extension)
+                    if audio_handle:
+                        st.session_state.tts_audio[new_msg_idx] = audio_handle
+                timing = format_turn_metrics(turn_metrics)
+                if timing:
+                    st.caption(timing)
+
+            except Overloaded:
+                error_message = fixed_phrase("busy", LANGUAGES[st.session_state.language]["code"])
+                st.warning(error_message)
+                play_fixed_phrase("busy")
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": error_message,
+                    "error": True
+                })
             except Exception as e:
                 error_message = f"An error occurred: {str(e)}"
                 st.error(error_message)
+                play_fixed_phrase("error")
                 st.session_state.messages.append({
                     "role": "assistant",
-                    "content": error_message
+                    "content": error_message,
+                    "error": True
                 })
 
-    # Reset processing flag and rerun to show audio player
+    persist_messages()
+
+    # Fold turns that no longer fit the context budget into the summary in the
+    # background; this is deferred to a later turn while Gemini is saturated
+    try:
+        if not get_scheduler().saturated("gemini"):
+            st.session_state.context.start_compaction(st.session_state.messages, summarize_in_background)
+    except Exception:
+        pass
+
+    # Reset processing flag; no rerun so the reply's player keeps playing
     st.session_state.processing = False
-    st.rerun()
 
 # Footer
 st.markdown("---")
@@ -592,3 +867,10 @@ st.markdown(
     "</div>",
     unsafe_allow_html=True
 )
+
+record("script_run", time.perf_counter() - SCRIPT_STARTED, session=st.session_state.session_id)
+start_background_preload()
+prefetch_for = (st.session_state.personality, st.session_state.language)
+if prefetch_enabled() and st.session_state.get("prefetched_for") != prefetch_for:
+    st.session_state.prefetched_for = prefetch_for
+    schedule_voice_prefetch()
@@ -0,0 +1,171 @@
+"""Output encodings for synthesized speech.
+
+Speech is synthesized as MP3 (Edge TTS always returns 24 kHz 48 kbit/s mono
+MP3 and gTTS a similar MP3), so sentence chunks can be joined byte-wise.
+Each piece of audio sent to a browser is then encoded once in the output
+format with ffmpeg: low-bitrate MP3, or Opus in WebM. The format is set per
+deployment with TTS_OUTPUT_FORMAT; clients that send ``Save-Data: on`` get
+TTS_SAVE_DATA_FORMAT, and Safari, which cannot play Opus in WebM, gets the
+format's MP3 fallback. Without ffmpeg, audio is served as synthesized.
+
+Speech is encoded chunk by chunk, on a small worker pool so ffmpeg never
+runs on a script thread while a reply streams, and each chunk's encoding is
+cached per format in the shared audio cache. A whole reply is the join of
+its encoded chunks when the format allows it (MP3); otherwise it is encoded
+once and not cached, since nothing asks for the same concatenation again.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from metrics import span
+from tts_cache import encoded_key, get_tts_cache
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_TIMEOUT = 30  # seconds
+ENCODE_WORKERS = int(os.getenv("TTS_ENCODE_WORKERS", "2"))
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    """An output encoding; ffmpeg_args is None for audio served as synthesized"""
+
+    name: str
+    mime: str
+    extension: str
+    ffmpeg_args: tuple = None
+    fallback: str = None  # Format for clients that cannot play this one
+    joinable: bool = True  # Encoded pieces concatenate byte-wise into one playable file
+
+
+FORMATS = {
+    "mp3": AudioFormat("mp3", "audio/mpeg", "mp3"),
+    "mp3-32k": AudioFormat("mp3-32k", "audio/mpeg", "mp3",
+                           ("-ac", "1", "-ar", "22050", "-c:a", "libmp3lame", "-b:a", "32k", "-f", "mp3")),
+    "mp3-24k": AudioFormat("mp3-24k", "audio/mpeg", "mp3",
+                           ("-ac", "1", "-ar", "16000", "-c:a", "libmp3lame", "-b:a", "24k", "-f", "mp3")),
+    "opus-24k": AudioFormat("opus-24k", "audio/webm", "webm",
+                            ("-ac", "1", "-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-f", "webm"),
+                            fallback="mp3-32k", joinable=False),
+    "opus-16k": AudioFormat("opus-16k", "audio/webm", "webm",
+                            ("-ac", "1", "-c:a", "libopus", "-b:a", "16k", "-application", "voip", "-f", "webm"),
+                            fallback="mp3-24k", joinable=False),
+}
+DEFAULT_FORMAT = "mp3"
+MIME_TYPES = {audio_format.extension: audio_format.mime for audio_format in FORMATS.values()}
+
+_missing_ffmpeg_logged = threading.Event()
+
+
+def get_output_format(name=None):
+    """Return the named format, or the deployment's TTS_OUTPUT_FORMAT"""
+    name = name or os.getenv("TTS_OUTPUT_FORMAT", DEFAULT_FORMAT)
+    return FORMATS.get(name, FORMATS[DEFAULT_FORMAT])
+
+
+def negotiate_format(headers=None, name=None):
+    """Pick the format for one client from its request headers"""
+    headers = headers or {}
+    audio_format = get_output_format(name)
+    if headers.get("Save-Data", "").lower() == "on":
+        audio_format = get_output_format(os.getenv("TTS_SAVE_DATA_FORMAT", "mp3-24k"))
+    user_agent = headers.get("User-Agent", "")
+    is_safari = "Safari" in user_agent and not any(
+        engine in user_agent for engine in ("Chrome", "Chromium", "CriOS", "Android")
+    )
+    if is_safari and audio_format.fallback:
+        audio_format = FORMATS[audio_format.fallback]
+    return audio_format
+
+
+def mime_type(path):
+    """Return the MIME type of a stored audio file from its extension"""
+    return MIME_TYPES.get(os.path.splitext(path)[1].lstrip("."), "audio/mpeg")
+
+
+def ffmpeg_path():
+    """Return the ffmpeg executable (FFMPEG_BINARY or on PATH), or None"""
+    return os.getenv("FFMPEG_BINARY") or shutil.which("ffmpeg")
+
+
+def run_ffmpeg(data, args):
+    """Pipe data through ffmpeg with the given output arguments and return the output"""
+    command = [ffmpeg_path(), "-hide_banner", "-loglevel", "error", "-i", "pipe:0", *args, "pipe:1"]
+    result = subprocess.run(command, input=data, capture_output=True, timeout=FFMPEG_TIMEOUT, check=True)
+    return result.stdout
+
+
+def encode_audio(mp3_bytes, audio_format, tags=None, cache=True):
+    """Return (audio bytes, format) for synthesized MP3 encoded in audio_format
+
+    Falls back to the MP3 as synthesized when ffmpeg is missing or fails.
+    With cache=False the encoding is neither looked up nor stored.
+    """
+    as_synthesized = FORMATS[DEFAULT_FORMAT]
+    if not mp3_bytes or audio_format.ffmpeg_args is None:
+        return mp3_bytes, as_synthesized
+    if ffmpeg_path() is None:
+        if not _missing_ffmpeg_logged.is_set():
+            _missing_ffmpeg_logged.set()
+            logger.warning("ffmpeg not found; serving audio as synthesized instead of %s", audio_format.name)
+        return mp3_bytes, as_synthesized
+
+    key = encoded_key(mp3_bytes, audio_format.name)
+    audio_cache = get_tts_cache()
+    with span("tts_encode", **(tags or {})) as stage:
+        encoded = audio_cache.get(key) if cache else None
+        if encoded:
+            stage.outcome = "cache_hit"
+            return encoded, audio_format
+        try:
+            encoded = run_ffmpeg(mp3_bytes, audio_format.ffmpeg_args)
+        except (OSError, subprocess.SubprocessError) as e:
+            stage.outcome = "error"
+            logger.warning("Encoding audio as %s failed: %s", audio_format.name, e)
+            return mp3_bytes, as_synthesized
+    if not encoded:
+        return mp3_bytes, as_synthesized
+    if cache:
+        audio_cache.put(key, encoded)
+    return encoded, audio_format
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_encode_pool():
+    """Return the process-wide worker pool that runs ffmpeg"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix="encode")
+    return _pool
+
+
+def submit_encode(mp3_bytes, audio_format, tags=None):
+    """Encode one chunk off the calling thread; returns a Future of (audio bytes, format)"""
+    if audio_format.ffmpeg_args is None:
+        done = Future()
+        done.set_result((mp3_bytes, FORMATS[DEFAULT_FORMAT]))
+        return done
+    return get_encode_pool().submit(encode_audio, mp3_bytes, audio_format, tags)
+
+
+def join_encoded(encoded, mp3_parts, audio_format, tags=None):
+    """Return (audio bytes, format) for a whole reply from its chunks
+
+    encoded holds the (audio bytes, format) of each chunk, mp3_parts the
+    chunks as synthesized. Chunks encoded in one joinable format are joined
+    byte-wise; otherwise the joined MP3 is encoded once, uncached.
+    """
+    formats = {used_format for _, used_format in encoded}
+    if len(formats) == 1 and encoded[0][1].joinable:
+        return b"".join(audio_data for audio_data, _ in encoded), encoded[0][1]
+    return encode_audio(b"".join(mp3_parts), audio_format, tags, cache=False)
@@ -0,0 +1,63 @@
+"""One player that speaks a reply's audio chunks back to back.
+
+Each synthesized chunk is added to the page as an ordinary (hidden) st.audio
+element as soon as it is ready. A small script rendered once per reply, above
+the chunks, watches its chat message for those elements, hides them and
+plays their sources one after another in its own player, so speech keeps
+going while later chunks are still being synthesized and no click is needed
+between sentences. A chunk that arrives after playback caught up starts as
+soon as it is added.
+"""
+import streamlit.components.v1 as components
+
+PLAYER_HEIGHT = 60  # pixels
+
+_QUEUE_SCRIPT = """
+<audio id="player" controls style="width: 100%"></audio>
+<script>
+const player = document.getElementById("player");
+const frame = window.frameElement;
+const scope = frame.closest('[data-testid="stChatMessage"]') || frame.ownerDocument.body;
+const queue = [];
+let current = -1;
+let waiting = true;  // Nothing is playing and the next chunk should start at once
+
+function playNext() {
+  current += 1;
+  waiting = false;
+  player.src = queue[current];
+  player.play().catch(() => {});
+}
+
+function collect() {
+  scope.querySelectorAll("audio").forEach((element) => {
+    if (element.dataset.queued || !element.src) return;
+    element.dataset.queued = "1";
+    const container = element.closest('[data-testid="stElementContainer"], .element-container') || element;
+    container.style.display = "none";
+    queue.push(element.src);
+  });
+  if (waiting && current < queue.length - 1) playNext();
+}
+
+player.addEventListener("ended", () => {
+  if (current < queue.length - 1) playNext();
+  else waiting = true;
+});
+// Playing again after the end replays the whole reply, not just its last chunk
+player.addEventListener("play", () => {
+  if (waiting && queue.length > 1 && current === queue.length - 1) {
+    current = -1;
+    playNext();
+  }
+});
+new MutationObserver(collect).observe(scope, {childList: true, subtree: true, attributes: true,
+                                              attributeFilter: ["src"]});
+collect();
+</script>
+"""
+
+
+def queued_player():
+    """Render the player that chains the st.audio chunks added below it in this chat message"""
+    components.html(_QUEUE_SCRIPT, height=PLAYER_HEIGHT)
@@ -0,0 +1,184 @@
+"""Audio clean-up applied to recordings before speech recognition.
+
+The browser recorder delivers WAV at its native sample rate, often stereo,
+with silence before and after the speech. preprocess_audio() downmixes to
+mono, trims leading and trailing silence with an energy-based voice activity
+detector and resamples to 16 kHz. Every step works on whole numpy arrays, so
+there are no per-sample Python loops.
+"""
+import io
+import logging
+import time
+import wave
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TARGET_SAMPLE_RATE = 16000
+FRAME_MS = 20
+# A frame is speech if it is louder than both the absolute floor and the
+# loudest frame minus the relative range
+SILENCE_FLOOR_DB = -55.0
+SILENCE_RANGE_DB = 35.0
+# Silence kept around the detected speech so word edges are not clipped
+PAD_MS = 200
+LOWPASS_TAPS = 63
+
+
+def decode_wav(audio_bytes):
+    """Decode PCM WAV bytes into float32 samples shaped (frames, channels) and the rate"""
+    with wave.open(io.BytesIO(audio_bytes), "rb") as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    elif width == 3:
+        # Widen 24-bit little-endian samples to int32 by prepending a zero low byte
+        triplets = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(triplets), 4), dtype=np.uint8)
+        padded[:, 1:] = triplets
+        samples = padded.view("<i4").ravel().astype(np.float32) / 2147483648.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width} bytes")
+
+    frames = len(samples) // channels
+    return samples[:frames * channels].reshape(frames, channels), rate
+
+
+def encode_wav(samples, rate):
+    """Encode mono float samples as 16-bit PCM WAV bytes"""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def to_mono(samples):
+    """Downmix (frames, channels) samples to a 1-D mono signal"""
+    return samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+
+
+def speech_bounds(samples, rate, frame_ms=FRAME_MS, floor_db=SILENCE_FLOOR_DB,
+                  range_db=SILENCE_RANGE_DB, pad_ms=PAD_MS):
+    """Return (start, end) sample indices of the speech, or None if all silence"""
+    frame_len = max(1, rate * frame_ms // 1000)
+    frame_count = len(samples) // frame_len
+    if frame_count == 0:
+        return None
+
+    frames = samples[:frame_count * frame_len].reshape(frame_count, frame_len)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    energy_db = 20.0 * np.log10(np.maximum(rms, 1e-10))
+    threshold = max(floor_db, energy_db.max() - range_db)
+    voiced = np.flatnonzero(energy_db > threshold)
+    if len(voiced) == 0:
+        return None
+
+    pad = rate * pad_ms // 1000
+    start = max(0, int(voiced[0]) * frame_len - pad)
+    end = min(len(samples), (int(voiced[-1]) + 1) * frame_len + pad)
+    return start, end
+
+
+def _lowpass(samples, cutoff, taps=LOWPASS_TAPS):
+    """Windowed-sinc low-pass filter; cutoff is a fraction of the sample rate"""
+    n = np.arange(taps) - (taps - 1) / 2.0
+    kernel = 2.0 * cutoff * np.sinc(2.0 * cutoff * n) * np.hamming(taps)
+    kernel /= kernel.sum()
+    return np.convolve(samples, kernel, mode="same")
+
+
+def resample(samples, rate, target_rate=TARGET_SAMPLE_RATE):
+    """Resample a mono signal with anti-aliasing and linear interpolation"""
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    if target_rate < rate:
+        samples = _lowpass(samples, 0.5 * target_rate / rate)
+    duration = len(samples) / rate
+    target_times = np.arange(int(duration * target_rate)) / target_rate
+    source_times = np.arange(len(samples)) / rate
+    return np.interp(target_times, source_times, samples).astype(np.float32)
+
+
+def preprocess_audio(audio_bytes, stats=None):
+    """Return 16 kHz mono WAV with silence trimmed, or b"" if there is no speech
+
+    If a stats dict is passed it receives the byte counts and timings.
+    """
+    started = time.perf_counter()
+    samples, rate = decode_wav(audio_bytes)
+    mono = to_mono(samples)
+
+    bounds = speech_bounds(mono, rate)
+    if bounds is None:
+        processed = b""
+        trimmed_seconds = len(mono) / rate
+    else:
+        start, end = bounds
+        trimmed_seconds = (len(mono) - (end - start)) / rate
+        processed = encode_wav(resample(mono[start:end], rate), TARGET_SAMPLE_RATE)
+
+    elapsed = time.perf_counter() - started
+    info = {
+        "bytes_before": len(audio_bytes),
+        "bytes_after": len(processed),
+        "sample_rate_before": rate,
+        "channels_before": samples.shape[1],
+        "duration_before": len(mono) / rate,
+        "trimmed_seconds": trimmed_seconds,
+        "preprocess_seconds": elapsed,
+    }
+    if stats is not None:
+        stats.update(info)
+    logger.info(
+        "Preprocessed audio: %d -> %d bytes (%d Hz x%d -> %d Hz mono, %.2fs silence trimmed) in %.1f ms",
+        info["bytes_before"], info["bytes_after"], rate, samples.shape[1],
+        TARGET_SAMPLE_RATE, trimmed_seconds, elapsed * 1000,
+    )
+    return processed
+
+
+def split_on_silence(samples, rate, target_seconds=20.0, max_seconds=30.0,
+                     overlap_ms=300, frame_ms=FRAME_MS):
+    """Split a mono signal into overlapping segments cut at quiet frames
+
+    Each cut is placed at the quietest frame between half the target length and
+    the maximum length, and every segment is extended by overlap_ms into its
+    neighbour so words at a cut are heard in full by at least one segment.
+    Returns a list of (start, end) sample indices.
+    """
+    frame_len = max(1, rate * frame_ms // 1000)
+    frame_count = len(samples) // frame_len
+    max_frames = max(1, int(max_seconds * 1000 / frame_ms))
+    if frame_count <= max_frames:
+        return [(0, len(samples))]
+
+    frames = samples[:frame_count * frame_len].reshape(frame_count, frame_len)
+    energy = np.mean(frames * frames, axis=1)
+    min_frames = max(1, int(target_seconds * 500 / frame_ms))
+
+    cuts = [0]
+    while frame_count - cuts[-1] > max_frames:
+        window = energy[cuts[-1] + min_frames:cuts[-1] + max_frames]
+        cuts.append(cuts[-1] + min_frames + int(np.argmin(window)))
+    cuts.append(frame_count)
+
+    overlap = rate * overlap_ms // 1000
+    bounds = []
+    for i in range(len(cuts) - 1):
+        start = max(0, cuts[i] * frame_len - overlap)
+        end = len(samples) if i == len(cuts) - 2 else min(len(samples), cuts[i + 1] * frame_len + overlap)
+        bounds.append((start, end))
+    return bounds
@@ -0,0 +1,332 @@
+"""Disk-backed store for the audio of each session's replies.
+
+Session state only holds a SessionAudio and a short handle per reply; the MP3
+bytes live in a file under AUDIO_STORE_DIR/<session>/ and the audio player is
+given the file path, so reply audio is not kept on the Python heap between
+reruns. Each session has a byte quota: when it is exceeded the least recently
+played replies are dropped. A session's files are deleted when its
+SessionAudio is garbage collected along with the session state, unless it
+belongs to a saved conversation that can be resumed later; files of sessions
+idle for longer than AUDIO_SESSION_TTL are swept (this also covers files left
+by an earlier run). The audio of saved conversations is marked persistent
+and kept as long as the conversation itself (CONVERSATION_RETENTION); the
+conversation store deletes it along with the conversation. Since that audio
+outlives its session, the whole store is also held to AUDIO_STORE_MAX_BYTES:
+each sweep totals the files on disk and, over budget, deletes the oldest
+files, those of saved conversations before those of live sessions.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+from conversation_store import DEFAULT_RETENTION
+from metrics import set_gauge
+
+DEFAULT_STORE_DIR = os.path.join(".cache", "sessions")
+DEFAULT_SESSION_QUOTA_BYTES = 16 * 1024 * 1024
+DEFAULT_SESSION_TTL = 3600
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+SWEEP_INTERVAL = 60
+# Marks the directory of a saved conversation's audio, so the sweep can tell
+# it apart after a restart
+PERSISTENT_MARKER = ".persistent"
+
+
+class AudioStore:
+    """Per-session audio files with an LRU byte quota, a store-wide budget and idle expiry"""
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, session_quota_bytes=DEFAULT_SESSION_QUOTA_BYTES,
+                 session_ttl=DEFAULT_SESSION_TTL, persistent_ttl=DEFAULT_RETENTION, max_bytes=DEFAULT_MAX_BYTES):
+        self.store_dir = store_dir
+        self.session_quota_bytes = session_quota_bytes
+        self.max_bytes = max_bytes
+        self.session_ttl = session_ttl
+        self.persistent_ttl = persistent_ttl
+        # session -> OrderedDict(handle -> size), least recently used first
+        self._sessions = {}
+        self._last_seen = {}
+        self._persistent = set()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._stats = {"stored": 0, "evictions": 0, "expired_sessions": 0}
+        os.makedirs(store_dir, exist_ok=True)
+        self.sweep()
+
+    def session(self, session, persistent=False):
+        """Return the SessionAudio to keep in the session's state
+
+        The audio of a persistent session outlives the SessionAudio; it is
+        removed by drop_session() or once idle for longer than persistent_ttl.
+        """
+        if persistent:
+            with self._lock:
+                self._persistent.add(session)
+        return SessionAudio(self, session, persistent)
+
+    def put(self, session, data, extension="mp3"):
+        """Store audio for session and return its handle, or None if it was not stored"""
+        if not data:
+            return None
+        handle = f"{uuid.uuid4().hex}.{extension}"
+        path = self._path(session, handle)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._mark_persistent(session)
+            # Write to a temp file and rename so players never see partial audio
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return None
+
+        with self._lock:
+            entries = self._sessions.setdefault(session, OrderedDict())
+            entries[handle] = len(data)
+            self._size += len(data)
+            self._last_seen[session] = time.time()
+            self._stats["stored"] += 1
+            evicted = self._evict(session)
+        self._remove_files(session, evicted)
+        self._maybe_sweep()
+        self._publish()
+        return handle
+
+    def restore(self, session, handles):
+        """Take back audio files written for session earlier (oldest first)"""
+        self._mark_persistent(session)
+        with self._lock:
+            entries = self._sessions.setdefault(session, OrderedDict())
+            for handle in handles:
+                if handle in entries:
+                    continue
+                try:
+                    size = os.path.getsize(self._path(session, handle))
+                except OSError:
+                    continue  # Swept or evicted since
+                entries[handle] = size
+                self._size += size
+            self._last_seen[session] = time.time()
+            evicted = self._evict(session)
+        self._remove_files(session, evicted)
+        self._publish()
+
+    def path(self, session, handle):
+        """Return the file holding the audio for handle, or None if it was evicted"""
+        with self._lock:
+            entries = self._sessions.get(session)
+            if not entries or handle not in entries:
+                return None
+            entries.move_to_end(handle)
+            self._last_seen[session] = time.time()
+        return self._path(session, handle)
+
+    def get(self, session, handle):
+        """Return the audio bytes for handle, or None if it was evicted"""
+        path = self.path(session, handle)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def drop_session(self, session):
+        """Delete all audio stored for session"""
+        with self._lock:
+            entries = self._sessions.pop(session, None)
+            self._last_seen.pop(session, None)
+            self._persistent.discard(session)
+            if entries:
+                self._size -= sum(entries.values())
+        shutil.rmtree(os.path.join(self.store_dir, session), ignore_errors=True)
+        self._publish()
+
+    def sweep(self):
+        """Delete the audio of sessions idle for longer than their TTL, then trim to max_bytes
+
+        Persistent sessions use persistent_ttl, all others session_ttl; a TTL
+        of 0 keeps that kind of session's audio until it is dropped.
+        """
+        self._last_sweep = time.time()
+        if self.session_ttl or self.persistent_ttl:
+            self._expire_idle()
+        if self.max_bytes:
+            self._trim()
+
+    def stats(self):
+        """Return the counters plus the current sessions, files and bytes"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["sessions"] = len(self._sessions)
+            snapshot["files"] = sum(len(entries) for entries in self._sessions.values())
+            snapshot["bytes"] = self._size
+        return snapshot
+
+    def session_bytes(self, session):
+        """Return the bytes currently stored for session"""
+        with self._lock:
+            return sum(self._sessions.get(session, {}).values())
+
+    # Callers hold self._lock; returns the evicted handles
+    def _evict(self, session):
+        entries = self._sessions[session]
+        used = sum(entries.values())
+        evicted = []
+        # Always keep the newest reply, even if it alone exceeds the quota
+        while used > self.session_quota_bytes and len(entries) > 1:
+            handle, size = entries.popitem(last=False)
+            used -= size
+            self._size -= size
+            self._stats["evictions"] += 1
+            evicted.append(handle)
+        return evicted
+
+    def _remove_files(self, session, handles):
+        for handle in handles:
+            try:
+                os.unlink(self._path(session, handle))
+            except OSError:
+                continue
+
+    def _expire_idle(self):
+        def expired(seen, persistent):
+            ttl = self.persistent_ttl if persistent else self.session_ttl
+            return bool(ttl) and seen < self._last_sweep - ttl
+
+        with self._lock:
+            idle = [session for session, seen in self._last_seen.items()
+                    if expired(seen, session in self._persistent)]
+            known = set(self._sessions)
+        # Directories no session in this process owns, e.g. from before a restart
+        try:
+            names = os.listdir(self.store_dir)
+        except OSError:
+            names = []
+        for name in names:
+            if name in known:
+                continue
+            directory = os.path.join(self.store_dir, name)
+            try:
+                if expired(os.path.getmtime(directory),
+                           os.path.exists(os.path.join(directory, PERSISTENT_MARKER))):
+                    idle.append(name)
+            except OSError:
+                continue
+        for session in idle:
+            self.drop_session(session)
+        with self._lock:
+            self._stats["expired_sessions"] += len(idle)
+
+    def _trim(self):
+        # Every file on disk counts, including saved conversations' audio
+        # that no session in this process has restored
+        files = []  # (live, mtime, size, session, handle)
+        try:
+            names = os.listdir(self.store_dir)
+        except OSError:
+            names = []
+        for session in names:
+            directory = os.path.join(self.store_dir, session)
+            try:
+                live = not os.path.exists(os.path.join(directory, PERSISTENT_MARKER))
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.name == PERSISTENT_MARKER or entry.name.startswith("tmp"):
+                            continue  # Not audio, or still being written
+                        info = entry.stat()
+                        files.append((live, info.st_mtime, info.st_size, session, entry.name))
+            except OSError:
+                continue
+        excess = sum(size for _, _, size, _, _ in files) - self.max_bytes
+        if excess <= 0:
+            return
+        # Saved conversations' audio goes first, oldest first
+        files.sort()
+        for _, _, size, session, handle in files:
+            if excess <= 0:
+                break
+            with self._lock:
+                entries = self._sessions.get(session)
+                if entries and handle in entries:
+                    self._size -= entries.pop(handle)
+                self._stats["evictions"] += 1
+            self._remove_files(session, [handle])
+            excess -= size
+        self._publish()
+
+    def _mark_persistent(self, session):
+        with self._lock:
+            if session not in self._persistent:
+                return
+        try:
+            open(os.path.join(self.store_dir, session, PERSISTENT_MARKER), "a").close()
+        except OSError:
+            pass  # No audio stored for the session yet
+
+    def _maybe_sweep(self):
+        if time.time() - self._last_sweep > SWEEP_INTERVAL:
+            self.sweep()
+
+    def _publish(self):
+        stats = self.stats()
+        set_gauge("session_audio_bytes", stats["bytes"], "Reply audio stored for live sessions")
+        set_gauge("session_audio_sessions", stats["sessions"], "Sessions with stored reply audio")
+
+    def _path(self, session, handle):
+        return os.path.join(self.store_dir, session, handle)
+
+
+class SessionAudio:
+    """One session's view of the store; its audio is deleted when this is collected"""
+
+    def __init__(self, store, session, persistent=False):
+        self.store = store
+        self.session = session
+        if not persistent:
+            weakref.finalize(self, store.drop_session, session)
+
+    def put(self, data, extension="mp3"):
+        return self.store.put(self.session, data, extension)
+
+    def path(self, handle):
+        return self.store.path(self.session, handle)
+
+    def get(self, handle):
+        return self.store.get(self.session, handle)
+
+    def restore(self, handles):
+        self.store.restore(self.session, handles)
+
+    def clear(self):
+        self.store.drop_session(self.session)
+
+    def size(self):
+        return self.store.session_bytes(self.session)
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_audio_store():
+    """Return the process-wide session audio store, configured from the environment"""
+    global _shared_store
+    if _shared_store is None:
+        with _shared_lock:
+            if _shared_store is None:
+                _shared_store = AudioStore(
+                    store_dir=os.getenv("AUDIO_STORE_DIR") or DEFAULT_STORE_DIR,
+                    session_quota_bytes=int(os.getenv("AUDIO_SESSION_QUOTA_BYTES", DEFAULT_SESSION_QUOTA_BYTES)),
+                    session_ttl=int(os.getenv("AUDIO_SESSION_TTL", DEFAULT_SESSION_TTL)),
+                    persistent_ttl=float(os.getenv("CONVERSATION_RETENTION", DEFAULT_RETENTION)),
+                    max_bytes=int(os.getenv("AUDIO_STORE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+                )
+    return _shared_store
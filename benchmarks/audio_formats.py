@@ -0,0 +1,118 @@
+"""Size and transfer time of synthesized speech in each output format.
+
+Usage:
+    python -m benchmarks.audio_formats reply1.mp3 reply2.mp3 --json formats.json
+    python -m benchmarks.audio_formats --synthesize "A sentence to speak." --voice en-US-JennyNeural
+    python -m benchmarks.audio_formats
+
+Inputs are MP3 files as synthesized (for example saved replies), text
+synthesized with the real TTS providers (--synthesize, needs network), or,
+with neither, a generated tone encoded like Edge TTS output. Every input is
+encoded in each format of audio_formats.FORMATS with ffmpeg, and the report
+shows bytes per second of speech, bitrate and the time to transfer a reply
+over a few typical links (bandwidth plus one round trip).
+"""
+import argparse
+import json
+import time
+
+from benchmarks.end_to_end import current_commit
+
+# name -> (bits per second, round trip seconds)
+LINKS = {
+    "2G": (150_000, 0.6),
+    "3G": (750_000, 0.3),
+    "4G": (4_000_000, 0.08),
+}
+# Edge TTS output: 24 kHz mono MP3 at 48 kbit/s
+SOURCE_ARGS = ("-ac", "1", "-ar", "24000", "-c:a", "libmp3lame", "-b:a", "48k", "-f", "mp3")
+
+
+def speech_seconds(audio_bytes):
+    """Return the duration of encoded audio by decoding it to 16 kHz PCM"""
+    from audio_formats import run_ffmpeg
+
+    pcm = run_ffmpeg(audio_bytes, ("-ac", "1", "-ar", "16000", "-f", "s16le"))
+    return len(pcm) / 32000.0
+
+
+def generated_input(seconds=8.0):
+    """Return a voiced-sounding test signal encoded like Edge TTS output"""
+    from audio_formats import run_ffmpeg
+    from benchmarks.fakes import make_recording
+
+    return run_ffmpeg(make_recording(seconds, channels=1, seed=0), SOURCE_ARGS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="*", help="MP3 files as synthesized")
+    parser.add_argument("--synthesize", action="append", default=[], help="text to synthesize as an input")
+    parser.add_argument("--voice", default="en-US-JennyNeural", help="voice for --synthesize")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    from audio_formats import FORMATS, ffmpeg_path, run_ffmpeg
+
+    if ffmpeg_path() is None:
+        parser.error("ffmpeg is required (install it or set FFMPEG_BINARY)")
+
+    sources = []
+    for path in args.inputs:
+        with open(path, "rb") as f:
+            sources.append((path, f.read()))
+    for text in args.synthesize:
+        from tts import generate_tts_audio
+
+        audio_data = generate_tts_audio(text, args.voice)
+        if not audio_data:
+            parser.error(f"synthesis failed for {text[:40]!r}")
+        sources.append((text[:40], audio_data))
+    if not sources:
+        sources.append(("generated 8s tone", generated_input()))
+
+    results = {}
+    total_seconds = sum(speech_seconds(audio_data) for _, audio_data in sources)
+    for name, audio_format in FORMATS.items():
+        total_bytes = 0
+        encode_seconds = 0.0
+        for _, audio_data in sources:
+            started = time.perf_counter()
+            encoded = audio_data if audio_format.ffmpeg_args is None else run_ffmpeg(audio_data, audio_format.ffmpeg_args)
+            encode_seconds += time.perf_counter() - started
+            total_bytes += len(encoded)
+        bytes_per_second = total_bytes / total_seconds if total_seconds else 0.0
+        # Transfer time of an average input
+        average_bytes = total_bytes / len(sources)
+        results[name] = {
+            "mime": audio_format.mime,
+            "bytes": total_bytes,
+            "bytes_per_second": bytes_per_second,
+            "kbit_per_second": bytes_per_second * 8 / 1000,
+            "encode_ms_per_input": encode_seconds / len(sources) * 1000,
+            "transfer_ms": {link: (rtt + average_bytes * 8 / bandwidth) * 1000
+                            for link, (bandwidth, rtt) in LINKS.items()},
+        }
+
+    print(f"{len(sources)} input(s), {total_seconds:.1f}s of speech")
+    print(f"{'format':<10}{'bytes/s':>9}{'kbit/s':>8}{'encode ms':>11}"
+          + "".join(f"{link + ' ms':>9}" for link in LINKS))
+    for name, result in results.items():
+        print(f"{name:<10}{result['bytes_per_second']:>9.0f}{result['kbit_per_second']:>8.1f}"
+              f"{result['encode_ms_per_input']:>11.0f}"
+              + "".join(f"{result['transfer_ms'][link]:>9.0f}" for link in LINKS))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": current_commit(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "inputs": [name for name, _ in sources],
+                "speech_seconds": total_seconds,
+                "links": LINKS,
+                "formats": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
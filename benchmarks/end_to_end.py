@@ -0,0 +1,188 @@
+"""End-to-end latency benchmark for a voice turn (STT -> Gemini -> TTS).
+
+Usage:
+    python -m benchmarks.end_to_end --turns 200 --concurrency 8 --json bench.json
+    python -m benchmarks.end_to_end --edge-failure-rate 0.2 --compare bench.json
+
+External services are replaced by the fakes in benchmarks/fakes.py, so the
+real preprocessing, recognition, chat-streaming and sentence-chunked speech
+code runs offline with controlled latency and failure rates. The shared
+audio and transcript caches are disabled unless --with-caches is given.
+p50/p95/p99 are reported per stage and end to end; --json writes them with
+the commit hash so runs can be compared across commits with --compare.
+"""
+import argparse
+import dataclasses
+import json
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.fakes import FakeConfig, install_fakes, make_recording
+
+STAGES = [
+    ("stt", "speech recognition"),
+    ("llm_first_token", "Gemini first token"),
+    ("llm_total", "Gemini full reply"),
+    ("tts_tail", "speech after reply"),
+    ("first_audio", "turn to first audio"),
+    ("end_to_end", "turn to last audio"),
+]
+
+
+def run_turn(model, recording, stt_code, voice):
+    """Run one voice turn through the real pipeline code and return its timings"""
+    import tts
+    from stt import transcribe_audio
+
+    timings = {}
+    started = time.perf_counter()
+    transcript = transcribe_audio(recording, stt_code)
+    timings["stt"] = time.perf_counter() - started
+    if transcript is None or transcript.startswith(("Error:", "Speech service error:")):
+        return "stt_failed", timings
+
+    llm_started = time.perf_counter()
+    metrics = {}
+    speech = tts.SpeechStream(voice, metrics, started=started)
+    try:
+        response = model.start_chat(history=[]).send_message(transcript, stream=True)
+        for chunk in response:
+            if "llm_first_token" not in timings:
+                timings["llm_first_token"] = time.perf_counter() - llm_started
+            speech.feed(chunk.text)
+            speech.poll()
+    except Exception:
+        return "llm_failed", timings
+    llm_finished = time.perf_counter()
+    timings["llm_total"] = llm_finished - llm_started
+
+    speech.close()
+    audio = list(speech)
+    finished = time.perf_counter()
+    timings["tts_tail"] = finished - llm_finished
+    timings["end_to_end"] = finished - started
+    if "time_to_first_audio" in metrics:
+        timings["first_audio"] = metrics["time_to_first_audio"]
+    if metrics.get("tts_shed"):
+        return "tts_shed", timings
+    return ("ok" if audio else "tts_failed"), timings
+
+
+def percentiles(values):
+    """Summarize a list of seconds as p50/p95/p99/mean in milliseconds"""
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(values),
+        "p50_ms": p50 * 1000,
+        "p95_ms": p95 * 1000,
+        "p99_ms": p99 * 1000,
+        "mean_ms": float(np.mean(values)) * 1000,
+    }
+
+
+def current_commit():
+    """Return the current git commit, or None outside a checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=50, help="voice turns to run (default 50)")
+    parser.add_argument("--concurrency", type=int, default=4, help="turns in flight at once (default 4)")
+    parser.add_argument("--recording-seconds", type=float, default=3.0, help="length of each question")
+    parser.add_argument("--language", default="en-US", help="stt_code for recognition")
+    parser.add_argument("--voice", default="en-US-JennyNeural", help="TTS voice")
+    parser.add_argument("--with-caches", action="store_true", help="keep the shared audio/transcript caches")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="print p50/p95 changes against an earlier --json result")
+    for field in dataclasses.fields(FakeConfig):
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=type(field.default) if field.default is not None else int,
+                            default=field.default, help=f"fake {field.name.replace('_', ' ')} (default {field.default})")
+    args = parser.parse_args()
+
+    config = FakeConfig(**{field.name: getattr(args, field.name) for field in dataclasses.fields(FakeConfig)})
+    restore = install_fakes(config)
+    try:
+        import google.generativeai as genai
+
+        import stt
+        import tts
+        import tts_cache
+
+        if not args.with_caches:
+            tts_cache._shared_cache = tts_cache.AudioCache(max_bytes=0, cache_dir=None)
+            stt.transcript_cache = stt.TranscriptCache(max_entries=0)
+
+        model = genai.GenerativeModel("gemini-2.5-flash")
+        recordings = [make_recording(args.recording_seconds, seed=i) for i in range(min(args.turns, 16))]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(
+                lambda i: run_turn(model, recordings[i % len(recordings)], args.language, args.voice),
+                range(args.turns),
+            ))
+        wall_seconds = time.perf_counter() - started
+        tts_routing = tts.get_tts_engine().stats()
+    finally:
+        restore()
+
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    stages = {
+        name: percentiles([timings[name] for outcome, timings in results if name in timings])
+        for name, _ in STAGES
+    }
+    report = {
+        "commit": current_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "turns": args.turns,
+        "concurrency": args.concurrency,
+        "with_caches": args.with_caches,
+        "fakes": dataclasses.asdict(config),
+        "wall_seconds": wall_seconds,
+        "turns_per_minute": args.turns / wall_seconds * 60 if wall_seconds else 0.0,
+        "outcomes": outcomes,
+        "tts_routing": tts_routing,
+        "stages": stages,
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    print(f"{args.turns} turns, concurrency {args.concurrency}, outcomes {outcomes}, "
+          f"{report['turns_per_minute']:.1f} turns/min")
+    print(f"TTS chunks {tts_routing['chunks']}: {tts_routing['hedge_rate']:.0%} hedged, "
+          f"wins {tts_routing['wins']}, {tts_routing['failed']} failed, breakers {tts_routing['breakers']}")
+    print(f"{'stage':<22}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}" + ("  vs previous p50/p95" if previous else ""))
+    for name, label in STAGES:
+        summary = stages[name]
+        if summary is None:
+            print(f"{label:<22}{'-':>10}{'-':>10}{'-':>10}")
+            continue
+        line = f"{label:<22}{summary['p50_ms']:>10.0f}{summary['p95_ms']:>10.0f}{summary['p99_ms']:>10.0f}"
+        old = (previous or {}).get("stages", {}).get(name)
+        if old:
+            line += (f"  {summary['p50_ms'] - old['p50_ms']:+.0f} / "
+                     f"{summary['p95_ms'] - old['p95_ms']:+.0f} (vs {previous.get('commit')})")
+        print(line)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Local stand-ins for the external services used by a voice turn.
+
+install_fakes() swaps in fakes for the Gemini model, edge_tts.Communicate,
+gTTS and the Google speech recognizer. Each fake sleeps for a configurable,
+jittered latency and fails at a configurable rate, so the real pipeline code
+can be timed offline and reproducibly (pass a seed).
+"""
+import asyncio
+import io
+import random
+import threading
+import time
+import wave
+from dataclasses import dataclass
+
+import edge_tts
+import google.generativeai as genai
+import gtts
+import numpy as np
+import speech_recognition as sr
+
+FAKE_SENTENCES = [
+    "That's a great question.",
+    "Here is what I would suggest as a first step.",
+    "Start small and build the habit over a couple of weeks.",
+    "Consistency matters much more than intensity at the beginning.",
+    "Keep track of your progress so you can see how far you have come.",
+    "Let me know if you would like a more detailed plan.",
+]
+
+
+@dataclass
+class FakeConfig:
+    """Latency (seconds) and failure rate for every faked service"""
+
+    stt_latency: float = 0.30
+    stt_seconds_per_audio_second: float = 0.05
+    stt_failure_rate: float = 0.0
+    llm_first_token: float = 0.40
+    llm_token_delay: float = 0.03
+    llm_failure_rate: float = 0.0
+    reply_sentences: int = 6
+    edge_latency: float = 0.25
+    edge_seconds_per_char: float = 0.002
+    edge_failure_rate: float = 0.0
+    gtts_latency: float = 0.60
+    gtts_failure_rate: float = 0.0
+    jitter: float = 0.25
+    seed: int = None
+
+
+class _Dice:
+    """Thread-safe random source shared by all fakes"""
+
+    def __init__(self, config):
+        self.config = config
+        self._random = random.Random(config.seed)
+        self._lock = threading.Lock()
+
+    def latency(self, base):
+        if base <= 0:
+            return 0.0
+        with self._lock:
+            return base * self._random.lognormvariate(0.0, self.config.jitter)
+
+    def fails(self, rate):
+        with self._lock:
+            return self._random.random() < rate
+
+
+def _mp3_bytes(text):
+    # Roughly the size of 48 kbit/s speech at ~15 characters per second
+    return b"\xff\xf3" * max(1, len(text) * 200)
+
+
+def install_fakes(config=None):
+    """Replace the external services with fakes; returns a function that restores them"""
+    config = config or FakeConfig()
+    dice = _Dice(config)
+
+    class FakeChunk:
+        def __init__(self, text):
+            self.text = text
+
+    class FakeChat:
+        def __init__(self, history=None):
+            self.history = list(history or [])
+
+        def send_message(self, prompt, stream=False, **kwargs):
+            time.sleep(dice.latency(config.llm_first_token))
+            if dice.fails(config.llm_failure_rate):
+                raise RuntimeError("Fake Gemini: 503 Service Unavailable")
+            reply = " ".join(FAKE_SENTENCES[i % len(FAKE_SENTENCES)]
+                             for i in range(config.reply_sentences))
+            if not stream:
+                time.sleep(dice.latency(config.llm_token_delay) * len(reply.split()))
+                return [FakeChunk(reply)]
+            return self._stream(reply)
+
+        def _stream(self, reply):
+            words = reply.split(" ")
+            for i in range(0, len(words), 4):
+                if i:
+                    time.sleep(dice.latency(config.llm_token_delay) * 4)
+                yield FakeChunk(" ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else ""))
+
+    class FakeGenerativeModel:
+        def __init__(self, model_name="gemini-2.5-flash", system_instruction=None, **kwargs):
+            self.model_name = model_name
+            self.system_instruction = system_instruction
+
+        def start_chat(self, history=None, **kwargs):
+            return FakeChat(history)
+
+        def generate_content(self, prompt, stream=False, **kwargs):
+            return FakeChat().send_message(str(prompt), stream=stream)
+
+    class FakeCommunicate:
+        def __init__(self, text, voice, **kwargs):
+            self.text = text
+            self.voice = voice
+
+        async def stream(self):
+            await asyncio.sleep(dice.latency(config.edge_latency + config.edge_seconds_per_char * len(self.text)))
+            if dice.fails(config.edge_failure_rate):
+                raise ConnectionError("Fake Edge TTS: connection reset")
+            yield {"type": "audio", "data": _mp3_bytes(self.text)}
+
+    class FakeGTTS:
+        def __init__(self, text, lang="en", slow=False, **kwargs):
+            self.text = text
+
+        def write_to_fp(self, fp):
+            time.sleep(dice.latency(config.gtts_latency))
+            if dice.fails(config.gtts_failure_rate):
+                raise gtts.gTTSError("Fake gTTS: 429 Too Many Requests")
+            fp.write(_mp3_bytes(self.text))
+
+    def fake_recognize_google(recognizer, audio_data, language="en-US", **kwargs):
+        seconds = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+        time.sleep(dice.latency(config.stt_latency + config.stt_seconds_per_audio_second * seconds))
+        if dice.fails(config.stt_failure_rate):
+            raise sr.RequestError("Fake Google STT: recognition connection failed")
+        return "how do I get started with a new workout routine"
+
+    originals = [
+        (genai, "GenerativeModel", genai.GenerativeModel),
+        (genai, "configure", genai.configure),
+        (edge_tts, "Communicate", edge_tts.Communicate),
+        (gtts, "gTTS", gtts.gTTS),
+        (sr.Recognizer, "recognize_google", sr.Recognizer.recognize_google),
+    ]
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.configure = lambda *args, **kwargs: None
+    edge_tts.Communicate = FakeCommunicate
+    gtts.gTTS = FakeGTTS
+    sr.Recognizer.recognize_google = fake_recognize_google
+
+    def restore():
+        for owner, name, value in originals:
+            setattr(owner, name, value)
+
+    return restore
+
+
+def make_recording(seconds=3.0, rate=44100, channels=2, lead_silence=0.5, seed=None):
+    """Return WAV bytes shaped like a browser recording: silence, a voiced stretch, silence"""
+    rng = np.random.default_rng(seed)
+    total = int((seconds + 2 * lead_silence) * rate)
+    samples = rng.normal(0.0, 0.0005, total)
+    start = int(lead_silence * rate)
+    voiced = np.arange(int(seconds * rate))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3.0 * voiced / rate)
+    samples[start:start + len(voiced)] += 0.2 * envelope * np.sin(2 * np.pi * 220.0 * voiced / rate)
+
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.repeat(pcm, channels).tobytes())
+    return buffer.getvalue()
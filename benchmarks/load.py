@@ -0,0 +1,433 @@
+"""Multi-session load test of the Streamlit app against stubbed providers.
+
+Usage:
+    python -m benchmarks.load --levels 1,4,16,32 --turns 4 --json load.json
+    python -m benchmarks.load --levels 8 --voice-every 1 --llm-first-token 1.0
+    python -m benchmarks.load --compare load.json
+
+A real ``streamlit run app.py`` server is started with Gemini, Edge TTS, gTTS
+and Google speech recognition replaced by the fakes of benchmarks/fakes.py.
+Each concurrency level then connects that many headless clients at once;
+each speaks Streamlit's websocket protocol like a browser tab. Users pick a
+personality and language (spread over every combination), then alternate
+typed turns and voice turns (a recording sent as the recorder component's
+value, transcribed, then sent with the button), with a short think time
+between turns.
+
+For every level the report shows turns per minute, the server's script run
+time (p50/p95 of the app's ``script_run`` span), how long typed and voice
+turns take as seen by the client, the time jobs waited for a Gemini, speech
+recognition or speech synthesis slot (the scheduler's ``queue_*`` spans),
+the server's peak RSS and RSS added per session, its peak thread count and
+the number of script runs that raised. Memory and threads are read from
+/proc, so they are only reported on Linux. Shared caches are disabled unless
+--with-caches is given, and the per-session rate limit is off unless
+SESSION_RATE_LIMIT is set.
+"""
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import aiohttp
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.Selectbox_pb2 import Selectbox
+
+from benchmarks.end_to_end import current_commit, percentiles
+from benchmarks.fakes import FakeConfig, make_recording
+from personas import LANGUAGES, PERSONALITIES
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "app.py")
+QUEUES = ("gemini", "stt", "tts")
+SAMPLE_INTERVAL = 0.1  # seconds between RSS/thread samples of the server
+
+# Runs the app with the fakes installed; argv: app path, port, FakeConfig as JSON
+_SERVER = """
+import json, sys
+from benchmarks.fakes import FakeConfig, install_fakes
+install_fakes(FakeConfig(**json.loads(sys.argv[3])))
+from streamlit.web import cli
+sys.argv = ["streamlit", "run", sys.argv[1], "--server.port", sys.argv[2], "--server.address", "127.0.0.1",
+            "--server.headless", "true", "--server.fileWatcherType", "none",
+            "--browser.gatherUsageStats", "false"]
+cli.main()
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(config, env, timeout=60):
+    """Start the app with fakes and return (process, port) once it is healthy"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-c", _SERVER, APP, str(port), json.dumps(dataclasses.asdict(config))],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the app server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                if response.status == 200:
+                    return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("the app server did not become healthy")
+
+
+def process_stats(pid):
+    """Return (RSS bytes, threads) of a process, or (None, None) without /proc"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]) * 1024, int(fields["Threads"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+class ProcessSampler:
+    """Tracks the peak RSS and thread count of a process while running"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.peak_rss, self.peak_threads = process_stats(pid)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="load-sampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            rss, threads = process_stats(self.pid)
+            if rss is not None:
+                self.peak_rss = max(self.peak_rss, rss)
+                self.peak_threads = max(self.peak_threads, threads)
+
+
+class BrowserSession:
+    """One headless app session over Streamlit's websocket protocol"""
+
+    def __init__(self, http, url, timeout):
+        self.http = http
+        self.url = url
+        self.timeout = timeout
+        self.query_string = ""
+        self.widgets = {}  # Widget id -> WidgetState the browser keeps sending
+        self.elements = []  # (type, proto) of the elements of the last script run
+        self.exceptions = 0
+        self._socket = None
+
+    async def connect(self):
+        self._socket = await self.http.ws_connect(self.url, max_msg_size=0)
+
+    async def close(self):
+        if self._socket is not None:
+            await self._socket.close()
+
+    async def rerun(self, trigger=None):
+        """Rerun the script with the kept widget values plus a one-shot trigger"""
+        message = BackMsg()
+        client_state = message.rerun_script
+        client_state.query_string = self.query_string
+        for state in self.widgets.values():
+            client_state.widget_states.widgets.add().CopyFrom(state)
+        if trigger is not None:
+            client_state.widget_states.widgets.add().CopyFrom(trigger)
+        await self._socket.send_bytes(message.SerializeToString())
+        await asyncio.wait_for(self._read_run(), self.timeout)
+
+    def find(self, kind, key=None, label_prefix=None, component=None):
+        """Return the id of an element of the last run, or None"""
+        for element_kind, element in self.elements:
+            if element_kind != kind:
+                continue
+            if key is not None and not element.id.endswith(f"-{key}"):
+                continue
+            if label_prefix is not None and not element.label.startswith(label_prefix):
+                continue
+            if component is not None and component not in element.component_name:
+                continue
+            return element.id
+        return None
+
+    def find_selectbox(self, key):
+        for element_kind, element in self.elements:
+            if element_kind == "selectbox" and element.id.endswith(f"-{key}"):
+                return element
+        return None
+
+    async def _read_run(self):
+        self.elements = []
+        while True:
+            received = await self._socket.receive()
+            if received.type != aiohttp.WSMsgType.BINARY:
+                raise ConnectionError(f"websocket closed ({received.type})")
+            message = ForwardMsg.FromString(received.data)
+            kind = message.WhichOneof("type")
+            if kind == "delta" and message.delta.WhichOneof("type") == "new_element":
+                element_kind = message.delta.new_element.WhichOneof("type")
+                self.elements.append((element_kind, getattr(message.delta.new_element, element_kind)))
+                if element_kind == "exception":
+                    self.exceptions += 1
+            elif kind == "page_info_changed":
+                self.query_string = message.page_info_changed.query_string
+            elif kind == "script_finished":
+                if message.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    return
+                self.elements = []  # st.rerun(): the next run follows
+
+
+def select(session, key, option):
+    """Keep a selectbox set to the option whose label ends with option"""
+    element = session.find_selectbox(key)
+    if element is None:
+        return False
+    index = next(i for i, label in enumerate(element.options) if label.endswith(option))
+    state = session.widgets.setdefault(element.id, widget_state(element.id))
+    # Newer Streamlit sends the selected label, older versions its index
+    if "raw_value" in Selectbox.DESCRIPTOR.fields_by_name:
+        state.string_value = element.options[index]
+    else:
+        state.int_value = index
+    return True
+
+
+def widget_state(widget_id):
+    """Return an empty WidgetState for a widget"""
+    state = BackMsg().rerun_script.widget_states.widgets.add()
+    state.id = widget_id
+    return state
+
+
+def chat_message(widget_id, text):
+    state = widget_state(widget_id)
+    # Newer Streamlit sends chat input as a ChatInputValue, older versions as a string trigger
+    if "chat_input_value" in state.DESCRIPTOR.fields_by_name:
+        state.chat_input_value.data = text
+    else:
+        state.string_trigger_value.data = text
+    return state
+
+
+async def simulate_user(index, http, url, args, recordings):
+    """Drive one session through its turns; returns its timings and errors"""
+    personalities, languages = list(PERSONALITIES), list(LANGUAGES)
+    rng = random.Random(index)
+    result = {"typed": [], "voice": [], "errors": 0, "turns": 0, "exceptions": 0}
+    session = BrowserSession(http, url, args.timeout)
+    try:
+        await session.connect()
+        await session.rerun()
+        for key, option in (("personality_selector", personalities[index % len(personalities)]),
+                            ("language_selector", languages[index % len(languages)])):
+            if select(session, key, option):
+                await session.rerun()
+
+        for turn in range(args.turns):
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * args.think_time)
+            started = time.perf_counter()
+            if args.voice_every and turn % args.voice_every == args.voice_every - 1:
+                recorder = session.find("component_instance", component="audio_recorder")
+                if recorder is None:
+                    result["errors"] += 1
+                    continue
+                # The recorder component's value is a JSON string of the WAV bytes
+                recording = widget_state(recorder)
+                recording.json_value = json.dumps(json.dumps(list(recordings[(index + turn) % len(recordings)])))
+                session.widgets[recorder] = recording
+                await session.rerun()
+                send = session.find("button", label_prefix="📤")
+                if send is None:
+                    result["errors"] += 1  # Not transcribed
+                    continue
+                trigger = widget_state(send)
+                trigger.trigger_value = True
+                await session.rerun(trigger)
+                result["voice"].append(time.perf_counter() - started)
+            else:
+                chat_input = session.find("chat_input")
+                if chat_input is None:
+                    # The run that sends a voice message does not draw the chat input
+                    await session.rerun()
+                    chat_input = session.find("chat_input")
+                if chat_input is None:
+                    result["errors"] += 1
+                    continue
+                await session.rerun(chat_message(chat_input, f"Question {turn} from user {index}"))
+                result["typed"].append(time.perf_counter() - started)
+            result["turns"] += 1
+    except (asyncio.TimeoutError, aiohttp.ClientError, ConnectionError):
+        result["errors"] += 1
+    finally:
+        result["exceptions"] = session.exceptions
+        await session.close()
+    return result
+
+
+def read_spans(log_path, started_at):
+    """Return {stage: [seconds]} of the server's spans recorded since a wall-clock time"""
+    spans = {}
+    try:
+        with open(log_path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["ts"] >= started_at:
+                    spans.setdefault(entry["stage"], []).append(entry["seconds"])
+    except (OSError, ValueError):
+        pass
+    return spans
+
+
+async def run_users(users, url, args, recordings):
+    async with aiohttp.ClientSession() as http:
+        return await asyncio.gather(*(simulate_user(i, http, url, args, recordings) for i in range(users)))
+
+
+def run_level(users, server, url, log_path, args, recordings):
+    """Run one concurrency level and return its measurements"""
+    baseline_rss, baseline_threads = process_stats(server.pid)
+    started_at = time.time()
+    started = time.perf_counter()
+    with ProcessSampler(server.pid) as sampler:
+        results = asyncio.run(run_users(users, url, args, recordings))
+    wall_seconds = time.perf_counter() - started
+    time.sleep(1.0)  # Let the last spans reach the log
+    spans = read_spans(log_path, started_at)
+
+    turns = sum(result["turns"] for result in results)
+    mb = 1 / 2 ** 20
+    return {
+        "users": users,
+        "turns": turns,
+        "wall_seconds": wall_seconds,
+        "turns_per_minute": turns / wall_seconds * 60 if wall_seconds else 0.0,
+        "errors": sum(result["errors"] for result in results),
+        "exceptions": sum(result["exceptions"] for result in results),
+        "script_run": percentiles(spans.get("script_run", [])),
+        "typed_turn": percentiles([t for result in results for t in result["typed"]]),
+        "voice_turn": percentiles([t for result in results for t in result["voice"]]),
+        "queue": {name: percentiles(spans.get(f"queue_{name}", [])) for name in QUEUES},
+        "baseline_rss_mb": baseline_rss * mb if baseline_rss is not None else None,
+        "peak_rss_mb": sampler.peak_rss * mb if sampler.peak_rss is not None else None,
+        "rss_per_session_mb": ((sampler.peak_rss - baseline_rss) / users * mb
+                               if baseline_rss is not None else None),
+        "baseline_threads": baseline_threads,
+        "peak_threads": sampler.peak_threads,
+    }
+
+
+def _ms(summary, key):
+    return f"{summary[key]:.0f}" if summary else "-"
+
+
+def _num(value, spec):
+    return format(value, spec) if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,4,16", help="comma-separated concurrent users (default 1,4,16)")
+    parser.add_argument("--turns", type=int, default=4, help="turns per user (default 4)")
+    parser.add_argument("--voice-every", type=int, default=2,
+                        help="every Nth turn is spoken, 0 for typed only (default 2)")
+    parser.add_argument("--think-time", type=float, default=1.0, help="mean seconds between a user's turns")
+    parser.add_argument("--recording-seconds", type=float, default=3.0, help="length of each spoken question")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds one script run may take")
+    parser.add_argument("--with-caches", action="store_true", help="keep the shared audio/transcript caches")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="print changes against an earlier --json result")
+    for field in dataclasses.fields(FakeConfig):
+        parser.add_argument(f"--{field.name.replace('_', '-')}", type=type(field.default) if field.default is not None else int,
+                            default=field.default, help=f"fake {field.name.replace('_', ' ')} (default {field.default})")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(",") if level.strip()]
+
+    config = FakeConfig(**{field.name: getattr(args, field.name) for field in dataclasses.fields(FakeConfig)})
+    scratch = tempfile.mkdtemp(prefix="voice-load-")
+    log_path = os.path.join(scratch, "spans.jsonl")
+    env = dict(os.environ, METRICS_JSON_LOG=log_path,
+               CONVERSATION_STORE_PATH=os.path.join(scratch, "conversations.sqlite3"),
+               AUDIO_STORE_DIR=os.path.join(scratch, "sessions"))
+    env.setdefault("SESSION_RATE_LIMIT", "0")
+    if not args.with_caches:
+        env.update(TTS_CACHE_MAX_BYTES="0", TTS_CACHE_DIR="", STT_CACHE_MAX_ENTRIES="0", RESPONSE_CACHE="false")
+
+    recordings = [make_recording(args.recording_seconds, seed=i) for i in range(16)]
+    server, port = start_server(config, env)
+    url = f"ws://127.0.0.1:{port}/_stcore/stream"
+    results = []
+    try:
+        for users in levels:
+            result = run_level(users, server, url, log_path, args, recordings)
+            results.append(result)
+            print(f"{users} users: {result['turns']} turns, {result['errors']} errors, "
+                  f"{result['wall_seconds']:.0f}s", file=sys.stderr)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    report = {
+        "commit": current_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "turns_per_user": args.turns,
+        "voice_every": args.voice_every,
+        "think_time": args.think_time,
+        "with_caches": args.with_caches,
+        "fakes": dataclasses.asdict(config),
+        "levels": results,
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    previous_levels = {level["users"]: level for level in (previous or {}).get("levels", [])}
+
+    print(f"{'users':>5}{'turns/min':>10}{'run p50':>9}{'run p95':>9}{'typed p95':>10}{'voice p95':>10}"
+          f"{'gemini q95':>11}{'stt q95':>9}{'tts q95':>9}{'peak MB':>9}{'MB/user':>9}{'threads':>9}{'errors':>8}")
+    for result in results:
+        queue = result["queue"]
+        line = (f"{result['users']:>5}{result['turns_per_minute']:>10.1f}"
+                f"{_ms(result['script_run'], 'p50_ms'):>9}{_ms(result['script_run'], 'p95_ms'):>9}"
+                f"{_ms(result['typed_turn'], 'p95_ms'):>10}{_ms(result['voice_turn'], 'p95_ms'):>10}"
+                f"{_ms(queue['gemini'], 'p95_ms'):>11}{_ms(queue['stt'], 'p95_ms'):>9}{_ms(queue['tts'], 'p95_ms'):>9}"
+                f"{_num(result['peak_rss_mb'], '.0f'):>9}{_num(result['rss_per_session_mb'], '.1f'):>9}"
+                f"{_num(result['peak_threads'], 'd'):>9}{result['errors'] + result['exceptions']:>8}")
+        old = previous_levels.get(result["users"])
+        if old and old["typed_turn"] and result["typed_turn"]:
+            line += (f"  typed p95 {result['typed_turn']['p95_ms'] - old['typed_turn']['p95_ms']:+.0f} ms"
+                     f" (vs {previous.get('commit')})")
+        print(line)
+    print("ms; run = server script run, typed/voice = turn as seen by the client, "
+          "q95 = p95 wait for a provider slot")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
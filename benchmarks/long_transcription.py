@@ -0,0 +1,70 @@
+"""Compare chunked parallel transcription with a single request on long clips.
+
+Usage:
+    python -m benchmarks.long_transcription talk.wav --language en-US --backend google
+
+Each clip is preprocessed once, then recognized as one request (the baseline)
+and as overlapping segments on the STT worker pool. Wall-clock times for both
+are printed side by side.
+"""
+import argparse
+import json
+import time
+
+from audio_preprocess import preprocess_audio
+from stt import STT_BACKEND, get_stt_backend, load_audio_data, segment_audio, transcribe_segments
+
+
+def timed(fn, *args, **kwargs):
+    """Run fn and return (result or error string, elapsed seconds)"""
+    started = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as e:
+        result = f"{type(e).__name__}: {e}"
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="long WAV recordings")
+    parser.add_argument("--language", default="en-US", help="stt_code to recognize (default en-US)")
+    parser.add_argument("--backend", default=STT_BACKEND, help=f"STT backend (default {STT_BACKEND})")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    backend = get_stt_backend(args.backend)
+    backend.load(args.language)
+    results = []
+    print(f"{'file':<32}{'audio (s)':>10}{'segments':>10}{'single (s)':>12}{'chunked (s)':>13}{'speedup':>9}")
+    for path in args.files:
+        with open(path, "rb") as f:
+            audio_bytes = preprocess_audio(f.read())
+        audio_data = load_audio_data(audio_bytes)
+        duration = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+        segments = segment_audio(audio_bytes)
+
+        single_text, single_seconds = timed(backend.recognize, audio_data, args.language)
+        chunked_text, chunked_seconds = timed(transcribe_segments, segments, args.language, args.backend)
+
+        speedup = single_seconds / chunked_seconds if chunked_seconds else 0.0
+        print(f"{path[-32:]:<32}{duration:>10.1f}{len(segments):>10}"
+              f"{single_seconds:>12.2f}{chunked_seconds:>13.2f}{speedup:>8.1f}x")
+        results.append({
+            "file": path,
+            "audio_seconds": duration,
+            "segments": len(segments),
+            "single_seconds": single_seconds,
+            "chunked_seconds": chunked_seconds,
+            "speedup": speedup,
+            "single_text": single_text,
+            "chunked_text": chunked_text,
+        })
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"backend": args.backend, "language": args.language, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Start-up benchmark: import cost and time to first paint of the Streamlit app.
+
+Usage:
+    python -m benchmarks.startup --samples 5 --json startup.json
+    python -m benchmarks.startup --compare startup.json
+
+Two reports are printed:
+
+- Import time of every top-level module the app touches, measured with
+  ``python -X importtime`` in a fresh interpreter each, split into the ones
+  imported when the script starts and the provider SDKs imported on first use.
+- Time to first paint: each sample starts a fresh interpreter that runs
+  app.py with Streamlit's AppTest, and reads the ``first_paint`` and
+  ``script_run`` spans the app records. Cold is the first run in a new process,
+  warm is a rerun in the same process.
+
+No external service is contacted; start-up must not need one.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.end_to_end import current_commit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported when app.py starts, and the ones deferred until first use
+STARTUP_MODULES = ["streamlit", "dotenv", "audio_player", "chat_context", "metrics", "response_cache", "tts", "tts_cache"]
+DEFERRED_MODULES = ["google.generativeai", "stt", "edge_tts", "audio_recorder_streamlit", "gtts"]
+
+_SAMPLE = """
+import json, sys, time
+script = sys.argv[1]
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+streamlit_seconds = time.perf_counter() - started
+at = AppTest.from_file(script, default_timeout=120)
+at.run()
+cold_seconds = time.perf_counter() - started - streamlit_seconds
+at.run()
+print(json.dumps({"streamlit_seconds": streamlit_seconds, "cold_run_seconds": cold_seconds,
+                  "exception": bool(at.exception)}))
+"""
+
+
+def import_seconds(module):
+    """Return the cumulative import time of module in a fresh interpreter, or None"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=ROOT)
+    if result.returncode != 0:
+        return None
+    for line in reversed(result.stderr.splitlines()):
+        # "import time:  self [us] | cumulative | package"; nested imports are indented
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module and not parts[2][1:].startswith(" "):
+            return int(parts[1]) / 1e6
+    return None
+
+
+def run_sample():
+    """Start the app once in a fresh process and return its start-up timings"""
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = os.path.join(tmp, "spans.jsonl")
+        env = dict(os.environ, METRICS_JSON_LOG=log_path)
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", _SAMPLE, os.path.join(ROOT, "app.py")], capture_output=True, text=True,
+                                cwd=ROOT, env=env)
+        process_seconds = time.perf_counter() - started
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "sample failed")
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        sample["process_seconds"] = process_seconds
+
+        spans = {"first_paint": [], "script_run": []}
+        with open(log_path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["stage"] in spans:
+                    spans[entry["stage"]].append(entry["seconds"])
+    for stage, values in spans.items():
+        if values:
+            sample[f"cold_{stage}"] = values[0]
+        if len(values) > 1:
+            sample[f"warm_{stage}"] = values[1]
+    return sample
+
+
+def summarize(values):
+    """Summarize seconds as p50/max/mean in milliseconds"""
+    if not values:
+        return None
+    return {
+        "count": len(values),
+        "p50_ms": float(np.percentile(values, 50)) * 1000,
+        "max_ms": max(values) * 1000,
+        "mean_ms": float(np.mean(values)) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=5, help="fresh processes to start (default 5)")
+    parser.add_argument("--skip-imports", action="store_true", help="skip the per-module import report")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="print p50 changes against an earlier --json result")
+    args = parser.parse_args()
+
+    imports = {}
+    if not args.skip_imports:
+        print(f"{'module':<28}{'import ms':>10}  when")
+        for group, modules in (("start-up", STARTUP_MODULES), ("first use", DEFERRED_MODULES)):
+            for module in modules:
+                seconds = import_seconds(module)
+                imports[module] = {"seconds": seconds, "when": group}
+                shown = f"{seconds * 1000:>10.0f}" if seconds is not None else f"{'missing':>10}"
+                print(f"{module:<28}{shown}  {group}")
+        print()
+
+    samples = [run_sample() for _ in range(args.samples)]
+    stages = [
+        ("process_seconds", "process start to exit"),
+        ("streamlit_seconds", "import streamlit"),
+        ("cold_first_paint", "cold: script to paint"),
+        ("cold_script_run", "cold: full script run"),
+        ("warm_first_paint", "warm: script to paint"),
+        ("warm_script_run", "warm: full script run"),
+    ]
+    summaries = {name: summarize([s[name] for s in samples if name in s]) for name, _ in stages}
+    report = {
+        "commit": current_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "samples": args.samples,
+        "imports": imports,
+        "startup": summaries,
+        "exceptions": sum(1 for s in samples if s["exception"]),
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    print(f"{args.samples} fresh starts, {report['exceptions']} with script exceptions")
+    print(f"{'stage':<26}{'p50 ms':>10}{'max ms':>10}" + ("  vs previous p50" if previous else ""))
+    for name, label in stages:
+        summary = summaries[name]
+        if summary is None:
+            print(f"{label:<26}{'-':>10}{'-':>10}")
+            continue
+        line = f"{label:<26}{summary['p50_ms']:>10.0f}{summary['max_ms']:>10.0f}"
+        old = (previous or {}).get("startup", {}).get(name)
+        if old:
+            line += f"  {summary['p50_ms'] - old['p50_ms']:+.0f} (vs {previous.get('commit')})"
+        print(line)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
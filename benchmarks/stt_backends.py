@@ -0,0 +1,101 @@
+"""Compare speech-to-text backends on latency and real-time factor.
+
+Usage:
+    python -m benchmarks.stt_backends recording1.wav recording2.wav \\
+        --language en-US --backends google,faster-whisper,vosk --repeat 3
+
+Model load time is measured separately from recognition, so the per-clip
+numbers show the steady-state cost once a local model is resident. The
+real-time factor (RTF) is recognition time divided by clip duration; below
+1.0 means faster than real time.
+"""
+import argparse
+import json
+import statistics
+import time
+
+from stt import STT_BACKENDS, get_stt_backend, load_audio_data
+
+
+def clip_duration(audio_data):
+    """Return the duration of AudioData in seconds"""
+    return len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+
+
+def benchmark_backend(name, clips, language_code, repeat):
+    """Time one backend over every clip and return a result dict"""
+    backend = get_stt_backend(name)
+    result = {"backend": name, "offline": backend.offline, "clips": []}
+
+    started = time.perf_counter()
+    try:
+        backend.load(language_code)
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+    result["load_seconds"] = time.perf_counter() - started
+
+    latencies = []
+    rtfs = []
+    for path, audio_data in clips:
+        duration = clip_duration(audio_data)
+        for _ in range(repeat):
+            started = time.perf_counter()
+            try:
+                text = backend.recognize(audio_data, language_code)
+                error = None
+            except Exception as e:
+                text, error = None, f"{type(e).__name__}: {e}"
+            elapsed = time.perf_counter() - started
+            latencies.append(elapsed)
+            rtfs.append(elapsed / duration if duration else 0.0)
+            result["clips"].append({
+                "file": path,
+                "duration_seconds": duration,
+                "latency_seconds": elapsed,
+                "rtf": rtfs[-1],
+                "text": text,
+                "error": error,
+            })
+
+    if latencies:
+        result["median_latency_seconds"] = statistics.median(latencies)
+        result["median_rtf"] = statistics.median(rtfs)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="WAV recordings to transcribe")
+    parser.add_argument("--language", default="en-US", help="stt_code to recognize (default en-US)")
+    parser.add_argument("--backends", default=",".join(STT_BACKENDS),
+                        help="comma-separated backends to compare")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per clip (default 3)")
+    parser.add_argument("--json", help="also write the full results to this file")
+    args = parser.parse_args()
+
+    clips = []
+    for path in args.files:
+        with open(path, "rb") as f:
+            clips.append((path, load_audio_data(f.read())))
+
+    results = [
+        benchmark_backend(name.strip(), clips, args.language, args.repeat)
+        for name in args.backends.split(",") if name.strip()
+    ]
+
+    print(f"{'backend':<16}{'load (s)':>10}{'median (s)':>12}{'median RTF':>12}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['backend']:<16}  unavailable: {result['error']}")
+            continue
+        print(f"{result['backend']:<16}{result['load_seconds']:>10.2f}"
+              f"{result.get('median_latency_seconds', 0):>12.3f}{result.get('median_rtf', 0):>12.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"language": args.language, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Token-budgeted conversation context for Gemini chat sessions.
+
+The most recent turns are sent verbatim as chat history while they fit in
+CONTEXT_TOKEN_BUDGET. Older turns are folded into a running summary that is
+updated incrementally, so the size of each request stays roughly constant no
+matter how long the conversation gets. Updating the summary is a model call,
+so it is started in the background after a reply (start_compaction) and its
+result taken up before the next one (apply_compaction).
+"""
+import os
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+SUMMARY_WORD_LIMIT = int(os.getenv("SUMMARY_WORD_LIMIT", "200"))
+
+SUMMARY_INSTRUCTION = (
+    "You maintain a running summary of a conversation between a user and an AI assistant. "
+    "Merge the new exchanges into the existing summary. Keep facts, names, preferences, "
+    "decisions and open questions; drop small talk. Write in the conversation's language, "
+    f"in plain prose of at most {SUMMARY_WORD_LIMIT} words."
+)
+
+
+def estimate_tokens(text):
+    """Cheaply estimate the token count of text without calling the API"""
+    if not text:
+        return 0
+    # CJK scripts are roughly one token per character, others about four characters per token
+    wide = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return wide + (len(text) - wide + 3) // 4
+
+
+def completed_turns(messages):
+    """Pair chat messages into (user, assistant) turns, skipping error replies"""
+    turns = []
+    pending_user = None
+    for message in messages:
+        if message["role"] == "user":
+            pending_user = message["content"]
+        elif pending_user is not None:
+            if not message.get("error"):
+                turns.append((pending_user, message["content"]))
+            pending_user = None
+    return turns
+
+
+def recent_turn_count(turns, budget=CONTEXT_TOKEN_BUDGET):
+    """Return how many of the newest turns fit in the token budget (at least one)"""
+    used = 0
+    count = 0
+    for user_text, assistant_text in reversed(turns):
+        used += estimate_tokens(user_text) + estimate_tokens(assistant_text)
+        if count and used > budget:
+            break
+        count += 1
+    return count
+
+
+def build_history(summary, turns):
+    """Build Gemini chat history from the running summary and verbatim turns"""
+    history = []
+    if summary:
+        history.append({"role": "user", "parts": [f"Summary of our earlier conversation: {summary}"]})
+        history.append({"role": "model", "parts": ["Understood, I'll keep that in mind."]})
+    for user_text, assistant_text in turns:
+        history.append({"role": "user", "parts": [user_text]})
+        history.append({"role": "model", "parts": [assistant_text]})
+    return history
+
+
+def history_tokens(history):
+    """Estimate the token count of a chat history"""
+    return sum(estimate_tokens(part) for entry in history for part in entry["parts"])
+
+
+def summarize_turns(model, summary, turns):
+    """Fold turns into the running summary, falling back to a plain digest on failure"""
+    exchanges = "\n".join(f"User: {user_text}\nAssistant: {assistant_text}"
+                          for user_text, assistant_text in turns)
+    try:
+        response = model.generate_content(
+            f"Existing summary:\n{summary or '(none)'}\n\nNew exchanges:\n{exchanges}"
+        )
+        new_summary = response.text.strip()
+        if new_summary:
+            return new_summary
+    except Exception:
+        pass
+    # Keep at least the gist of what the user asked so the context is not lost
+    asked = " ".join(f"The user asked: {user_text[:200]}" for user_text, _ in turns)
+    return f"{summary} {asked}".strip()
+
+
+class ConversationContext:
+    """Tracks the running summary and which turns have been folded into it"""
+
+    def __init__(self, budget=CONTEXT_TOKEN_BUDGET):
+        self.budget = budget
+        self.summary = ""
+        self.summarized_turns = 0
+        self._pending = None  # (Future of the new summary, turns it folds in)
+
+    def history(self, messages):
+        """Return chat history for the completed turns in messages"""
+        turns = completed_turns(messages)[self.summarized_turns:]
+        keep = recent_turn_count(turns, self.budget) if turns else 0
+        return build_history(self.summary, turns[len(turns) - keep:])
+
+    def start_compaction(self, messages, summarize):
+        """Start folding turns that no longer fit the budget into the summary
+
+        summarize(summary, turns) must return a Future of the new summary; it
+        is taken up by apply_compaction(). Does nothing while one is running.
+        """
+        if self._pending is not None:
+            return
+        evicted = self._evictable(messages)
+        if evicted:
+            self._pending = (summarize(self.summary, evicted), len(evicted))
+
+    def apply_compaction(self):
+        """Take up a finished background compaction; returns True if the summary changed
+
+        A compaction that is still running is left for a later call, and one
+        that failed is dropped so the next start_compaction() retries it.
+        """
+        if self._pending is None or not self._pending[0].done():
+            return False
+        future, count = self._pending
+        self._pending = None
+        try:
+            self.summary = future.result()
+        except Exception:
+            return False
+        self.summarized_turns += count
+        return True
+
+    def _evictable(self, messages):
+        turns = completed_turns(messages)[self.summarized_turns:]
+        if not turns:
+            return []
+        return turns[:len(turns) - recent_turn_count(turns, self.budget)]
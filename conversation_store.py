@@ -0,0 +1,331 @@
+"""Persistent store for conversations, so they survive refreshes and restarts.
+
+Each conversation has an id (kept in the page URL as ``?chat=<id>``), its
+personality, language and running summary, and one row per message keyed by
+(conversation, message index) with the handle of the reply's audio in the
+session audio store. The database is SQLite in WAL mode, so reads are not
+blocked by the writer. Writes are queued and committed in batches by a
+background thread, so saving a turn never adds to reply latency. Reads return
+one page of messages at a time, newest first, so resuming a long
+conversation only loads what is shown; a page always starts on a user
+message, so no turn is split between two pages. Conversations not updated
+for CONVERSATION_RETENTION seconds are deleted, and on_delete is told the
+ids of deleted conversations so their reply audio can go with them.
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_PATH = os.path.join(".cache", "conversations.sqlite3")
+DEFAULT_RETENTION = 30 * 24 * 60 * 60  # seconds
+DEFAULT_FLUSH_INTERVAL = 0.5  # seconds
+BATCH_SIZE = 64
+PRUNE_INTERVAL = 60 * 60
+
+_UPSERT_CONVERSATION = (
+    "INSERT INTO conversations (id, personality, language, created_at, updated_at)"
+    " VALUES (?, ?, ?, ?, ?)"
+    " ON CONFLICT(id) DO UPDATE SET personality = excluded.personality,"
+    " language = excluded.language, updated_at = excluded.updated_at"
+)
+
+
+class ConversationStore:
+    """SQLite (WAL) conversation store with batched background writes"""
+
+    def __init__(self, path=DEFAULT_STORE_PATH, retention=DEFAULT_RETENTION,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, on_delete=None):
+        self.path = path
+        self.retention = retention
+        self.flush_interval = flush_interval
+        self.on_delete = on_delete  # Called with the ids of deleted conversations
+        self._pending = []  # (sql, params) statements waiting for the writer
+        self._writing = False
+        self._flush_waiters = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._read_lock = threading.Lock()
+        self._stats = {"queued": 0, "written": 0, "batches": 0, "failed": 0}
+        self._last_prune = 0.0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._write_conn = sqlite3.connect(path, check_same_thread=False)
+        self._write_conn.execute("PRAGMA journal_mode=WAL")
+        self._write_conn.execute("PRAGMA synchronous=NORMAL")
+        self._write_conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            " id TEXT PRIMARY KEY,"
+            " personality TEXT NOT NULL,"
+            " language TEXT NOT NULL,"
+            " summary TEXT NOT NULL DEFAULT '',"
+            " summarized_turns INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._write_conn.execute(
+            "CREATE INDEX IF NOT EXISTS conversations_updated_at ON conversations (updated_at)"
+        )
+        self._write_conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " conversation TEXT NOT NULL,"
+            " idx INTEGER NOT NULL,"
+            " role TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " error INTEGER NOT NULL DEFAULT 0,"
+            " metrics TEXT,"
+            " audio TEXT,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (conversation, idx)) WITHOUT ROWID"
+        )
+        self._write_conn.commit()
+        self._prune()
+        self._read_conn = sqlite3.connect(path, check_same_thread=False)
+
+        self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def save_message(self, conversation, personality, language, index, message, audio=None):
+        """Queue message number index of a conversation (and its reply audio handle)"""
+        now = time.time()
+        metrics = message.get("metrics")
+        self._enqueue(
+            (_UPSERT_CONVERSATION, (conversation, personality, language, now, now)),
+            ("INSERT OR REPLACE INTO messages"
+             " (conversation, idx, role, content, error, metrics, audio, created_at)"
+             " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+             (conversation, index, message["role"], message["content"], int(bool(message.get("error"))),
+              json.dumps(metrics) if metrics else None, audio, now)),
+        )
+
+    def save_context(self, conversation, summary, summarized_turns):
+        """Queue the running summary and how many completed turns it covers"""
+        self._enqueue(
+            ("UPDATE conversations SET summary = ?, summarized_turns = ?, updated_at = ? WHERE id = ?",
+             (summary, summarized_turns, time.time(), conversation)),
+        )
+
+    def save_settings(self, conversation, personality, language):
+        """Queue a change of a saved conversation's personality or language"""
+        self._enqueue(
+            ("UPDATE conversations SET personality = ?, language = ?, updated_at = ? WHERE id = ?",
+             (personality, language, time.time(), conversation)),
+        )
+
+    def delete(self, conversation):
+        """Queue the deletion of a conversation and its messages"""
+        self._enqueue(
+            ("DELETE FROM messages WHERE conversation = ?", (conversation,)),
+            ("DELETE FROM conversations WHERE id = ?", (conversation,)),
+        )
+        self._notify_deleted([conversation])
+
+    def load(self, conversation):
+        """Return a conversation's settings, summary and message count, or None"""
+        self.flush()
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT personality, language, summary, summarized_turns FROM conversations WHERE id = ?",
+                (conversation,),
+            ).fetchone()
+            if row is None:
+                return None
+            count = self._read_conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE conversation = ?", (conversation,)
+            ).fetchone()[0]
+        personality, language, summary, summarized_turns = row
+        return {"personality": personality, "language": language, "summary": summary,
+                "summarized_turns": summarized_turns, "messages": count}
+
+    def page(self, conversation, before=None, limit=20):
+        """Return (index of the first message, [(message, audio handle)]) for about
+        limit messages preceding message number before (the newest if None)
+
+        A page that would start inside a turn is extended back to the turn's
+        user message, so turns counted by completed_turns() before the page
+        and chat_context.completed_turns() on it add up to the whole turns.
+        """
+        if before is None:
+            before = 1 << 62
+        columns = "SELECT idx, role, content, error, metrics, audio FROM messages"
+        with self._read_lock:
+            rows = self._read_conn.execute(
+                f"{columns} WHERE conversation = ? AND idx < ? ORDER BY idx DESC LIMIT ?",
+                (conversation, before, limit),
+            ).fetchall()
+            first = rows[-1][0] if rows else None
+            if rows and rows[-1][1] != "user":
+                start = self._read_conn.execute(
+                    "SELECT MAX(idx) FROM messages WHERE conversation = ? AND idx < ? AND role = 'user'",
+                    (conversation, first),
+                ).fetchone()[0]
+                if start is not None:
+                    rows += self._read_conn.execute(
+                        f"{columns} WHERE conversation = ? AND idx >= ? AND idx < ? ORDER BY idx DESC",
+                        (conversation, start, first),
+                    ).fetchall()
+        rows.reverse()
+        page = []
+        for _, role, content, error, metrics, audio in rows:
+            message = {"role": role, "content": content}
+            if error:
+                message["error"] = True
+            if metrics:
+                message["metrics"] = json.loads(metrics)
+            page.append((message, audio))
+        return (rows[0][0] if rows else 0), page
+
+    def completed_turns(self, conversation, before):
+        """Count the completed turns among the messages preceding message number before
+
+        Matches chat_context.completed_turns: a turn is a user message directly
+        followed by an assistant reply that is not an error.
+        """
+        with self._read_lock:
+            return self._read_conn.execute(
+                "SELECT COUNT(*) FROM messages AS reply JOIN messages AS prompt"
+                " ON prompt.conversation = reply.conversation AND prompt.idx = reply.idx - 1"
+                " WHERE reply.conversation = ? AND reply.idx < ?"
+                " AND reply.role = 'assistant' AND reply.error = 0 AND prompt.role = 'user'",
+                (conversation, before),
+            ).fetchone()[0]
+
+    def flush(self):
+        """Block until every queued write is committed"""
+        with self._cond:
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            try:
+                while (self._pending or self._writing) and self._thread.is_alive():
+                    self._cond.wait(1.0)
+            finally:
+                self._flush_waiters -= 1
+
+    def close(self):
+        """Write what is queued and stop the writer thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout=10)
+
+    def stats(self):
+        """Return the write counters and the number of queued statements"""
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot["pending"] = len(self._pending)
+        return snapshot
+
+    def _enqueue(self, *statements):
+        with self._cond:
+            self._pending.extend(statements)
+            self._stats["queued"] += len(statements)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                # Let a batch collect unless someone is waiting for it
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < BATCH_SIZE and not self._closed and not self._flush_waiters:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch, self._pending = self._pending, []
+                if not batch:
+                    return  # Closed with nothing left to write
+                self._writing = True
+
+            written = self._write(batch)
+            if time.time() - self._last_prune > PRUNE_INTERVAL:
+                self._prune()
+            with self._cond:
+                self._writing = False
+                self._stats["batches"] += 1
+                self._stats["written" if written else "failed"] += len(batch)
+                self._cond.notify_all()
+
+    def _write(self, batch):
+        with span("conversation_write") as stage:
+            try:
+                with self._write_conn:
+                    for sql, params in batch:
+                        self._write_conn.execute(sql, params)
+            except sqlite3.Error as e:
+                stage.outcome = "error"
+                logger.warning("Could not save %d conversation updates: %s", len(batch), e)
+                return False
+        return True
+
+    def _notify_deleted(self, conversations):
+        if self.on_delete is None or not conversations:
+            return
+        try:
+            self.on_delete(conversations)
+        except Exception as e:
+            logger.warning("Could not clean up after %d deleted conversations: %s", len(conversations), e)
+
+    def _prune(self):
+        self._last_prune = time.time()
+        if not self.retention:
+            return
+        cutoff = self._last_prune - self.retention
+        try:
+            expired = [row[0] for row in self._write_conn.execute(
+                "SELECT id FROM conversations WHERE updated_at < ?", (cutoff,)
+            )]
+            with self._write_conn:
+                self._write_conn.execute(
+                    "DELETE FROM messages WHERE conversation IN"
+                    " (SELECT id FROM conversations WHERE updated_at < ?)",
+                    (cutoff,),
+                )
+                self._write_conn.execute("DELETE FROM conversations WHERE updated_at < ?", (cutoff,))
+        except sqlite3.Error as e:
+            logger.warning("Could not delete expired conversations: %s", e)
+            return
+        self._notify_deleted(expired)
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def conversation_store_enabled():
+    """Return True unless the conversation store is switched off in the environment"""
+    return os.getenv("CONVERSATION_STORE", "true").lower() not in ("0", "false", "no")
+
+
+def _drop_conversation_audio(conversations):
+    """Delete the reply audio of deleted conversations from the session audio store"""
+    from audio_store import get_audio_store
+
+    audio_store = get_audio_store()
+    for conversation in conversations:
+        audio_store.drop_session(conversation)
+
+
+def get_conversation_store():
+    """Return the process-wide conversation store, configured from the environment"""
+    global _shared_store
+    if _shared_store is None:
+        with _shared_lock:
+            if _shared_store is None:
+                _shared_store = ConversationStore(
+                    path=os.getenv("CONVERSATION_STORE_PATH") or DEFAULT_STORE_PATH,
+                    retention=float(os.getenv("CONVERSATION_RETENTION", DEFAULT_RETENTION)),
+                    flush_interval=float(os.getenv("CONVERSATION_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)),
+                    on_delete=_drop_conversation_audio,
+                )
+    return _shared_store
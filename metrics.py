@@ -0,0 +1,142 @@
+"""Per-stage latency instrumentation.
+
+Wrap a stage in ``with span("stage", personality=..., language=...)`` to time
+it. Every finished span is:
+
+- observed in the ``voice_assistant_stage_seconds`` Prometheus histogram when
+  prometheus_client is installed (served on METRICS_PORT if set),
+- written as one JSON line to METRICS_JSON_LOG ("-" for stderr) if set,
+- kept in a bounded in-process buffer that the sidebar latency panel reads.
+
+Spans are tagged with personality, language, voice and outcome. The outcome
+defaults to "ok", becomes "error" when the block raises (unless the block
+already set another outcome), and can be set explicitly with
+``s.outcome = "cache_hit"``.
+
+Point-in-time values such as stored audio bytes are set with set_gauge() and
+exported as ``voice_assistant_<name>`` Prometheus gauges.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+TAG_NAMES = ("personality", "language", "voice", "outcome")
+RECENT_SPANS = int(os.getenv("METRICS_RECENT_SPANS", "2000"))
+
+_recent = deque(maxlen=RECENT_SPANS)
+_recent_lock = threading.Lock()
+_setup_lock = threading.Lock()
+_histogram = None
+_json_logger = None
+_configured = False
+_gauges = {}
+_gauge_values = {}
+
+
+def _configure():
+    """Set up the exporters once per process"""
+    global _histogram, _json_logger, _configured
+    if _configured:
+        return
+    with _setup_lock:
+        if _configured:
+            return
+        try:
+            import prometheus_client
+        except ImportError:  # Prometheus export is optional
+            prometheus_client = None
+        if prometheus_client is not None:
+            _histogram = prometheus_client.Histogram(
+                "voice_assistant_stage_seconds",
+                "Latency of each voice assistant pipeline stage",
+                ("stage",) + TAG_NAMES,
+                buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30),
+            )
+            port = os.getenv("METRICS_PORT")
+            if port:
+                prometheus_client.start_http_server(int(port))
+
+        log_target = os.getenv("METRICS_JSON_LOG")
+        if log_target:
+            _json_logger = logging.getLogger("voice_assistant.metrics")
+            _json_logger.setLevel(logging.INFO)
+            _json_logger.propagate = False
+            handler = logging.StreamHandler() if log_target == "-" else logging.FileHandler(log_target)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            _json_logger.addHandler(handler)
+        _configured = True
+
+
+class Span:
+    """A timed stage; set outcome or extra tags before the block ends"""
+
+    def __init__(self, stage, tags):
+        self.stage = stage
+        self.tags = tags
+        self.outcome = "ok"
+        self.seconds = None
+
+
+@contextmanager
+def span(stage, session=None, **tags):
+    """Time a pipeline stage and record it when the block exits"""
+    current = Span(stage, tags)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        if current.outcome == "ok":
+            current.outcome = "error"
+        raise
+    finally:
+        current.seconds = time.perf_counter() - started
+        record(stage, current.seconds, outcome=current.outcome, session=session, **current.tags)
+
+
+def record(stage, seconds, outcome="ok", session=None, **tags):
+    """Record a stage duration measured elsewhere"""
+    _configure()
+    labels = {name: str(tags.get(name) or "") for name in TAG_NAMES}
+    labels["outcome"] = outcome
+    entry = {"ts": time.time(), "stage": stage, "seconds": seconds, "session": session}
+    entry.update(labels)
+
+    with _recent_lock:
+        _recent.append(entry)
+    if _histogram is not None:
+        _histogram.labels(stage=stage, **labels).observe(seconds)
+    if _json_logger is not None:
+        _json_logger.info(json.dumps(entry, ensure_ascii=False))
+
+
+def set_gauge(name, value, description=""):
+    """Set a point-in-time value such as the bytes currently held by a store"""
+    _configure()
+    with _recent_lock:
+        _gauge_values[name] = value
+        gauge = _gauges.get(name)
+        if gauge is None and _histogram is not None:
+            import prometheus_client
+
+            gauge = _gauges[name] = prometheus_client.Gauge(f"voice_assistant_{name}", description or name)
+    if gauge is not None:
+        gauge.set(value)
+
+
+def gauges():
+    """Return the latest value of every gauge"""
+    with _recent_lock:
+        return dict(_gauge_values)
+
+
+def recent_spans(session=None, limit=50):
+    """Return the newest spans, optionally only those of one session"""
+    with _recent_lock:
+        spans = list(_recent)
+    if session is not None:
+        spans = [entry for entry in spans if entry["session"] == session]
+    return spans[-limit:][::-1]
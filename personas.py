@@ -0,0 +1,80 @@
+"""Personalities, languages and the Gemini system instruction built from them.
+
+Shared by the Streamlit app and the headless pipeline so both speak with the
+same voices and prompts.
+"""
+
+# Language configurations
+LANGUAGES = {
+    "English": {
+        "code": "en",
+        "stt_code": "en-US",
+        "tts_voice": "en-US-JennyNeural",
+        "flag": "🇺🇸",
+        "ai_instruction": "Respond in English."
+    },
+    "Spanish": {
+        "code": "es",
+        "stt_code": "es-ES",
+        "tts_voice": "es-ES-ElviraNeural",
+        "flag": "🇪🇸",
+        "ai_instruction": "Responde en español. (Respond in Spanish.)"
+    },
+    "French": {
+        "code": "fr",
+        "stt_code": "fr-FR",
+        "tts_voice": "fr-FR-DeniseNeural",
+        "flag": "🇫🇷",
+        "ai_instruction": "Réponds en français. (Respond in French.)"
+    },
+    "Chinese (Mandarin)": {
+        "code": "zh",
+        "stt_code": "zh-CN",
+        "tts_voice": "zh-CN-XiaoxiaoNeural",
+        "flag": "🇨🇳",
+        "ai_instruction": "用中文回复。(Respond in Mandarin Chinese.)"
+    },
+    "Japanese": {
+        "code": "ja",
+        "stt_code": "ja-JP",
+        "tts_voice": "ja-JP-NanamiNeural",
+        "flag": "🇯🇵",
+        "ai_instruction": "日本語で返答してください。(Respond in Japanese.)"
+    }
+}
+
+# Personality prompts
+PERSONALITIES = {
+    "General Assistant": {
+        "name": "General Assistant",
+        "prompt": "You are a helpful and friendly AI assistant. Provide clear, accurate, and helpful responses to any questions or tasks.",
+        "icon": "🤖",
+        "description": "A versatile AI helper for all your questions"
+    },
+    "Study Buddy": {
+        "name": "Study Buddy",
+        "prompt": "You are a patient and encouraging study companion. Help users learn by explaining concepts clearly, providing examples, and asking questions to check understanding. Break down complex topics into digestible parts.",
+        "icon": "📚",
+        "description": "Your patient learning companion"
+    },
+    "Fitness Coach": {
+        "name": "Fitness Coach",
+        "prompt": "You are an enthusiastic and motivating fitness coach. Provide workout advice, nutrition tips, and encouragement. Focus on health, safety, and sustainable fitness habits. Always remind users to consult healthcare professionals for medical concerns.",
+        "icon": "💪",
+        "description": "Your motivating fitness partner"
+    },
+    "Gaming Helper": {
+        "name": "Gaming Helper",
+        "prompt": "You are an experienced gaming enthusiast. Help with game strategies, tips, walkthroughs, and recommendations. Be excited about gaming while providing practical advice.",
+        "icon": "🎮",
+        "description": "Your gaming strategy advisor"
+    }
+}
+
+
+def system_instruction(personality, language):
+    """Return the Gemini system instruction for a personality and language"""
+    # Personality-based system instruction + language instruction
+    personality_prompt = PERSONALITIES[personality]["prompt"]
+    language_instruction = LANGUAGES[language]["ai_instruction"]
+    return f"{personality_prompt}\n\nIMPORTANT: {language_instruction}"
@@ -0,0 +1,356 @@
+"""Headless voice pipeline: speech recognition -> Gemini -> speech, without the UI.
+
+Usage:
+    python pipeline.py run questions/ --out results/ --workers 8 --personality "Study Buddy"
+    python pipeline.py run manifest.jsonl --language Spanish --format opus-24k
+    python pipeline.py serve --port 8080 --workers 8
+
+``run`` processes WAV recordings (.wav), text questions (.txt) and
+JSON-lines manifests ({"id", "audio" or "text", "personality", "language"})
+concurrently. Each finished turn is written as one JSON line (to stdout, or
+results.jsonl in --out) and its reply audio to <out>/<id>.<ext>, as soon as
+it completes. Throughput and per-stage latency are reported on stderr.
+
+``serve`` exposes the same turn over HTTP:
+
+    POST /turn  {"text" | "audio_base64", "personality", "language", "format"}
+                -> {"id", "transcript", "reply", "audio_base64", "mime", "timings"}
+    GET /health -> counters and scheduler state
+
+Turns reuse the app's recognition, prompts, response cache, sentence-chunked
+speech and output formats, and share the process-wide scheduler limits.
+"""
+import argparse
+import base64
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+# Load environment variables (before the modules below read their settings)
+load_dotenv()
+
+import numpy as np
+
+from audio_formats import encode_audio, get_output_format, join_encoded
+from metrics import span
+from personas import LANGUAGES, PERSONALITIES, system_instruction
+from response_cache import get_response_cache, response_cache_enabled
+from scheduler import get_scheduler
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = (".wav",)
+STAGES = ("stt", "llm", "tts", "total")
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(personality, language):
+    """Return the Gemini model for a personality and language, created once per process"""
+    key = (personality, language)
+    if key not in _models:
+        with _models_lock:
+            if key not in _models:
+                import google.generativeai as genai
+
+                genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+                with span("model_create", personality=personality, language=language):
+                    _models[key] = genai.GenerativeModel(
+                        "gemini-2.5-flash",
+                        system_instruction=system_instruction(personality, language),
+                    )
+    return _models[key]
+
+
+def generate_reply(prompt, personality, language, session=None):
+    """Return Gemini's reply to a single prompt, using the response cache if enabled"""
+    tags = {"personality": personality, "language": language}
+    if response_cache_enabled():
+        cached = get_response_cache().get(personality, language, prompt)
+        if cached:
+            return cached
+    model = get_model(personality, language)
+    with get_scheduler().slot("gemini", session), span("llm_generate", session=session, **tags):
+        response = model.start_chat(history=[]).send_message(prompt)
+        reply = "".join(chunk.text for chunk in response)
+    if response_cache_enabled():
+        get_response_cache().put(personality, language, prompt, reply)
+    return reply
+
+
+def process_turn(item_id, audio_bytes=None, text=None, personality="General Assistant",
+                 language="English", audio_format=None):
+    """Run one turn and return a result dict; failures are reported in "error"
+
+    The reply audio is returned as bytes under "audio" with its "mime" and
+    "extension".
+    """
+    from stt import transcribe_audio
+    from tts import stream_tts_audio
+
+    result = {"id": item_id, "personality": personality, "language": language, "timings": {}}
+    timings = result["timings"]
+    if personality not in PERSONALITIES or language not in LANGUAGES:
+        result["error"] = f"Unknown personality or language: {personality} / {language}"
+        return result
+    config = LANGUAGES[language]
+    session = f"pipeline-{item_id}"
+    tags = {"session": session, "personality": personality, "language": language,
+            "voice": config["tts_voice"]}
+    started = time.perf_counter()
+
+    if audio_bytes is not None:
+        text = transcribe_audio(audio_bytes, config["stt_code"], tags=tags)
+        timings["stt"] = time.perf_counter() - started
+        if text is None:
+            result["error"] = "No speech recognized"
+            return result
+        if text.startswith(("Error:", "Speech service error:")):
+            result["error"] = text
+            return result
+    result["transcript"] = text
+
+    llm_started = time.perf_counter()
+    try:
+        reply = generate_reply(text, personality, language, session)
+    except Exception as e:
+        result["error"] = f"Gemini error: {e}"
+        return result
+    timings["llm"] = time.perf_counter() - llm_started
+    result["reply"] = reply
+
+    tts_started = time.perf_counter()
+    audio_format = audio_format or get_output_format()
+    audio_parts = list(stream_tts_audio(reply, config["tts_voice"], tags=tags))
+    if audio_parts:
+        # Chunk encodings are cached and shared with the app; the whole reply is not
+        encoded = [encode_audio(audio_part, audio_format, tags) for audio_part in audio_parts]
+        audio_data, used_format = join_encoded(encoded, audio_parts, audio_format, tags)
+        result.update(audio=audio_data, mime=used_format.mime, extension=used_format.extension)
+    timings["tts"] = time.perf_counter() - tts_started
+    timings["total"] = time.perf_counter() - started
+    return result
+
+
+def load_items(paths, personality, language):
+    """Yield work items from recordings, text files, manifests and directories"""
+    for path in paths:
+        if os.path.isdir(path):
+            children = sorted(os.path.join(path, name) for name in os.listdir(path))
+            yield from load_items([p for p in children if os.path.isfile(p)], personality, language)
+            continue
+        stem, extension = os.path.splitext(os.path.basename(path))
+        extension = extension.lower()
+        if extension == ".jsonl":
+            base = os.path.dirname(path)
+            with open(path, encoding="utf-8") as f:
+                for number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    item = {"id": str(entry.get("id") or f"{stem}-{number}"),
+                            "personality": entry.get("personality", personality),
+                            "language": entry.get("language", language)}
+                    if entry.get("audio"):
+                        with open(os.path.join(base, entry["audio"]), "rb") as audio_file:
+                            item["audio_bytes"] = audio_file.read()
+                    else:
+                        item["text"] = entry.get("text", "")
+                    yield item
+        elif extension in AUDIO_EXTENSIONS:
+            with open(path, "rb") as f:
+                yield {"id": stem, "audio_bytes": f.read(), "personality": personality, "language": language}
+        elif extension == ".txt":
+            with open(path, encoding="utf-8") as f:
+                yield {"id": stem, "text": f.read().strip(), "personality": personality, "language": language}
+
+
+def summarize(results, wall_seconds):
+    """Return throughput and p50/p95/p99 milliseconds per stage"""
+    ok = [result for result in results if "error" not in result]
+    report = {
+        "items": len(results),
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "wall_seconds": wall_seconds,
+        "turns_per_minute": len(ok) / wall_seconds * 60 if wall_seconds else 0.0,
+        "stages": {},
+    }
+    for stage in STAGES:
+        values = [result["timings"][stage] for result in ok if stage in result["timings"]]
+        if values:
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+            report["stages"][stage] = {"count": len(values), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99}
+    return report
+
+
+def run_batch(items, workers=4, out_dir=None, audio_format=None, output=None):
+    """Process items concurrently, writing each result as soon as it finishes"""
+    output = output or sys.stdout
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    results = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline") as pool:
+        futures = [
+            pool.submit(process_turn, item["id"], item.get("audio_bytes"), item.get("text"),
+                        item["personality"], item["language"], audio_format)
+            for item in items
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            audio_data = result.pop("audio", None)
+            if audio_data and out_dir:
+                result["audio_file"] = f"{result['id']}.{result['extension']}"
+                with open(os.path.join(out_dir, result["audio_file"]), "wb") as f:
+                    f.write(audio_data)
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            results.append(result)
+    return summarize(results, time.perf_counter() - started)
+
+
+class TurnHandler(BaseHTTPRequestHandler):
+    """POST /turn runs one turn; GET /health returns counters"""
+
+    pool = None
+    audio_format = None
+    personality = "General Assistant"
+    language = "English"
+    counters = {"turns": 0, "errors": 0}
+    counters_lock = threading.Lock()
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send(404, {"error": "not found"})
+            return
+        with self.counters_lock:
+            body = dict(self.counters)
+        body["scheduler"] = get_scheduler().stats()
+        self._send(200, body)
+
+    def do_POST(self):
+        if self.path != "/turn":
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("the body must be a JSON object")
+            audio_bytes = base64.b64decode(request["audio_base64"]) if request.get("audio_base64") else None
+            audio_format = get_output_format(request["format"]) if request.get("format") else self.audio_format
+            personality = request.get("personality", self.personality)
+            language = request.get("language", self.language)
+            # Unknown settings are the client's mistake, not an upstream failure
+            if personality not in PERSONALITIES or language not in LANGUAGES:
+                raise ValueError(f"unknown personality or language: {personality} / {language}")
+        except (ValueError, TypeError) as e:
+            self._send(400, {"error": f"Bad request: {e}"})
+            return
+        if audio_bytes is None and not request.get("text"):
+            self._send(400, {"error": "Send text or audio_base64"})
+            return
+
+        future = self.pool.submit(
+            process_turn, request.get("id") or uuid.uuid4().hex[:12], audio_bytes, request.get("text"),
+            personality, language, audio_format,
+        )
+        result = future.result()
+        audio_data = result.pop("audio", None)
+        if audio_data:
+            result["audio_base64"] = base64.b64encode(audio_data).decode("ascii")
+        with self.counters_lock:
+            self.counters["turns"] += 1
+            self.counters["errors"] += "error" in result
+        self._send(200 if "error" not in result else 502, result)
+
+    def log_message(self, format, *args):
+        logger.info("%s %s", self.address_string(), format % args)
+
+    def _send(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def serve(host="127.0.0.1", port=8080, workers=4, audio_format=None, personality="General Assistant",
+          language="English"):
+    """Serve POST /turn until interrupted; at most workers turns run at once
+
+    personality and language are used for requests that do not name their own.
+    """
+    TurnHandler.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline")
+    TurnHandler.audio_format = audio_format
+    TurnHandler.personality = personality
+    TurnHandler.language = language
+    server = ThreadingHTTPServer((host, port), TurnHandler)
+    logger.info("Serving the voice pipeline on http://%s:%d", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        TurnHandler.pool.shutdown()
+
+
+def print_report(report, stream=sys.stderr):
+    print(f"{report['items']} items, {report['ok']} ok, {report['failed']} failed, "
+          f"{report['turns_per_minute']:.1f} turns/min over {report['wall_seconds']:.1f}s", file=stream)
+    print(f"{'stage':<8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}", file=stream)
+    for stage, summary in report["stages"].items():
+        print(f"{stage:<8}{summary['p50_ms']:>10.0f}{summary['p95_ms']:>10.0f}{summary['p99_ms']:>10.0f}",
+              file=stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="process files and directories")
+    run_parser.add_argument("inputs", nargs="+", help="recordings, .txt questions, .jsonl manifests or directories")
+    run_parser.add_argument("--out", help="directory for results.jsonl and reply audio (default: JSON lines on stdout)")
+    run_parser.add_argument("--report", help="also write the throughput report to this JSON file")
+    serve_parser = commands.add_parser("serve", help="serve POST /turn over HTTP")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    for sub in (run_parser, serve_parser):
+        sub.add_argument("--workers", type=int, default=4, help="turns processed at once (default 4)")
+        sub.add_argument("--personality", default="General Assistant", choices=list(PERSONALITIES))
+        sub.add_argument("--language", default="English", choices=list(LANGUAGES))
+        sub.add_argument("--format", help="output audio format (default TTS_OUTPUT_FORMAT)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    audio_format = get_output_format(args.format)
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers, audio_format, args.personality, args.language)
+        return
+
+    items = load_items(args.inputs, args.personality, args.language)
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        with open(os.path.join(args.out, "results.jsonl"), "w", encoding="utf-8") as output:
+            report = run_batch(items, args.workers, args.out, audio_format, output)
+    else:
+        report = run_batch(items, args.workers, None, audio_format)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
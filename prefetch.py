@@ -0,0 +1,262 @@
+"""Speculative synthesis in the voice a user is likely to switch to next.
+
+When a session starts or changes language, the languages it is likely to
+pick next are guessed from the language switches seen by this process and
+from the browser's Accept-Language header. Each language's fixed phrases and
+its most often served cached replies (see response_cache) are then
+synthesized with that language's voice, chunked the same way as a reply, into
+the shared audio cache and encoded in the output format, so the first turn
+after a switch does not wait for a cold voice.
+
+Speculation must never delay a user's turn, so it runs on one background
+thread, one request at a time, outside the scheduler's TTS lane, and only:
+
+- while no synthesis for a user is running or queued,
+- while this process used less than TTS_PREFETCH_CPU_LIMIT of a core over
+  the last second,
+- within TTS_PREFETCH_REQUESTS_PER_MINUTE requests and
+  TTS_PREFETCH_CHARS_PER_MINUTE characters across all sessions.
+
+Jobs that cannot start within TTS_PREFETCH_MAX_WAIT seconds are dropped.
+
+Synthesis itself is network I/O on the engine's shared event loop, so these
+budgets, not thread priority, are what keep it out of the way; it uses Edge
+TTS only and does not feed the latency windows and circuit breakers that
+route users' replies (see TTSEngine.speculate). The prefetch thread runs at
+the lowest CPU priority, which on Linux also covers the ffmpeg encodes it
+starts.
+"""
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from metrics import set_gauge, span
+
+DEFAULT_REQUESTS_PER_MINUTE = 12
+DEFAULT_CHARS_PER_MINUTE = 3000
+DEFAULT_CPU_LIMIT = 0.5  # share of one core
+DEFAULT_MAX_WAIT = 120  # seconds
+MAX_QUEUE = 64
+IDLE_POLL = 0.25  # seconds between admission checks
+CPU_WINDOW = 1.0  # seconds the CPU use is measured over
+
+
+def prefetch_enabled():
+    """Return True unless speculative voice prefetching is switched off in the environment"""
+    return os.getenv("TTS_PREFETCH", "true").lower() not in ("0", "false", "no")
+
+
+def accepted_languages(headers, languages):
+    """Return the names in languages matching the browser's Accept-Language, best first"""
+    ranked = []
+    for position, item in enumerate((headers or {}).get("Accept-Language", "").split(",")):
+        tag, _, params = item.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        ranked.append((-quality, position, tag.split("-")[0].lower()))
+    names = []
+    for _, _, code in sorted(ranked):
+        for name, config in languages.items():
+            if config["code"] == code and name not in names:
+                names.append(name)
+    return names
+
+
+class VoicePrefetcher:
+    """Budgeted background synthesis of texts for voices a user may switch to"""
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, chars_per_minute=DEFAULT_CHARS_PER_MINUTE,
+                 cpu_limit=DEFAULT_CPU_LIMIT, max_wait=DEFAULT_MAX_WAIT):
+        self.requests_per_minute = requests_per_minute
+        self.chars_per_minute = chars_per_minute
+        self.cpu_limit = cpu_limit
+        self.max_wait = max_wait
+        self._jobs = deque()  # (queued at, text, voice, output format)
+        self._queued = set()  # (text, voice) waiting in _jobs
+        self._spent = deque()  # (time, characters) of the requests of the last minute
+        self._switches = Counter()  # (from language, to language) -> count
+        self._stats = {"queued": 0, "chunks": 0, "chars": 0, "skipped_cached": 0, "dropped": 0, "failed": 0}
+        self._cond = threading.Condition()
+        self._cpu_sample = (time.monotonic(), time.process_time())
+        self._cpu_use = 0.0
+        self._thread = threading.Thread(target=self._run, name="tts-prefetch", daemon=True)
+        self._thread.start()
+
+    def record_switch(self, old_language, new_language):
+        """Count a user switching language; the counts drive likely_languages()"""
+        with self._cond:
+            self._switches[(old_language, new_language)] += 1
+
+    def likely_languages(self, language, headers=None, languages=None, limit=1):
+        """Guess the languages a user in language is likely to switch to next"""
+        with self._cond:
+            switched_to = [(count, new) for (old, new), count in self._switches.items() if old == language]
+        guesses = [new for _, new in sorted(switched_to, reverse=True)]
+        guesses += accepted_languages(headers, languages or {})
+        likely = []
+        for name in guesses:
+            if name != language and name not in likely:
+                likely.append(name)
+        return likely[:limit]
+
+    def request(self, texts, voice, output_format=None):
+        """Queue texts to be spoken with voice when there is spare capacity
+
+        Only the queue is touched here, on the caller's (script) thread; texts
+        that turn out to be cached already are skipped by the worker.
+        """
+        now = time.monotonic()
+        with self._cond:
+            for text in texts:
+                if not text or (text, voice) in self._queued:
+                    continue
+                if len(self._jobs) >= MAX_QUEUE:
+                    self._stats["dropped"] += 1
+                    continue
+                self._jobs.append((now, text, voice, output_format))
+                self._queued.add((text, voice))
+                self._stats["queued"] += 1
+            self._cond.notify_all()
+        self._publish()
+
+    def stats(self):
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot["pending"] = len(self._jobs)
+            snapshot["cpu_use"] = self._cpu_use
+        return snapshot
+
+    def _run(self):
+        try:
+            # Linux schedules threads individually, and the ffmpeg processes
+            # started from this thread inherit its priority
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                queued_at, text, voice, output_format = self._jobs[0]
+            if time.monotonic() - queued_at > self.max_wait:
+                self._finish_job(dropped=True)
+                continue
+            self._finish_job(dropped=not self._speak(text, voice, output_format))
+
+    def _speak(self, text, voice, output_format):
+        """Synthesize and cache text; False if the budget never allowed it"""
+        from audio_formats import encode_audio
+        from tts import get_tts_engine, split_into_chunks, strip_markdown
+        from tts_cache import cache_key, get_tts_cache
+
+        audio_cache = get_tts_cache()
+        engine = get_tts_engine()
+        # Membership checks leave the cache's hit and miss counters to real replies
+        missing = [chunk for chunk in split_into_chunks(strip_markdown(text))
+                   if cache_key(chunk, voice) not in audio_cache]
+        if not missing:
+            with self._cond:
+                self._stats["skipped_cached"] += 1
+            return True
+        parts = []  # Newly synthesized; cached chunks were encoded by whoever cached them
+        for chunk in missing:
+            key = cache_key(chunk, voice)
+            if not self._wait_for_capacity(len(chunk)):
+                return False
+            if key in audio_cache:
+                continue  # A reply spoke it while this job waited
+            with span("tts_prefetch", voice=voice) as stage:
+                try:
+                    future = engine.submit(engine.speculate(chunk, voice))
+                    audio_data, provider = future.result()
+                except Exception:
+                    audio_data, provider = None, None
+                if not audio_data:
+                    stage.outcome = "failed"
+                # Fallback audio is not the voice users will hear, so it is not kept
+                elif not engine.cacheable(provider):
+                    audio_data = None
+                    stage.outcome = f"{provider}_discarded"
+            with self._cond:
+                self._stats["chunks" if audio_data else "failed"] += 1
+                self._stats["chars"] += len(chunk)
+            if not audio_data:
+                return True
+            audio_cache.put(key, audio_data)
+            parts.append(audio_data)
+        # Encoding runs ffmpeg, so it waits for spare capacity too; chunks are
+        # encoded one by one, as replies are
+        if output_format is not None and parts and self._wait_for_capacity(0):
+            for audio_data in parts:
+                encode_audio(audio_data, output_format)
+        return True
+
+    def _wait_for_capacity(self, chars):
+        """Block until a request of chars characters may start; False if it never may"""
+        from scheduler import get_scheduler
+
+        deadline = time.monotonic() + self.max_wait
+        while time.monotonic() < deadline:
+            tts = get_scheduler().stats()["tts"]
+            if not tts["running"] and not tts["queued"] and self._cpu_ok() and self._spend(chars):
+                return True
+            time.sleep(IDLE_POLL)
+        return False
+
+    def _cpu_ok(self):
+        now, cpu = time.monotonic(), time.process_time()
+        started, started_cpu = self._cpu_sample
+        if now - started >= CPU_WINDOW:
+            self._cpu_use = (cpu - started_cpu) / (now - started)
+            self._cpu_sample = (now, cpu)
+        return self._cpu_use < self.cpu_limit
+
+    def _spend(self, chars):
+        now = time.monotonic()
+        with self._cond:
+            while self._spent and now - self._spent[0][0] > 60:
+                self._spent.popleft()
+            if chars and (len(self._spent) >= self.requests_per_minute
+                          or sum(spent for _, spent in self._spent) + chars > self.chars_per_minute):
+                return False
+            if chars:
+                self._spent.append((now, chars))
+            return True
+
+    def _finish_job(self, dropped=False):
+        with self._cond:
+            _, text, voice, _ = self._jobs.popleft()
+            self._queued.discard((text, voice))
+            if dropped:
+                self._stats["dropped"] += 1
+        self._publish()
+
+    def _publish(self):
+        stats = self.stats()
+        set_gauge("tts_prefetch_pending", stats["pending"], "Speculative synthesis jobs waiting")
+        set_gauge("tts_prefetch_chunks", stats["chunks"], "Chunks synthesized speculatively")
+
+
+_shared_prefetcher = None
+_shared_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """Return the process-wide voice prefetcher, configured from the environment"""
+    global _shared_prefetcher
+    if _shared_prefetcher is None:
+        with _shared_lock:
+            if _shared_prefetcher is None:
+                _shared_prefetcher = VoicePrefetcher(
+                    requests_per_minute=int(os.getenv("TTS_PREFETCH_REQUESTS_PER_MINUTE",
+                                                      DEFAULT_REQUESTS_PER_MINUTE)),
+                    chars_per_minute=int(os.getenv("TTS_PREFETCH_CHARS_PER_MINUTE", DEFAULT_CHARS_PER_MINUTE)),
+                    cpu_limit=float(os.getenv("TTS_PREFETCH_CPU_LIMIT", DEFAULT_CPU_LIMIT)),
+                    max_wait=float(os.getenv("TTS_PREFETCH_MAX_WAIT", DEFAULT_MAX_WAIT)),
+                )
+    return _shared_prefetcher
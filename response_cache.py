@@ -0,0 +1,181 @@
+"""Shared cache of Gemini replies for repeated prompts.
+
+Replies are keyed by (personality, language, normalized prompt) and stored in
+a local SQLite database so they are shared by every session and survive
+restarts. Entries expire after a TTL and the least recently used entries are
+evicted once the cache holds more than its maximum number of entries.
+
+Prompts may carry personal details, so they never leave this module: per-key
+statistics identify entries by their key hash and are meant for operators
+(hits are logged at DEBUG level), while users only see aggregate counts.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from metrics import set_gauge
+from tts_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "responses.sqlite3")
+DEFAULT_TTL = 24 * 60 * 60  # seconds
+DEFAULT_MAX_ENTRIES = 5000
+
+_TRAILING_PUNCTUATION_RE = re.compile(r"[\s.!?。！？]+$")
+
+
+def normalize_prompt(prompt):
+    """Normalize a prompt so near-identical questions share one entry"""
+    return _TRAILING_PUNCTUATION_RE.sub("", normalize_text(prompt).casefold())
+
+
+def response_key(personality, language, prompt):
+    """Return the cache key for a prompt sent to a personality in a language"""
+    payload = "\x1f".join((personality, language, normalize_prompt(prompt)))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed reply cache with TTL, size cap, LRU eviction and per-key hits"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " personality TEXT NOT NULL,"
+            " language TEXT NOT NULL,"
+            " prompt TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+        )
+        self._conn.commit()
+
+    def get(self, personality, language, prompt):
+        """Return the cached reply, or None if missing or expired"""
+        key = response_key(personality, language, prompt)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                self._publish()
+                return None
+            self._conn.execute(
+                "UPDATE responses SET hits = hits + 1, last_used = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        self._publish()
+        logger.debug("Response cache hit for key %s (%s / %s)", key[:16], personality, language)
+        return row[0]
+
+    def put(self, personality, language, prompt, response):
+        """Store a reply and evict the least recently used entries over the cap"""
+        if not response:
+            return
+        key = response_key(personality, language, prompt)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses"
+                " (key, personality, language, prompt, response, created_at, last_used, hits)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (key, personality, language, normalize_prompt(prompt), response, now, now),
+            )
+            self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def key_stats(self, limit=10):
+        """Return the most frequently hit entries as dicts, identified by key hash
+
+        For operators only; the prompts themselves are not returned.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, personality, language, hits, last_used FROM responses"
+                " ORDER BY hits DESC, last_used DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {"key": k[:16], "personality": p, "language": l, "hits": h, "last_used": u}
+            for k, p, l, h, u in rows
+        ]
+
+    def top_responses(self, personality, language, limit=5):
+        """Return the most frequently hit replies for a personality and language"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT response FROM responses WHERE personality = ? AND language = ? AND created_at >= ?"
+                " ORDER BY hits DESC, last_used DESC LIMIT ?",
+                (personality, language, time.time() - self.ttl, limit),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def stats(self):
+        """Return hit/miss counters for this process and the number of entries"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _publish(self):
+        set_gauge("response_cache_hits", self.hits, "Response cache hits in this process")
+        set_gauge("response_cache_misses", self.misses, "Response cache misses in this process")
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def response_cache_enabled():
+    """Return True if the response cache is switched on in the environment"""
+    return os.getenv("RESPONSE_CACHE", "false").lower() in ("1", "true", "yes")
+
+
+def get_response_cache():
+    """Return the process-wide response cache, configured from the environment"""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                _shared_cache = ResponseCache(
+                    path=os.getenv("RESPONSE_CACHE_PATH", DEFAULT_CACHE_PATH),
+                    ttl=float(os.getenv("RESPONSE_CACHE_TTL", DEFAULT_TTL)),
+                    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                )
+    return _shared_cache
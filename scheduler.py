@@ -0,0 +1,277 @@
+"""Process-wide scheduling of outbound Gemini, speech recognition and TTS jobs.
+
+Every Streamlit session runs on its own script thread, so without a shared
+limit a burst of users starts an unbounded number of provider calls at once.
+Each provider has a lane with a concurrency limit. Jobs that cannot start
+wait in the lane, queued per session and granted round-robin across
+sessions, so one session's long reply cannot starve everyone else. A lane
+whose queue is full, or a job that waits longer than SCHEDULER_MAX_WAIT,
+is shed with Overloaded instead of letting latency grow without bound;
+callers degrade (for example by skipping speech) when a lane is saturated.
+Follow-up jobs of work that was already admitted (the later chunks of a
+reply being spoken) pass admitted=True: they are queued past the cap and
+wait as long as it takes, so admitted work is never cut off half-way.
+Sessions are also limited to SESSION_RATE_LIMIT turns per minute.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+from metrics import record, set_gauge
+
+PROVIDERS = ("gemini", "stt", "tts")
+DEFAULT_LIMITS = {"gemini": 8, "stt": 4, "tts": 4}
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_MAX_WAIT = 30.0
+DEFAULT_SESSION_RATE_LIMIT = 20
+RATE_WINDOW = 60  # seconds the turn rate is counted over
+WAIT_POLL_SECONDS = 0.5
+
+
+class Overloaded(Exception):
+    """Raised when a job is shed because its provider is saturated"""
+
+
+class RateLimited(Overloaded):
+    """Raised when a session exceeds its turn rate; retry_after is in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many requests, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    """A waiting job; on_grant is called (under the lane lock) when it may start"""
+
+    def __init__(self, session, on_grant):
+        self.session = session
+        self.on_grant = on_grant
+        self.granted = False
+
+
+class Lane:
+    """Concurrency limit plus a per-session round-robin wait queue for one provider"""
+
+    def __init__(self, name, limit, max_queue=DEFAULT_MAX_QUEUE):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self._running = 0
+        self._waiting = OrderedDict()  # session -> deque of tickets, in turn order
+        self._queued = 0
+        self._lock = threading.Lock()
+
+    def enqueue(self, session, on_grant, admitted=False):
+        """Queue a job; it is granted at once if a slot is free
+
+        Raises Overloaded if the queue is full, unless the job is admitted.
+        """
+        ticket = _Ticket(session, on_grant)
+        with self._lock:
+            if self._running < self.limit and not self._queued:
+                self._grant(ticket)
+            elif self.max_queue and self._queued >= self.max_queue and not admitted:
+                raise Overloaded(f"{self.name} queue is full")
+            else:
+                self._waiting.setdefault(session, deque()).append(ticket)
+                self._queued += 1
+        self._publish()
+        return ticket
+
+    def cancel(self, ticket):
+        """Withdraw a waiting job; returns False if it had already been granted"""
+        with self._lock:
+            if ticket.granted:
+                return False
+            queue = self._waiting.get(ticket.session)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                self._queued -= 1
+                if not queue:
+                    del self._waiting[ticket.session]
+        self._publish()
+        return True
+
+    def release(self):
+        """Free a slot and grant it to the next session in turn"""
+        with self._lock:
+            self._running -= 1
+            if self._waiting:
+                session, queue = self._waiting.popitem(last=False)
+                ticket = queue.popleft()
+                self._queued -= 1
+                if queue:
+                    # The session goes to the back of the rotation
+                    self._waiting[session] = queue
+                self._grant(ticket)
+        self._publish()
+
+    def position(self, ticket):
+        """Return how many jobs will start before this one, plus one"""
+        with self._lock:
+            if ticket.granted:
+                return 0
+            sessions = list(self._waiting.items())
+            rounds = next((queue.index(ticket) for session, queue in sessions
+                           if session == ticket.session and ticket in queue), 0)
+            ahead = 0
+            before = True
+            for session, queue in sessions:
+                if session == ticket.session:
+                    before = False
+                    ahead += rounds
+                    continue
+                ahead += min(len(queue), rounds + 1 if before else rounds)
+        return ahead + 1
+
+    def saturated(self):
+        """Return True when every slot is busy and jobs are already waiting"""
+        with self._lock:
+            return self._running >= self.limit and self._queued > 0
+
+    def stats(self):
+        with self._lock:
+            return {"running": self._running, "queued": self._queued, "limit": self.limit}
+
+    # Callers hold self._lock
+    def _grant(self, ticket):
+        self._running += 1
+        ticket.granted = True
+        ticket.on_grant()
+
+    def _publish(self):
+        stats = self.stats()
+        set_gauge(f"{self.name}_running", stats["running"], f"{self.name} jobs running")
+        set_gauge(f"{self.name}_queued", stats["queued"], f"{self.name} jobs waiting for a slot")
+
+
+class Scheduler:
+    """Lanes for every provider plus the per-session turn rate limit"""
+
+    def __init__(self, limits=None, max_queue=DEFAULT_MAX_QUEUE, max_wait=DEFAULT_MAX_WAIT,
+                 session_rate_limit=DEFAULT_SESSION_RATE_LIMIT):
+        limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.lanes = {name: Lane(name, limits[name], max_queue) for name in PROVIDERS}
+        self.max_wait = max_wait
+        self.session_rate_limit = session_rate_limit
+        self._turns = {}  # session -> deque of recent turn start times
+        self._last_rate_sweep = time.monotonic()
+        self._rate_lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, provider, session=None, on_wait=None, admitted=False):
+        """Run the block once a slot is free; on_wait(position) is called while queued
+
+        An admitted job is never shed (see the module docstring).
+        """
+        lane = self.lanes[provider]
+        granted = threading.Event()
+        started = time.perf_counter()
+        try:
+            ticket = lane.enqueue(session, granted.set, admitted)
+        except Overloaded:
+            record(f"queue_{provider}", 0.0, outcome="shed", session=session)
+            raise
+        try:
+            while not granted.wait(WAIT_POLL_SECONDS):
+                if self.max_wait and not admitted and time.perf_counter() - started > self.max_wait:
+                    raise Overloaded(f"{provider} is busy")
+                if on_wait is not None:
+                    on_wait(lane.position(ticket))
+        except BaseException:
+            # Timed out, or the script was stopped while waiting
+            self._abandon(lane, ticket, provider, started, session)
+            raise
+        self._record_wait(provider, started, session)
+        try:
+            yield
+        finally:
+            lane.release()
+
+    @asynccontextmanager
+    async def async_slot(self, provider, session=None, admitted=False):
+        """Like slot(), for coroutines on an event loop"""
+        lane = self.lanes[provider]
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+        started = time.perf_counter()
+
+        def on_grant():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        ticket = lane.enqueue(session, on_grant, admitted)
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), None if admitted else self.max_wait or None)
+        except asyncio.TimeoutError:
+            self._abandon(lane, ticket, provider, started, session)
+            raise Overloaded(f"{provider} is busy") from None
+        except BaseException:
+            self._abandon(lane, ticket, provider, started, session)
+            raise
+        self._record_wait(provider, started, session)
+        try:
+            yield
+        finally:
+            lane.release()
+
+    def saturated(self, provider):
+        """Return True when provider has no free slot and a backlog"""
+        return self.lanes[provider].saturated()
+
+    def check_rate(self, session):
+        """Count a turn for session, raising RateLimited if it is over the limit"""
+        if not self.session_rate_limit:
+            return
+        now = time.monotonic()
+        with self._rate_lock:
+            if now - self._last_rate_sweep > RATE_WINDOW:
+                # Forget sessions with no turn in the window, so ended sessions do not pile up
+                self._turns = {other: times for other, times in self._turns.items()
+                               if now - times[-1] <= RATE_WINDOW}
+                self._last_rate_sweep = now
+            turns = self._turns.setdefault(session, deque())
+            while turns and now - turns[0] > RATE_WINDOW:
+                turns.popleft()
+            if len(turns) >= self.session_rate_limit:
+                raise RateLimited(RATE_WINDOW - (now - turns[0]))
+            turns.append(now)
+
+    def stats(self):
+        """Return running/queued/limit for every provider"""
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+    def _abandon(self, lane, ticket, provider, started, session):
+        # A slot granted while the job was giving up must be handed back
+        if not lane.cancel(ticket):
+            lane.release()
+        record(f"queue_{provider}", time.perf_counter() - started, outcome="shed", session=session)
+
+    def _record_wait(self, provider, started, session):
+        waited = time.perf_counter() - started
+        record(f"queue_{provider}", waited, outcome="queued" if waited > 0.001 else "ok", session=session)
+
+
+_shared_scheduler = None
+_shared_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler, configured from the environment"""
+    global _shared_scheduler
+    if _shared_scheduler is None:
+        with _shared_lock:
+            if _shared_scheduler is None:
+                _shared_scheduler = Scheduler(
+                    limits={
+                        "gemini": int(os.getenv("GEMINI_MAX_CONCURRENCY", DEFAULT_LIMITS["gemini"])),
+                        "stt": int(os.getenv("STT_MAX_CONCURRENCY", DEFAULT_LIMITS["stt"])),
+                        "tts": int(os.getenv("TTS_MAX_CONCURRENCY", DEFAULT_LIMITS["tts"])),
+                    },
+                    max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", DEFAULT_MAX_QUEUE)),
+                    max_wait=float(os.getenv("SCHEDULER_MAX_WAIT", DEFAULT_MAX_WAIT)),
+                    session_rate_limit=int(os.getenv("SESSION_RATE_LIMIT", DEFAULT_SESSION_RATE_LIMIT)),
+                )
+    return _shared_scheduler
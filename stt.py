@@ -0,0 +1,431 @@
+"""Speech-to-text with pluggable recognition backends.
+
+The backend is chosen with the STT_BACKEND environment variable:
+
+- ``google``: Google Web Speech API through SpeechRecognition (default, online)
+- ``faster-whisper``: local CPU Whisper model (``pip install faster-whisper``)
+- ``vosk``: local Kaldi models, one per language (``pip install vosk``)
+
+Backend instances are shared by the whole process, so local models are loaded
+once on first use and then reused by every session.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import speech_recognition as sr
+
+from audio_preprocess import decode_wav, encode_wav, preprocess_audio, split_on_silence, to_mono
+from metrics import span
+from scheduler import WAIT_POLL_SECONDS, Overloaded, get_scheduler
+
+logger = logging.getLogger(__name__)
+
+STT_BACKEND = os.getenv("STT_BACKEND", "google")
+# Trim silence, downmix and resample recordings before recognition
+STT_PREPROCESS = os.getenv("STT_PREPROCESS", "true").lower() not in ("0", "false", "no")
+STT_CACHE_MAX_ENTRIES = int(os.getenv("STT_CACHE_MAX_ENTRIES", "1024"))
+# Recordings longer than this are split at pauses and recognized in parallel
+STT_LONG_AUDIO_SECONDS = float(os.getenv("STT_LONG_AUDIO_SECONDS", "30"))
+STT_SEGMENT_SECONDS = float(os.getenv("STT_SEGMENT_SECONDS", "20"))
+STT_MAX_WORKERS = int(os.getenv("STT_MAX_WORKERS", "4"))
+
+# Sample rate local engines expect
+LOCAL_SAMPLE_RATE = 16000
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_BEAM_SIZE = int(os.getenv("WHISPER_BEAM_SIZE", "1"))
+
+VOSK_MODEL_DIR = os.getenv("VOSK_MODEL_DIR", os.path.join("models", "vosk"))
+# Vosk model folder (unpacked from https://alphacephei.com/vosk/models) for each stt_code
+VOSK_MODELS = {
+    "en-US": "vosk-model-small-en-us-0.15",
+    "es-ES": "vosk-model-small-es-0.42",
+    "fr-FR": "vosk-model-small-fr-0.22",
+    "zh-CN": "vosk-model-small-cn-0.22",
+    "ja-JP": "vosk-model-small-ja-0.22",
+}
+
+
+class STTBackend:
+    """Base class for speech recognition engines
+
+    recognize() returns the transcript, raises sr.UnknownValueError when no
+    speech is understood and sr.RequestError when the engine is unavailable.
+    """
+
+    name = ""
+    offline = False
+
+    def load(self, language_code):
+        """Load whatever the engine needs for a language (no-op by default)"""
+
+    def recognize(self, audio_data, language_code):
+        raise NotImplementedError
+
+
+class GoogleSTT(STTBackend):
+    """Google Web Speech API via SpeechRecognition"""
+
+    name = "google"
+
+    def recognize(self, audio_data, language_code):
+        return sr.Recognizer().recognize_google(audio_data, language=language_code)
+
+
+class FasterWhisperSTT(STTBackend):
+    """Local faster-whisper model shared by all languages"""
+
+    name = "faster-whisper"
+    offline = True
+
+    def __init__(self, model_size=WHISPER_MODEL, compute_type=WHISPER_COMPUTE_TYPE):
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self, language_code=None):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        from faster_whisper import WhisperModel
+                    except ImportError:
+                        raise sr.RequestError("faster-whisper is not installed (pip install faster-whisper)")
+                    self._model = WhisperModel(
+                        self.model_size, device="cpu", compute_type=self.compute_type
+                    )
+        return self._model
+
+    def recognize(self, audio_data, language_code):
+        import numpy as np
+
+        model = self.load()
+        raw = audio_data.get_raw_data(convert_rate=LOCAL_SAMPLE_RATE, convert_width=2)
+        samples = np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+        # Whisper takes the bare language ("zh-CN" -> "zh")
+        segments, _ = model.transcribe(
+            samples, language=language_code.split("-")[0], beam_size=WHISPER_BEAM_SIZE
+        )
+        text = "".join(segment.text for segment in segments).strip()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+class VoskSTT(STTBackend):
+    """Local Vosk models, loaded once per language"""
+
+    name = "vosk"
+    offline = True
+
+    def __init__(self, model_dir=VOSK_MODEL_DIR, models=VOSK_MODELS):
+        self.model_dir = model_dir
+        self.models = models
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    def load(self, language_code):
+        model = self._loaded.get(language_code)
+        if model is None:
+            with self._lock:
+                model = self._loaded.get(language_code)
+                if model is None:
+                    try:
+                        from vosk import Model, SetLogLevel
+                    except ImportError:
+                        raise sr.RequestError("vosk is not installed (pip install vosk)")
+                    path = os.path.join(self.model_dir, self.models.get(language_code, language_code))
+                    if not os.path.isdir(path):
+                        raise sr.RequestError(f"Vosk model for {language_code} not found at {path}")
+                    SetLogLevel(-1)
+                    model = Model(path)
+                    self._loaded[language_code] = model
+        return model
+
+    def recognize(self, audio_data, language_code):
+        model = self.load(language_code)
+        from vosk import KaldiRecognizer
+
+        recognizer = KaldiRecognizer(model, LOCAL_SAMPLE_RATE)
+        recognizer.AcceptWaveform(
+            audio_data.get_raw_data(convert_rate=LOCAL_SAMPLE_RATE, convert_width=2)
+        )
+        text = json.loads(recognizer.FinalResult()).get("text", "").strip()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+STT_BACKENDS = {
+    GoogleSTT.name: GoogleSTT,
+    FasterWhisperSTT.name: FasterWhisperSTT,
+    VoskSTT.name: VoskSTT,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_stt_backend(name=None):
+    """Return the process-wide instance of a backend (STT_BACKEND by default)"""
+    name = name or STT_BACKEND
+    if name not in STT_BACKENDS:
+        raise ValueError(f"Unknown STT backend {name!r}; choose from {', '.join(STT_BACKENDS)}")
+    backend = _backends.get(name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(name)
+            if backend is None:
+                backend = STT_BACKENDS[name]()
+                _backends[name] = backend
+    return backend
+
+
+def audio_digest(audio_bytes):
+    """Return a short, fast content digest identifying a recording"""
+    return hashlib.blake2b(audio_bytes, digest_size=16).hexdigest()
+
+
+class TranscriptCache:
+    """Process-wide LRU of transcripts keyed by (audio digest, stt_code, backend)"""
+
+    def __init__(self, max_entries=STT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        """Return (True, transcript) on a hit or (False, None) on a miss"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def store(self, key, transcript):
+        with self._lock:
+            self._entries[key] = transcript
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+transcript_cache = TranscriptCache()
+
+
+def load_audio_data(audio_bytes):
+    """Read WAV bytes into SpeechRecognition AudioData"""
+    # The audio_recorder returns WAV format audio
+    # We need to use AudioFile to properly read it
+    with sr.AudioFile(io.BytesIO(audio_bytes)) as source:
+        return sr.Recognizer().record(source)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_stt_pool():
+    """Return the process-wide worker pool for segment recognition"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=STT_MAX_WORKERS, thread_name_prefix="stt")
+    return _pool
+
+
+def segment_audio(audio_bytes, segment_seconds=STT_SEGMENT_SECONDS,
+                  max_seconds=STT_LONG_AUDIO_SECONDS):
+    """Split WAV bytes at pauses into overlapping WAV segments"""
+    samples, rate = decode_wav(audio_bytes)
+    mono = to_mono(samples)
+    return [
+        encode_wav(mono[start:end], rate)
+        for start, end in split_on_silence(mono, rate, segment_seconds, max_seconds)
+    ]
+
+
+def _join_overlapping(left, right, max_overlap=8):
+    """Join two transcripts, dropping words repeated across the segment overlap"""
+    if " " not in right.strip() and any(ord(ch) >= 0x2E80 for ch in right):
+        # Scripts without spaces: match characters instead of words
+        for n in range(min(max_overlap, len(left), len(right)), 0, -1):
+            if left.endswith(right[:n]):
+                return left + right[n:]
+        return left + right
+
+    left_words = left.split()
+    right_words = right.split()
+    normalize = lambda words: [w.strip(".,!?;:").casefold() for w in words]
+    for n in range(min(max_overlap, len(left_words), len(right_words)), 0, -1):
+        if normalize(left_words[-n:]) == normalize(right_words[:n]):
+            return " ".join(left_words + right_words[n:])
+    return f"{left} {right}"
+
+
+def stitch_transcripts(texts):
+    """Join segment transcripts in order"""
+    merged = ""
+    for text in texts:
+        if text:
+            merged = _join_overlapping(merged, text) if merged else text
+    return merged
+
+
+def _recognize_in_slot(engine, audio_data, language_code, session, admitted=False, on_wait=None,
+                       on_start=None):
+    """Recognize one segment once the scheduler grants it an STT slot"""
+    with get_scheduler().slot("stt", session, on_wait=on_wait, admitted=admitted):
+        if on_start is not None:
+            on_start()
+        return engine.recognize(audio_data, language_code)
+
+
+def transcribe_segments(segments, language_code="en-US", backend=None, on_partial=None, session=None,
+                        on_queue=None):
+    """Recognize WAV segments concurrently and stitch the transcripts in order
+
+    Every segment takes its own slot in the scheduler's STT lane (queued under
+    session), so the lane's limit bounds the recognizer calls actually in
+    flight. The recording is admitted or shed as a whole with its first
+    segment, while on_queue(position) reports its place in the queue; the
+    other segments are only queued once it starts and are never shed, so a
+    transcription is not abandoned half-way. on_partial(texts, done, total)
+    is called from the calling thread each time a segment finishes; texts
+    holds None for segments still in progress. Raises sr.UnknownValueError
+    if nothing was understood, sr.RequestError if any segment could not be
+    recognized and Overloaded if the recording was shed.
+    """
+    engine = get_stt_backend(backend)
+    pool = get_stt_pool()
+    admitted = threading.Event()
+    queue_position = deque(maxlen=1)
+    first = pool.submit(_recognize_in_slot, engine, load_audio_data(segments[0]), language_code, session,
+                        on_wait=queue_position.append, on_start=admitted.set)
+    # Queue positions are reported from this thread, which owns the UI
+    while not admitted.wait(WAIT_POLL_SECONDS) and not first.done():
+        if on_queue is not None and queue_position:
+            on_queue(queue_position[-1])
+    if not admitted.is_set():
+        first.result()  # Raises Overloaded: the recording was shed before it started
+    futures = {first: 0}
+    futures.update({
+        pool.submit(_recognize_in_slot, engine, load_audio_data(segment), language_code, session, True): index
+        for index, segment in enumerate(segments[1:], start=1)
+    })
+    texts = [None] * len(segments)
+    errors = []
+    for done, future in enumerate(as_completed(futures), start=1):
+        index = futures[future]
+        try:
+            texts[index] = future.result()
+        except sr.UnknownValueError:
+            texts[index] = ""
+        except Exception as e:
+            texts[index] = ""
+            errors.append(e)
+        if on_partial is not None:
+            on_partial(list(texts), done, len(segments))
+
+    if errors:
+        raise errors[0]
+    text = stitch_transcripts(texts)
+    if not text:
+        raise sr.UnknownValueError()
+    return text
+
+
+# Function to transcribe audio
+def transcribe_audio(audio_bytes, language_code="en-US", backend=None, stats=None, digest=None,
+                     on_partial=None, tags=None, on_queue=None):
+    """Convert audio bytes to text using the configured speech recognition backend
+
+    Results are cached by (digest, language_code, backend), so a replayed or
+    resubmitted recording is never recognized twice. Service errors are not
+    cached so they can be retried. Long recordings are split into segments
+    recognized in parallel, reporting progress through on_partial (see
+    transcribe_segments). tags are attached to the "stt" latency span.
+
+    Recognition runs in a slot of the shared scheduler, one per segment for a
+    long recording; on_queue(position) is called while the recording waits
+    to start, and an error is returned if the recognizer is too busy.
+    """
+    if audio_bytes is None:
+        return None
+
+    with span("stt", **(tags or {})) as stage:
+        key = (digest or audio_digest(audio_bytes), language_code, backend or STT_BACKEND)
+        found, text = transcript_cache.lookup(key)
+        if found:
+            stage.outcome = "cache_hit"
+            return text
+
+        try:
+            text = _transcribe_uncached(audio_bytes, language_code, backend, stats, on_partial,
+                                        (tags or {}).get("session"), on_queue)
+        except Overloaded:
+            stage.outcome = "shed"
+            return "Error: speech recognition is busy, please try again in a moment"
+        if text is None:
+            stage.outcome = "no_speech"
+        elif text.startswith("Error:") or text.startswith("Speech service error:"):
+            stage.outcome = "error"
+            return text
+        transcript_cache.store(key, text)
+        return text
+
+
+def _transcribe_uncached(audio_bytes, language_code, backend, stats, on_partial=None, session=None,
+                         on_queue=None):
+    """Run preprocessing and recognition for one recording; raises Overloaded if shed"""
+    try:
+        if STT_PREPROCESS:
+            try:
+                audio_bytes = preprocess_audio(audio_bytes, stats)
+            except Exception as e:
+                # Not a PCM WAV we can decode; let the recognizer try the original
+                logger.warning("Audio preprocessing skipped: %s", e)
+            if not audio_bytes:
+                return None  # Nothing but silence, no need to call the recognizer
+
+        audio_data = load_audio_data(audio_bytes)
+        duration = len(audio_data.frame_data) / (audio_data.sample_rate * audio_data.sample_width)
+
+        # Recognize speech with the selected backend in the specified language
+        started = time.perf_counter()
+        if duration > STT_LONG_AUDIO_SECONDS:
+            segments = segment_audio(audio_bytes)
+            text = transcribe_segments(segments, language_code, backend, on_partial, session, on_queue)
+        else:
+            segments = [audio_bytes]
+            with get_scheduler().slot("stt", session, on_wait=on_queue):
+                text = get_stt_backend(backend).recognize(audio_data, language_code)
+        elapsed = time.perf_counter() - started
+        if stats is not None:
+            stats.update({"segments": len(segments), "audio_seconds": duration,
+                          "recognition_seconds": elapsed})
+        logger.info("Recognized %.1fs of audio in %d segment(s) in %.1f ms",
+                    duration, len(segments), elapsed * 1000)
+        return text
+    except Overloaded:
+        raise
+    except sr.UnknownValueError:
+        return None  # Return None so we can show a better message
+    except sr.RequestError as e:
+        return f"Speech service error: {e}"
+    except Exception as e:
+        return f"Error: {str(e)}"
@@ -0,0 +1,28 @@
+import audio_formats
+from audio_formats import FORMATS, join_encoded, submit_encode
+
+
+def test_joinable_chunk_encodings_are_joined_without_reencoding(monkeypatch):
+    def encode_audio(*args, **kwargs):
+        raise AssertionError("joined chunks must not be encoded again")
+
+    monkeypatch.setattr(audio_formats, "encode_audio", encode_audio)
+    encoded = [(b"one", FORMATS["mp3-32k"]), (b"two", FORMATS["mp3-32k"])]
+    assert join_encoded(encoded, [b"a", b"b"], FORMATS["mp3-32k"]) == (b"onetwo", FORMATS["mp3-32k"])
+
+
+def test_unjoinable_reply_is_encoded_once_uncached(monkeypatch):
+    calls = []
+
+    def encode_audio(data, audio_format, tags=None, cache=True):
+        calls.append((data, cache))
+        return b"webm", audio_format
+
+    monkeypatch.setattr(audio_formats, "encode_audio", encode_audio)
+    encoded = [(b"one", FORMATS["opus-24k"]), (b"two", FORMATS["opus-24k"])]
+    assert join_encoded(encoded, [b"a", b"b"], FORMATS["opus-24k"]) == (b"webm", FORMATS["opus-24k"])
+    assert calls == [(b"ab", False)]
+
+
+def test_audio_served_as_synthesized_needs_no_worker():
+    assert submit_encode(b"mp3", FORMATS["mp3"]).result() == (b"mp3", FORMATS["mp3"])
@@ -0,0 +1,40 @@
+import os
+import time
+
+from audio_store import AudioStore
+
+
+def _age(store, session, handle, seconds):
+    then = time.time() - seconds
+    os.utime(store.path(session, handle), (then, then))
+
+
+def test_sweep_trims_saved_conversation_audio_first(tmp_path):
+    store_dir = str(tmp_path / "sessions")
+    store = AudioStore(store_dir, session_ttl=0, persistent_ttl=0, max_bytes=250)
+    store.session("old-chat", persistent=True)
+    store.session("new-chat", persistent=True)
+    oldest = store.put("old-chat", b"a" * 100)
+    newer = store.put("new-chat", b"b" * 100)
+    live = store.put("visitor", b"c" * 100)
+    _age(store, "old-chat", oldest, 300)
+    _age(store, "new-chat", newer, 200)
+    _age(store, "visitor", live, 400)  # Older, but its session is still live
+
+    store.sweep()
+    assert store.get("old-chat", oldest) is None
+    assert store.get("new-chat", newer) == b"b" * 100
+    assert store.get("visitor", live) == b"c" * 100
+    assert store.stats()["bytes"] == 200
+
+
+def test_budget_counts_audio_left_by_an_earlier_process(tmp_path):
+    store_dir = str(tmp_path / "sessions")
+    earlier = AudioStore(store_dir, session_ttl=0, persistent_ttl=0, max_bytes=0)
+    earlier.session("chat", persistent=True)
+    for _ in range(3):
+        earlier.put("chat", b"x" * 100)
+
+    AudioStore(store_dir, session_ttl=0, persistent_ttl=0, max_bytes=150)  # Sweeps on start-up
+    remaining = [name for name in os.listdir(os.path.join(store_dir, "chat")) if name != ".persistent"]
+    assert len(remaining) == 1
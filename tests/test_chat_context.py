@@ -0,0 +1,49 @@
+from concurrent.futures import Future
+
+from chat_context import ConversationContext
+
+
+def _messages(turns):
+    messages = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"question {turn} " + "word " * 40})
+        messages.append({"role": "assistant", "content": f"answer {turn} " + "word " * 40})
+    return messages
+
+
+def test_compaction_is_applied_once_it_finishes():
+    context = ConversationContext(budget=100)
+    started = []
+
+    def summarize(summary, turns):
+        started.append(turns)
+        return Future()
+
+    messages = _messages(5)
+    context.start_compaction(messages, summarize)
+    context.start_compaction(messages, summarize)  # Already running
+    assert len(started) == 1
+    assert not context.apply_compaction()
+    assert context.summarized_turns == 0
+
+    future = context._pending[0]
+    future.set_result("The user asked five questions.")
+    assert context.apply_compaction()
+    assert context.summary == "The user asked five questions."
+    assert context.summarized_turns == len(started[0])
+    assert not context.apply_compaction()
+
+
+def test_failed_compaction_is_retried():
+    context = ConversationContext(budget=100)
+
+    def failing(summary, turns):
+        future = Future()
+        future.set_exception(RuntimeError("busy"))
+        return future
+
+    context.start_compaction(_messages(5), failing)
+    assert not context.apply_compaction()
+    assert (context.summary, context.summarized_turns) == ("", 0)
+    context.start_compaction(_messages(5), failing)
+    assert context._pending is not None
@@ -0,0 +1,72 @@
+import os
+import time
+
+from audio_store import AudioStore
+from chat_context import completed_turns
+from conversation_store import ConversationStore
+
+
+def _save(store, conversation, messages):
+    for index, message in enumerate(messages):
+        store.save_message(conversation, "General Assistant", "English", index, message)
+    store.flush()
+
+
+def test_resume_across_a_split_turn_counts_every_turn(tmp_path):
+    store = ConversationStore(path=str(tmp_path / "conversations.sqlite3"), flush_interval=0)
+    messages = []
+    for turn in range(22):
+        messages.append({"role": "user", "content": f"question {turn}"})
+        if turn == 5:
+            # An interrupted turn: the prompt was saved but never answered
+            messages.append({"role": "user", "content": "question again"})
+        messages.append({"role": "assistant", "content": f"answer {turn}"})
+    _save(store, "chat", messages)
+    total = len(completed_turns(messages))
+
+    for limit in range(1, len(messages) + 1):
+        before = None
+        loaded = []
+        while before is None or before:
+            offset, page = store.page("chat", before=before, limit=limit)
+            assert page[0][0]["role"] == "user"
+            turns_before = store.completed_turns("chat", offset)
+            loaded[:0] = [message for message, _ in page]
+            assert turns_before + len(completed_turns(loaded)) == total
+            before = offset
+    store.close()
+
+
+def test_pruned_conversations_lose_their_audio(tmp_path):
+    audio_store = AudioStore(str(tmp_path / "sessions"), session_ttl=1, persistent_ttl=0)
+    audio_store.session("chat", persistent=True)
+    handle = audio_store.put("chat", b"reply")
+    store = ConversationStore(path=str(tmp_path / "conversations.sqlite3"), retention=60, flush_interval=0,
+                              on_delete=lambda ids: [audio_store.drop_session(i) for i in ids])
+    _save(store, "chat", [{"role": "user", "content": "hi"}])
+
+    # The short session TTL does not apply to a saved conversation's audio
+    audio_store._last_seen["chat"] = time.time() - 10
+    audio_store.sweep()
+    assert audio_store.get("chat", handle) == b"reply"
+
+    store._write_conn.execute("UPDATE conversations SET updated_at = 0")
+    store._write_conn.commit()
+    store._prune()
+    assert audio_store.get("chat", handle) is None
+    assert not os.path.exists(tmp_path / "sessions" / "chat")
+    store.close()
+
+
+def test_sweep_after_restart_keeps_saved_conversation_audio(tmp_path):
+    store_dir = str(tmp_path / "sessions")
+    audio_store = AudioStore(store_dir, session_ttl=1)
+    audio_store.session("chat", persistent=True)
+    audio_store.put("chat", b"reply")
+    audio_store.put("visitor", b"reply")
+    idle_since = time.time() - 10
+    for name in ("chat", "visitor"):
+        os.utime(os.path.join(store_dir, name), (idle_since, idle_since))
+
+    AudioStore(store_dir, session_ttl=1)  # A restarted process sweeps on start-up
+    assert sorted(os.listdir(store_dir)) == ["chat"]
@@ -0,0 +1,52 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import pipeline
+
+
+@pytest.fixture
+def turn_server(monkeypatch):
+    """A /turn server whose turns echo their settings instead of calling providers"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fake_turn(item_id, audio_bytes=None, text=None, personality="General Assistant",
+                  language="English", audio_format=None):
+        return {"id": item_id, "personality": personality, "language": language, "reply": text}
+
+    monkeypatch.setattr(pipeline, "process_turn", fake_turn)
+    monkeypatch.setattr(pipeline.TurnHandler, "pool", ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(pipeline.TurnHandler, "language", "Spanish")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), pipeline.TurnHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/turn"
+    server.shutdown()
+    server.server_close()
+    pipeline.TurnHandler.pool.shutdown()
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=body if isinstance(body, bytes) else json.dumps(body).encode())
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_server_defaults_apply_to_requests_without_settings(turn_server):
+    status, body = post(turn_server, {"text": "Hola"})
+    assert status == 200
+    assert (body["personality"], body["language"]) == ("General Assistant", "Spanish")
+
+
+@pytest.mark.parametrize("body", [b"[1]", b'"hi"', b"{not json", {"text": "Hi", "language": "Klingon"},
+                                  {"text": "Hi", "personality": ["Study Buddy"]}, {"personality": "Study Buddy"}])
+def test_client_errors_are_rejected_with_400(turn_server, body):
+    status, response = post(turn_server, body)
+    assert status == 400
+    assert "error" in response
@@ -0,0 +1,20 @@
+import time
+
+import tts_cache
+from prefetch import VoicePrefetcher
+from tts_cache import cache_key
+
+
+def test_cached_texts_are_skipped_without_touching_cache_counters(monkeypatch):
+    audio_cache = tts_cache.AudioCache(cache_dir=None)
+    monkeypatch.setattr(tts_cache, "_shared_cache", audio_cache)
+    audio_cache.put(cache_key("Hola.", "es-ES-ElviraNeural"), b"audio")
+
+    prefetcher = VoicePrefetcher()
+    prefetcher.request(["Hola."], "es-ES-ElviraNeural")
+    deadline = time.monotonic() + 5
+    while prefetcher.stats()["pending"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert prefetcher.stats()["skipped_cached"] == 1
+    assert audio_cache.stats()["hits"] == audio_cache.stats()["misses"] == 0
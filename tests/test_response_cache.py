@@ -0,0 +1,11 @@
+from response_cache import ResponseCache
+
+
+def test_key_stats_do_not_expose_prompts(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite3"))
+    cache.put("General Assistant", "English", "My name is Alice, what is my tax ID?", "reply")
+    assert cache.get("General Assistant", "English", "my name is alice, what is my tax id") == "reply"
+    [entry] = cache.key_stats()
+    assert entry["hits"] == 1
+    assert "prompt" not in entry
+    assert "alice" not in repr(entry).lower()
@@ -0,0 +1,24 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import scheduler
+from scheduler import RateLimited, Scheduler
+
+
+def test_rate_limit_forgets_idle_sessions(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(scheduler, "time", SimpleNamespace(monotonic=lambda: now[0],
+                                                           perf_counter=time.perf_counter))
+    shared = Scheduler(session_rate_limit=2)
+    for session in range(100):
+        shared.check_rate(f"ended-{session}")
+    shared.check_rate("active")
+    shared.check_rate("active")
+    with pytest.raises(RateLimited):
+        shared.check_rate("active")
+
+    now[0] += scheduler.RATE_WINDOW + 1
+    shared.check_rate("active")
+    assert list(shared._turns) == ["active"]
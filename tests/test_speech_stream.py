@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+import scheduler
+import tts
+import tts_cache
+from scheduler import Overloaded, Scheduler
+
+
+@pytest.fixture
+def fake_tts(monkeypatch):
+    """A one-slot TTS lane with a two-job queue and a slow fake Edge provider"""
+    monkeypatch.setattr(scheduler, "_shared_scheduler",
+                        Scheduler(limits={"tts": 1}, max_queue=2, max_wait=0.05))
+    monkeypatch.setattr(tts_cache, "_shared_cache", tts_cache.AudioCache(max_bytes=0, cache_dir=None))
+    engine = tts.TTSEngine()
+
+    async def edge(text, voice):
+        await asyncio.sleep(0.05)
+        return text.encode("utf-8")
+
+    engine.providers = [tts.TTSProvider("edge", edge)]
+    monkeypatch.setattr(tts, "_engine", engine)
+    return engine
+
+
+def test_admitted_reply_is_spoken_in_full(fake_tts):
+    sentences = [f"Sentence number {i} " + "is long enough to be a chunk of its own. " * 5 for i in range(6)]
+    metrics = {}
+    speech = tts.SpeechStream("en-US-JennyNeural", metrics)
+    speech.feed(" ".join(sentences))
+    speech.close()
+    parts = list(speech)
+    assert metrics["tts_chunks"] == 6
+    assert len(parts) == 6
+    assert not speech.shed and "tts_shed" not in metrics
+
+
+def test_lane_sheds_new_jobs_but_queues_admitted_ones():
+    lane = scheduler.Lane("tts", limit=1, max_queue=1)
+    lane.enqueue("a", lambda: None)
+    lane.enqueue("a", lambda: None)
+    with pytest.raises(Overloaded):
+        lane.enqueue("b", lambda: None)
+    lane.enqueue("a", lambda: None, admitted=True)
+    assert lane.stats()["queued"] == 2
+
+
+def test_fallback_audio_is_not_cached_under_the_voice_key(fake_tts):
+    async def failing_edge(text, voice):
+        raise RuntimeError("edge is down")
+
+    async def gtts(text, voice):
+        return b"robotic"
+
+    fake_tts.providers = [tts.TTSProvider("edge", failing_edge), tts.TTSProvider("gtts", gtts)]
+    assert tts.generate_tts_audio("Hello there.") == b"robotic"
+    assert tts.cached_tts_audio("Hello there.") is None
+
+
+def test_speculation_leaves_routing_state_alone(fake_tts):
+    calls = []
+
+    async def failing_edge(text, voice):
+        calls.append(text)
+        raise RuntimeError("edge is down")
+
+    edge = tts.TTSProvider("edge", failing_edge)
+    fake_tts.providers = [edge]
+    for _ in range(tts.TTS_BREAKER_FAILURES + 1):
+        assert fake_tts.submit(fake_tts.speculate("Hello there.", "en-US-JennyNeural")).result() == (None, None)
+    assert edge.breaker.state == "closed"
+    assert edge.latency.percentile(50) is None
+    assert fake_tts.stats()["chunks"] == 0
+
+    # A half-open breaker keeps its probe for a user's reply
+    for _ in range(tts.TTS_BREAKER_FAILURES):
+        edge.breaker.record_failure()
+    edge.breaker._opened_at -= edge.breaker.cooldown
+    assert edge.breaker.state == "half_open"
+    assert fake_tts.submit(fake_tts.speculate("Hello again.", "en-US-JennyNeural")).result() == (None, None)
+    assert "Hello again." not in calls
+    assert edge.breaker.allow()
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import scheduler
+import stt
+from audio_preprocess import encode_wav
+
+
+class CountingBackend(stt.STTBackend):
+    """Records the most recognizer calls that were in flight at once"""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def recognize(self, audio_data, language_code):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(0.05)
+        with self._lock:
+            self.active -= 1
+        return "word"
+
+
+def test_segments_respect_the_stt_lane_limit(monkeypatch):
+    monkeypatch.setattr(scheduler, "_shared_scheduler", scheduler.Scheduler(limits={"stt": 2}))
+    backend = CountingBackend()
+    monkeypatch.setitem(stt.STT_BACKENDS, "counting", CountingBackend)
+    monkeypatch.setitem(stt._backends, "counting", backend)
+    monkeypatch.setattr(stt, "_pool", None)
+    monkeypatch.setattr(stt, "STT_MAX_WORKERS", 4)
+    segments = [encode_wav(np.zeros(1600), 16000) for _ in range(8)]
+
+    assert stt.transcribe_segments(segments, backend="counting", session="s") == "word"
+    assert backend.peak == 2
+
+
+def test_admitted_recording_is_never_shed_half_way(monkeypatch):
+    monkeypatch.setattr(scheduler, "_shared_scheduler",
+                        scheduler.Scheduler(limits={"stt": 1}, max_queue=1, max_wait=0.05))
+    backend = CountingBackend()
+    monkeypatch.setitem(stt.STT_BACKENDS, "counting", CountingBackend)
+    monkeypatch.setitem(stt._backends, "counting", backend)
+    monkeypatch.setattr(stt, "_pool", None)
+    segments = [encode_wav(np.zeros(1600), 16000) for _ in range(6)]
+
+    partials = []
+    text = stt.transcribe_segments(segments, backend="counting", session="s",
+                                   on_partial=lambda texts, done, total: partials.append(done))
+    assert text == "word"
+    assert partials == list(range(1, 7))
+    assert backend.peak == 1
+
+
+def test_recording_is_shed_as_a_whole_before_it_starts(monkeypatch):
+    shared = scheduler.Scheduler(limits={"stt": 1}, max_queue=1, max_wait=0.05)
+    monkeypatch.setattr(scheduler, "_shared_scheduler", shared)
+    backend = CountingBackend()
+    monkeypatch.setitem(stt.STT_BACKENDS, "counting", CountingBackend)
+    monkeypatch.setitem(stt._backends, "counting", backend)
+    monkeypatch.setattr(stt, "_pool", None)
+    segments = [encode_wav(np.zeros(1600), 16000) for _ in range(3)]
+
+    with shared.slot("stt", "other"):
+        with pytest.raises(scheduler.Overloaded):
+            stt.transcribe_segments(segments, backend="counting", session="s")
+    assert backend.peak == 0
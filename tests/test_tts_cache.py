@@ -0,0 +1,34 @@
+import os
+
+import tts_cache
+from tts_cache import AudioCache
+
+
+def test_disk_tier_trims_to_low_water_without_walking(tmp_path, monkeypatch):
+    audio_cache = AudioCache(max_bytes=0, cache_dir=str(tmp_path), max_disk_bytes=10_000)
+    walks = []
+    monkeypatch.setattr(tts_cache.os, "walk", lambda *args: walks.append(args) or iter(()))
+    for i in range(200):
+        audio_cache.put(f"{i:064x}", b"x" * 1000)
+    monkeypatch.undo()
+    assert not walks
+    assert audio_cache._disk_size <= 10_000
+    on_disk = sum(len(names) for _, _, names in os.walk(tmp_path.as_posix()) if names)
+    assert on_disk * 1000 == audio_cache._disk_size
+    # Trimming to the low-water mark leaves room, so trims are rare
+    assert audio_cache.stats()["disk_evictions"] < 200
+
+
+def test_rewriting_a_key_does_not_grow_disk_size(tmp_path):
+    audio_cache = AudioCache(max_bytes=0, cache_dir=str(tmp_path), max_disk_bytes=10**6)
+    for _ in range(100):
+        audio_cache.put("ab" * 32, b"x" * 1000)
+    assert audio_cache._disk_size == 1000
+
+
+def test_disk_index_survives_restart(tmp_path):
+    audio_cache = AudioCache(max_bytes=0, cache_dir=str(tmp_path))
+    audio_cache.put("cd" * 32, b"audio")
+    reopened = AudioCache(max_bytes=0, cache_dir=str(tmp_path))
+    assert reopened._disk_size == 5
+    assert reopened.get("cd" * 32) == b"audio"
@@ -0,0 +1,15 @@
+import pytest
+
+from tts import strip_markdown
+
+
+@pytest.mark.parametrize("markdown, spoken", [
+    ("**bold** and *italic* and __strong__ and _em_", "bold and italic and strong and em"),
+    ("Call `snake_case_name` here", "Call snake_case_name here"),
+    ("Rename my_var_name please", "Rename my_var_name please"),
+    ("2*3*4 is 24", "2*3*4 is 24"),
+    ("A *really* big_deal", "A really big_deal"),
+    ("~~gone~~ now", "gone now"),
+])
+def test_strip_markdown_emphasis(markdown, spoken):
+    assert strip_markdown(markdown) == spoken
@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+from warmup import load_phrases
+
+
+@pytest.mark.parametrize("content", [[1, 2], "hello", {"en": "Hello"}, {"en": [3]}])
+def test_malformed_phrases_file_falls_back_to_fixed_phrases(monkeypatch, tmp_path, content):
+    path = tmp_path / "phrases.json"
+    path.write_text(json.dumps(content))
+    monkeypatch.delenv("WARMUP_PHRASES_FILE", raising=False)
+    fixed = load_phrases(["en"])
+    monkeypatch.setenv("WARMUP_PHRASES_FILE", str(path))
+
+    assert load_phrases(["en"]) == fixed
+
+
+def test_phrases_file_adds_phrases(monkeypatch, tmp_path):
+    path = tmp_path / "phrases.json"
+    path.write_text(json.dumps({"en": ["Welcome back!"]}))
+    monkeypatch.setenv("WARMUP_PHRASES_FILE", str(path))
+
+    assert "Welcome back!" in load_phrases(["en"])["en"]
@@ -0,0 +1,518 @@
+"""Text-to-speech synthesis shared by every Streamlit session.
+
+A single long-lived asyncio event loop runs on a daemon thread for the whole
+process. Synthesis requests are submitted to it as futures and Edge TTS audio
+is collected in memory from the streamed chunks, so a reply costs neither a
+new thread, a new event loop nor a temporary file.
+
+Replies are stripped of markdown, split on sentence boundaries and the chunks
+are synthesized concurrently in the shared scheduler's TTS lane, whose
+TTS_MAX_CONCURRENCY slots are shared fairly between sessions. Chunks are
+yielded in order as soon as each is ready so playback can start on the first
+sentence while the rest are still being synthesized. When the lane is
+saturated a new reply is not voiced at all rather than queued behind others;
+once a reply is admitted all of its chunks are queued, however long the
+lane's backlog, so a voiced reply is never missing sentences.
+
+Each chunk is routed across Edge TTS and gTTS: Edge is tried first, and if it
+fails, or takes longer than its recent TTS_HEDGE_PERCENTILE latency, a hedged
+gTTS request is raced against it and the first audio wins. A circuit breaker
+per provider skips a provider that keeps failing for TTS_BREAKER_COOLDOWN
+seconds. Only audio from the preferred provider is stored in the shared
+audio cache, whose keys name the Edge voice, so a fallback voice is never
+replayed in place of it.
+"""
+import asyncio
+import io
+import os
+import re
+import threading
+import time
+
+from metrics import set_gauge, span
+from provider_health import CLOSED, STATE_VALUES, CircuitBreaker, LatencyWindow
+from scheduler import Overloaded, get_scheduler
+from tts_cache import cache_key, get_tts_cache
+
+EDGE_TTS_TIMEOUT = 15  # seconds
+TTS_HEDGE_PERCENTILE = float(os.getenv("TTS_HEDGE_PERCENTILE", "95"))
+# Hedge delay used until a provider has enough latency samples, and the floor
+TTS_HEDGE_DELAY = float(os.getenv("TTS_HEDGE_DELAY", "2.0"))
+TTS_HEDGE_MIN_DELAY = float(os.getenv("TTS_HEDGE_MIN_DELAY", "0.3"))
+TTS_BREAKER_FAILURES = int(os.getenv("TTS_BREAKER_FAILURES", "5"))
+TTS_BREAKER_COOLDOWN = float(os.getenv("TTS_BREAKER_COOLDOWN", "30"))
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "300"))
+TTS_FIRST_CHUNK_CHARS = int(os.getenv("TTS_FIRST_CHUNK_CHARS", "150"))
+
+_CODE_BLOCK_RE = re.compile(r"```.*?(```|$)", re.DOTALL)
+_INLINE_CODE_RE = re.compile(r"`([^`]*)`")
+_IMAGE_RE = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+_LINK_RE = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_URL_RE = re.compile(r"https?://\S+")
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s*", re.MULTILINE)
+_BLOCKQUOTE_RE = re.compile(r"^\s*>\s?", re.MULTILINE)
+_BULLET_RE = re.compile(r"^\s*[-*+]\s+", re.MULTILINE)
+_TABLE_RULE_RE = re.compile(r"^\s*\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$", re.MULTILINE)
+_HORIZONTAL_RULE_RE = re.compile(r"^\s*([-*_]\s*){3,}$", re.MULTILINE)
+# Emphasis markers only count at word edges, so snake_case and 2*3*4 are kept
+_EMPHASIS_RE = re.compile(r"(?<!\w)(\*\*|__|~~|\*|_)(?=\S)(.+?)(?<=\S)\1(?!\w)")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?;:])\s+|(?<=[。！？；])|\n+")
+_SOFT_BREAK_RE = re.compile(r"[,，、]\s*|\s+")
+
+
+def strip_markdown(text):
+    """Remove markdown syntax, code and URLs that should not be read aloud"""
+    text = _CODE_BLOCK_RE.sub(" ", text)
+    text = _INLINE_CODE_RE.sub(r"\1", text)
+    text = _IMAGE_RE.sub(r"\1", text)
+    text = _LINK_RE.sub(r"\1", text)
+    text = _URL_RE.sub("", text)
+    text = _HTML_TAG_RE.sub("", text)
+    text = _TABLE_RULE_RE.sub("", text)
+    text = _HORIZONTAL_RULE_RE.sub("", text)
+    text = _HEADING_RE.sub("", text)
+    text = _BLOCKQUOTE_RE.sub("", text)
+    text = _BULLET_RE.sub("", text)
+    text = _EMPHASIS_RE.sub(r"\2", text)
+    text = text.replace("|", ", ")
+    return text.strip()
+
+
+def _split_long_sentence(sentence, max_chars):
+    """Break a sentence longer than max_chars at commas or spaces"""
+    pieces = []
+    while len(sentence) > max_chars:
+        cut = 0
+        for match in _SOFT_BREAK_RE.finditer(sentence, 0, max_chars):
+            cut = match.end()
+        if cut == 0:
+            cut = max_chars  # No natural break (e.g. CJK text): hard split
+        pieces.append(sentence[:cut].strip())
+        sentence = sentence[cut:]
+    if sentence.strip():
+        pieces.append(sentence.strip())
+    return pieces
+
+
+def split_sentences(text, max_chars=TTS_CHUNK_CHARS, first_chunk_chars=TTS_FIRST_CHUNK_CHARS):
+    """Split text into sentences, breaking any longer than the chunk size"""
+    sentences = []
+    for sentence in _SENTENCE_END_RE.split(text):
+        if sentence and sentence.strip():
+            limit = first_chunk_chars if not sentences else max_chars
+            sentences.extend(_split_long_sentence(sentence.strip(), limit))
+    return sentences
+
+
+def pack_sentences(sentences, max_chars=TTS_CHUNK_CHARS):
+    """Pack sentences into chunks of at most max_chars
+
+    The first sentence is always a chunk on its own so the first audio arrives
+    as early as possible. Packing is greedy and depends only on the sentences,
+    so text that arrives incrementally is chunked exactly like the full text.
+    """
+    chunks = []
+    current = ""
+    for sentence in sentences:
+        candidate = f"{current} {sentence}" if current else sentence
+        if current and (not chunks or len(candidate) > max_chars):
+            chunks.append(current)
+            current = sentence
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_into_chunks(text, max_chars=TTS_CHUNK_CHARS, first_chunk_chars=TTS_FIRST_CHUNK_CHARS):
+    """Split text on sentence boundaries into chunks of at most max_chars"""
+    return pack_sentences(split_sentences(text, max_chars, first_chunk_chars), max_chars)
+
+
+class TTSProvider:
+    """One synthesis provider with its latency window and circuit breaker"""
+
+    def __init__(self, name, call):
+        self.name = name
+        self.call = call  # async (text, voice) -> bytes
+        self.latency = LatencyWindow()
+        self.breaker = CircuitBreaker(name, TTS_BREAKER_FAILURES, TTS_BREAKER_COOLDOWN)
+
+    def hedge_delay(self):
+        """Seconds to wait for this provider before hedging with the next one"""
+        threshold = self.latency.percentile(TTS_HEDGE_PERCENTILE)
+        return TTS_HEDGE_DELAY if threshold is None else max(TTS_HEDGE_MIN_DELAY, threshold)
+
+    async def attempt(self, text, voice, tags, record=True):
+        """Call the provider once, timed as a "tts_<name>" span; None on failure
+
+        With record=False the call leaves the latency window and the circuit
+        breaker untouched, so it cannot move the hedge delay or trip the breaker.
+        """
+        if not record:
+            try:
+                with span(f"tts_{self.name}", **tags):
+                    return await self.call(text, voice) or None
+            except Exception:
+                return None
+        started = time.perf_counter()
+        try:
+            with span(f"tts_{self.name}", **tags) as stage:
+                try:
+                    audio_data = await self.call(text, voice)
+                except asyncio.CancelledError:
+                    stage.outcome = "cancelled"
+                    raise
+                if not audio_data:
+                    stage.outcome = "empty"
+        except asyncio.CancelledError:
+            # Lost a hedge race; its elapsed time is still a lower bound on latency
+            self.latency.add(time.perf_counter() - started)
+            self.breaker.release()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            return None
+        if not audio_data:
+            self.breaker.record_failure()
+            return None
+        self.latency.add(time.perf_counter() - started)
+        self.breaker.record_success()
+        return audio_data
+
+
+class TTSEngine:
+    """Owns the background event loop that all synthesis runs on"""
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        # In order of preference
+        self.providers = [TTSProvider("edge", self.edge_synthesize_with_timeout),
+                          TTSProvider("gtts", self.gtts_synthesize)]
+        self._stats = {"chunks": 0, "hedged": 0, "failed": 0}
+        self._wins = {provider.name: 0 for provider in self.providers}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def loop(self):
+        """Return the background loop, starting it on first use"""
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(
+                        target=loop.run_forever, name="tts-event-loop", daemon=True
+                    )
+                    thread.start()
+                    self._thread = thread
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coro):
+        """Schedule a coroutine on the background loop and return its Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def edge_synthesize(self, text, voice):
+        """Stream Edge TTS audio for text into memory and return the bytes"""
+        import edge_tts  # Imported on first use to keep app start-up fast
+
+        communicate = edge_tts.Communicate(text, voice)
+        buffer = io.BytesIO()
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                buffer.write(chunk["data"])
+        return buffer.getvalue()
+
+    async def edge_synthesize_with_timeout(self, text, voice):
+        """Edge TTS bounded by EDGE_TTS_TIMEOUT"""
+        return await asyncio.wait_for(self.edge_synthesize(text, voice), EDGE_TTS_TIMEOUT)
+
+    async def gtts_synthesize(self, text, voice):
+        """Run gTTS on a worker thread without blocking the loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, synthesize_gtts, text, voice)
+
+    def cacheable(self, provider):
+        """Return True if audio won by provider may be cached under the voice's key"""
+        return provider == self.providers[0].name
+
+    async def synthesize(self, text, voice, tags=None, admitted=False):
+        """Synthesize one chunk with Edge TTS, falling back to gTTS
+
+        Returns (audio bytes, name of the provider that produced them), or
+        (None, None) on failure.
+
+        Each provider attempt is timed as a "tts_edge" / "tts_gtts" span. The
+        chunk waits for a slot in the scheduler's TTS lane and is dropped if
+        it is shed, which never happens to an admitted chunk (one of a reply
+        that was already let in).
+        """
+        tags = dict(tags or {}, voice=voice)
+        try:
+            async with get_scheduler().async_slot("tts", tags.get("session"), admitted=admitted):
+                return await self._synthesize(text, voice, tags)
+        except Overloaded:
+            return None, None
+
+    async def _synthesize(self, text, voice, tags):
+        """Route one chunk across the providers, hedging a slow one
+
+        Returns (audio bytes, winning provider name), or (None, None) on failure.
+
+        The outcome of the "tts_chunk" span names the winning provider, with
+        "_hedged" appended when a hedge request was sent.
+        """
+        remaining = [provider for provider in self.providers if provider.breaker.allow()]
+        running = {}  # task -> provider
+        audio_data = None
+        winner = None
+        hedged = False
+        with span("tts_chunk", **tags) as stage:
+            try:
+                while remaining or running:
+                    if not running:
+                        # First attempt, or the previous provider failed
+                        provider = remaining.pop(0)
+                        running[asyncio.ensure_future(provider.attempt(text, voice, tags))] = provider
+                    timeout = next(iter(running.values())).hedge_delay() if remaining else None
+                    done, _ = await asyncio.wait(running, timeout=timeout,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        # Slower than usual: race the next provider against it
+                        hedged = True
+                        provider = remaining.pop(0)
+                        running[asyncio.ensure_future(provider.attempt(text, voice, tags))] = provider
+                        continue
+                    for task in done:
+                        provider = running.pop(task)
+                        if task.result():
+                            audio_data = task.result()
+                            winner = provider.name
+                            stage.outcome = provider.name + ("_hedged" if hedged else "")
+                            break
+                    if audio_data:
+                        break
+            finally:
+                for task in running:
+                    task.cancel()
+                # Providers that were let through but never called
+                for provider in remaining:
+                    provider.breaker.release()
+            if not audio_data:
+                stage.outcome = "failed"
+        self._record_route(stage.outcome, hedged)
+        return audio_data, winner
+
+    async def speculate(self, text, voice, tags=None):
+        """Synthesize one chunk nobody is waiting for (see prefetch)
+
+        Returns (audio bytes, provider name), or (None, None) on failure.
+
+        Only the preferred provider is tried, since fallback audio is never
+        cached, and only while its breaker is closed, so speculation never
+        takes a half-open breaker's probe. The attempt is kept out of the
+        latency windows, breakers and route stats that steer users' replies,
+        and out of the scheduler's TTS lane, which it only uses while idle.
+        """
+        provider = self.providers[0]
+        if provider.breaker.state != CLOSED:
+            return None, None
+        audio_data = await provider.attempt(text, voice, dict(tags or {}, voice=voice), record=False)
+        return (audio_data, provider.name) if audio_data else (None, None)
+
+    def stats(self):
+        """Return chunk, hedge, failure and win counts plus the breaker states"""
+        with self._stats_lock:
+            snapshot = dict(self._stats, wins=dict(self._wins))
+        snapshot["hedge_rate"] = snapshot["hedged"] / snapshot["chunks"] if snapshot["chunks"] else 0.0
+        snapshot["breakers"] = {provider.name: provider.breaker.state for provider in self.providers}
+        return snapshot
+
+    def _record_route(self, outcome, hedged):
+        winner = outcome.split("_")[0]
+        with self._stats_lock:
+            self._stats["chunks"] += 1
+            self._stats["hedged"] += hedged
+            if winner in self._wins:
+                self._wins[winner] += 1
+            else:
+                self._stats["failed"] += 1
+        stats = self.stats()
+        set_gauge("tts_hedge_rate", stats["hedge_rate"], "Share of TTS chunks that sent a hedge request")
+        for provider in self.providers:
+            set_gauge(f"tts_wins_{provider.name}", stats["wins"][provider.name],
+                      f"TTS chunks won by {provider.name}")
+            set_gauge(f"tts_breaker_{provider.name}", STATE_VALUES[stats["breakers"][provider.name]],
+                      f"{provider.name} circuit breaker (0 closed, 1 half-open, 2 open)")
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_tts_engine():
+    """Return the process-wide TTS engine"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = TTSEngine()
+    return _engine
+
+
+def synthesize_gtts(text, voice):
+    """Synthesize text with gTTS into memory and return the MP3 bytes"""
+    from gtts import gTTS
+
+    # Extract language code from voice (e.g., "en-US-JennyNeural" -> "en")
+    lang_code = voice.split('-')[0] if '-' in voice else 'en'
+    buffer = io.BytesIO()
+    gTTS(text=text, lang=lang_code, slow=False).write_to_fp(buffer)
+    return buffer.getvalue()
+
+
+class SpeechStream:
+    """Synthesizes text that arrives in pieces, such as a streamed model reply
+
+    Text is fed in with feed(); every chunk whose sentences are complete is
+    submitted for synthesis straight away while more text keeps arriving.
+    poll() returns audio that is ready without blocking, and iterating the
+    stream after close() yields the remaining audio in order.
+
+    If a metrics dict is passed it receives the chunk count, the time to first
+    audio and the total synthesis time in seconds, measured from started.
+    tags are attached to the latency spans of every provider attempt.
+
+    If the TTS lane is saturated when the first uncached chunk is ready, the
+    reply is not synthesized at all: shed is set and metrics["tts_shed"] too.
+    Otherwise the reply is admitted and every chunk is queued until it is
+    synthesized, so the reply is spoken in full or not at all.
+    """
+
+    def __init__(self, voice="en-US-JennyNeural", metrics=None, started=None, tags=None):
+        self.voice = voice
+        self.metrics = metrics
+        self.tags = tags
+        self.started = started if started is not None else time.perf_counter()
+        self._text = ""
+        self._closed = False
+        self._pending = []  # [cache key, future or None, audio bytes or None]
+        self._next = 0
+        self._submitted = 0
+        self.shed = False
+        self._cache = get_tts_cache()
+        self._engine = get_tts_engine()
+
+    def feed(self, text):
+        """Add text and submit any chunks that can no longer change"""
+        self._text += text or ""
+        self._submit_ready_chunks()
+
+    def close(self):
+        """Mark the text complete and submit whatever is still buffered"""
+        self._closed = True
+        self._submit_ready_chunks()
+        if self.metrics is not None:
+            self.metrics["tts_chunks"] = len(self._pending)
+
+    def poll(self):
+        """Return, in order, the audio chunks that are ready right now"""
+        parts = []
+        while self._next < len(self._pending):
+            entry = self._pending[self._next]
+            if entry[1] is not None and not entry[1].done():
+                break
+            parts.extend(self._take(entry))
+        return parts
+
+    def __iter__(self):
+        while self._next < len(self._pending):
+            yield from self._take(self._pending[self._next])
+        if self._closed and self.metrics is not None:
+            self.metrics["tts_total"] = time.perf_counter() - self.started
+
+    def _take(self, entry):
+        self._next += 1
+        key, future, audio_data = entry
+        if future is not None:
+            try:
+                audio_data, provider = future.result()
+            except Exception:
+                audio_data, provider = None, None
+            if audio_data and self._engine.cacheable(provider):
+                self._cache.put(key, audio_data)
+        if not audio_data:
+            return []
+        if self.metrics is not None and "time_to_first_audio" not in self.metrics:
+            self.metrics["time_to_first_audio"] = time.perf_counter() - self.started
+        return [audio_data]
+
+    def _speakable_prefix(self):
+        """Return the part of the text made of complete sentences"""
+        if self._closed:
+            return self._text
+        text = self._text
+        # Never cut inside an unfinished code block; it is stripped once closed
+        if text.count("```") % 2:
+            text = text[:text.rindex("```")]
+        end = 0
+        for match in _SENTENCE_END_RE.finditer(text):
+            end = match.end()
+        return text[:end]
+
+    def _submit_ready_chunks(self):
+        chunks = split_into_chunks(strip_markdown(self._speakable_prefix()))
+        # The trailing chunk may still grow unless the text is complete or
+        # it is the first chunk, which is always exactly one sentence
+        final = len(chunks) if self._closed or len(chunks) == 1 else len(chunks) - 1
+        for chunk in chunks[len(self._pending):final]:
+            key = cache_key(chunk, self.voice)
+            cached_audio = self._cache.get(key)
+            if cached_audio:
+                self._pending.append([key, None, cached_audio])
+                continue
+            if not self._submitted and get_scheduler().saturated("tts"):
+                # Degrade instead of queueing a whole reply behind a backlog
+                self.shed = True
+                if self.metrics is not None:
+                    self.metrics["tts_shed"] = True
+            if self.shed:
+                self._pending.append([key, None, None])
+                continue
+            self._submitted += 1
+            future = self._engine.submit(self._engine.synthesize(chunk, self.voice, self.tags, admitted=True))
+            self._pending.append([key, future, None])
+
+
+def stream_tts_audio(text, voice="en-US-JennyNeural", metrics=None, tags=None):
+    """Yield audio bytes for text chunk by chunk, in order, as each becomes ready"""
+    speech = SpeechStream(voice, metrics, tags=tags)
+    speech.feed(text)
+    speech.close()
+    yield from speech
+
+
+def cached_tts_audio(text, voice="en-US-JennyNeural"):
+    """Return the full audio for text if every chunk is already cached, else None"""
+    audio_cache = get_tts_cache()
+    parts = []
+    for chunk in split_into_chunks(strip_markdown(text or "")):
+        audio_data = audio_cache.get(cache_key(chunk, voice))
+        if not audio_data:
+            return None
+        parts.append(audio_data)
+    return b"".join(parts) or None
+
+
+def generate_tts_audio(text, voice="en-US-JennyNeural", metrics=None, tags=None):
+    """Convert text to speech using Edge TTS (with gTTS fallback) and return audio bytes"""
+    if not text or len(text.strip()) == 0:
+        return None
+
+    # MP3 frames can be concatenated, so the chunks join into one playable file
+    audio_data = b"".join(stream_tts_audio(text, voice, metrics, tags))
+    return audio_data or None
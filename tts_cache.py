@@ -0,0 +1,236 @@
+"""Shared, content-addressed cache for synthesized speech audio.
+
+Audio is keyed by a hash of (normalized text, voice, output format) so the
+same reply spoken by the same voice is synthesized once and then reused by
+every Streamlit session. Re-encodings of synthesized audio (see
+audio_formats) are keyed by the source audio's hash and the format, so one
+encoding per format is kept. Entries live in an in-process LRU bounded by a byte
+budget, backed by an on-disk tier that survives restarts. The disk tier
+keeps an in-memory index of its files and sizes, so writes never walk the
+cache directory; once it is over budget it is trimmed down to
+DISK_LOW_WATER of the budget, least recently used files first.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+
+# Edge TTS default output format; part of the key so encodings never mix
+DEFAULT_OUTPUT_FORMAT = "audio-24khz-48kbitrate-mono-mp3"
+
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+DEFAULT_DISK_BYTES = 512 * 1024 * 1024
+DEFAULT_CACHE_DIR = os.path.join(".cache", "tts")
+# Share of the disk budget a trim brings the disk tier down to
+DISK_LOW_WATER = 0.8
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Normalize text so trivially different replies share one cache entry"""
+    text = unicodedata.normalize("NFC", text or "")
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def cache_key(text, voice, output_format=DEFAULT_OUTPUT_FORMAT):
+    """Return the content hash identifying audio for text spoken by voice"""
+    payload = "\x1f".join((normalize_text(text), voice, output_format))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def encoded_key(source, output_format):
+    """Return the key for source audio bytes re-encoded in output_format"""
+    digest = hashlib.sha256(source).hexdigest()
+    return hashlib.sha256(f"{digest}\x1f{output_format}".encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """Two-tier (memory LRU + disk) byte cache with hit/miss/eviction counters"""
+
+    def __init__(self, max_bytes=DEFAULT_MEMORY_BYTES, cache_dir=None,
+                 max_disk_bytes=DEFAULT_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "disk_evictions": 0,
+        }
+        self._disk_index = OrderedDict()  # key -> file size, least recently used first
+        self._disk_size = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            for _, size, key in sorted(self._disk_files()):
+                self._disk_index[key] = size
+                self._disk_size += size
+
+    def get(self, key):
+        """Return cached bytes for key, or None on a miss"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["memory_hits"] += 1
+                return data
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        """Store bytes under key in both tiers"""
+        if not data:
+            return
+        with self._lock:
+            self._remember(key, data)
+        self._write_disk(key, data)
+
+    def __contains__(self, key):
+        with self._lock:
+            if key in self._entries:
+                return True
+        path = self._path(key)
+        return path is not None and os.path.exists(path)
+
+    def stats(self):
+        """Return a snapshot of the cache counters and current sizes"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["memory_entries"] = len(self._entries)
+            snapshot["memory_bytes"] = self._size
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = snapshot["hits"] / lookups if lookups else 0.0
+        return snapshot
+
+    def clear_memory(self):
+        """Drop the in-process tier; the disk tier is left intact"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    # Memory tier (callers hold self._lock)
+    def _remember(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[key] = data
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self._stats["evictions"] += 1
+
+    # Disk tier
+    def _path(self, key):
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # Refresh mtime so eviction after a restart is LRU too
+        except OSError:
+            return None
+        if data:
+            with self._lock:
+                self._index_disk(key, len(data))
+        return data or None
+
+    def _write_disk(self, key, data):
+        path = self._path(key)
+        if path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so readers never see partial audio
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            self._index_disk(key, len(data))
+            over_budget = self.max_disk_bytes and self._disk_size > self.max_disk_bytes
+        if over_budget:
+            self._trim_disk()
+
+    def _disk_files(self):
+        """Return (mtime, size, key) of every file in the disk tier; used once at start-up"""
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.startswith(os.path.basename(root)):
+                    continue  # A temp file left by an interrupted write
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        return files
+
+    def _trim_disk(self):
+        """Delete least recently used files until the tier is at its low-water mark"""
+        target = self.max_disk_bytes * DISK_LOW_WATER
+        evicted = []
+        with self._lock:
+            while self._disk_index and self._disk_size > target:
+                key, size = self._disk_index.popitem(last=False)
+                self._disk_size -= size
+                self._stats["disk_evictions"] += 1
+                evicted.append(key)
+        for key in evicted:
+            try:
+                os.unlink(self._path(key))
+            except OSError:
+                continue
+
+    # Callers hold self._lock
+    def _index_disk(self, key, size):
+        """Record key's file as most recently used; a rewrite replaces its old size"""
+        self._disk_size += size - self._disk_index.pop(key, 0)
+        self._disk_index[key] = size
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """Return the process-wide audio cache, configured from the environment"""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                cache_dir = os.getenv("TTS_CACHE_DIR", DEFAULT_CACHE_DIR)
+                _shared_cache = AudioCache(
+                    max_bytes=int(os.getenv("TTS_CACHE_MAX_BYTES", DEFAULT_MEMORY_BYTES)),
+                    cache_dir=cache_dir or None,
+                    max_disk_bytes=int(os.getenv("TTS_CACHE_DISK_MAX_BYTES", DEFAULT_DISK_BYTES)),
+                )
+    return _shared_cache
@@ -0,0 +1,138 @@
+"""Optional warm-up run once per server process (WARMUP=true).
+
+The first request after a deploy otherwise pays for creating the Gemini
+models, opening the Gemini channel, importing and starting the TTS engine and
+synthesizing phrases that every deployment says again and again. Warm-up
+creates the model of every personality/language pair, synthesizes each
+language's fixed phrases with its voice (which exercises the TTS path end to
+end) and stores them in the shared audio cache, encoded in the output format
+too. Phrases come from FIXED_PHRASES, extended or replaced per language by
+the JSON file named in WARMUP_PHRASES_FILE ({"en": ["...", ...], ...}).
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+# Fixed replies the app speaks itself, by language code
+FIXED_PHRASES = {
+    "greeting": {
+        "en": "Hello! How can I help you today?",
+        "es": "¡Hola! ¿En qué puedo ayudarte hoy?",
+        "fr": "Bonjour ! Comment puis-je vous aider aujourd'hui ?",
+        "zh": "你好！今天我能帮你什么？",
+        "ja": "こんにちは！今日はどのようなご用件でしょうか？",
+    },
+    "error": {
+        "en": "Sorry, something went wrong. Please try again.",
+        "es": "Lo siento, algo salió mal. Por favor, inténtalo de nuevo.",
+        "fr": "Désolé, une erreur s'est produite. Veuillez réessayer.",
+        "zh": "抱歉，出了点问题。请再试一次。",
+        "ja": "申し訳ありません、問題が発生しました。もう一度お試しください。",
+    },
+    "busy": {
+        "en": "The assistant is busy right now. Please try again in a moment.",
+        "es": "El asistente está ocupado en este momento. Por favor, inténtalo de nuevo en un momento.",
+        "fr": "L'assistant est occupé pour le moment. Veuillez réessayer dans un instant.",
+        "zh": "助手现在很忙，请稍后再试。",
+        "ja": "アシスタントは現在混み合っています。しばらくしてからもう一度お試しください。",
+    },
+}
+
+_last_report = {}
+_report_lock = threading.Lock()
+
+
+def warmup_enabled():
+    return os.getenv("WARMUP", "false").lower() in ("1", "true", "yes")
+
+
+def fixed_phrase(kind, language_code):
+    """Return a fixed reply in the given language, falling back to English"""
+    phrases = FIXED_PHRASES[kind]
+    return phrases.get(language_code, phrases["en"])
+
+
+def load_phrases(language_codes):
+    """Return {language code: [phrases]} to pre-render"""
+    phrases = {code: [by_language[code] for by_language in FIXED_PHRASES.values() if code in by_language]
+               for code in language_codes}
+    path = os.getenv("WARMUP_PHRASES_FILE")
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                extra = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not read WARMUP_PHRASES_FILE %s: %s", path, e)
+            extra = {}
+        if not isinstance(extra, dict):
+            logger.warning("WARMUP_PHRASES_FILE %s must hold a JSON object of language code -> phrases", path)
+            extra = {}
+        for code, texts in extra.items():
+            if not isinstance(texts, list):
+                logger.warning("WARMUP_PHRASES_FILE %s: phrases for %s must be a list", path, code)
+                continue
+            phrases.setdefault(code, []).extend(text for text in texts
+                                                if isinstance(text, str) and text not in phrases[code])
+    return phrases
+
+
+def run_warmup(create_model, pairs, voices, phrases, output_format=None, ping=None):
+    """Warm every model, voice and phrase; returns and remembers a report
+
+    create_model(personality, language) is called for each pair, ping() once
+    to open the Gemini channel, and every phrase of phrases[code] is
+    synthesized with voices[code] and encoded in output_format.
+    """
+    from audio_formats import encode_audio
+    from tts import generate_tts_audio
+
+    report = {"models": 0, "voices": 0, "phrases": 0, "failures": 0}
+    started = time.perf_counter()
+    with span("warmup") as stage:
+        for personality, language in pairs:
+            try:
+                create_model(personality, language)
+                report["models"] += 1
+            except Exception as e:
+                report["failures"] += 1
+                logger.warning("Warm-up could not create the %s/%s model: %s", personality, language, e)
+        if ping is not None:
+            try:
+                ping()
+            except Exception as e:
+                report["failures"] += 1
+                logger.warning("Warm-up could not reach Gemini: %s", e)
+
+        for code, voice in voices.items():
+            voiced = False
+            for text in phrases.get(code, []):
+                audio_data = generate_tts_audio(text, voice)
+                if not audio_data:
+                    report["failures"] += 1
+                    continue
+                if output_format is not None:
+                    encode_audio(audio_data, output_format)
+                report["phrases"] += 1
+                voiced = True
+            report["voices"] += voiced
+        if report["failures"]:
+            stage.outcome = "partial"
+    report["seconds"] = time.perf_counter() - started
+    logger.info("Warm-up finished in %.1fs: %d models, %d voices, %d phrases, %d failures",
+                report["seconds"], report["models"], report["voices"], report["phrases"], report["failures"])
+    with _report_lock:
+        _last_report.clear()
+        _last_report.update(report)
+    return report
+
+
+def last_report():
+    """Return the report of this process's warm-up, or {} if none has finished"""
+    with _report_lock:
+        return dict(_last_report)